@@ -2,15 +2,33 @@
 # 必要なモジュールのインポート
 # ================================
 from flask import Flask, render_template, request, redirect, url_for, session  # Flask基本機能
-from db import insert_user, get_connection  # DB処理用関数
+from db import insert_user, get_connection, pool_stats, register_record  # DB処理用関数
 from dotenv import load_dotenv  # .envから環境変数を読み込む
-import bcrypt  # パスワードの暗号化・照合に使用
+from passwords import hash_password, check_password, needs_rehash, HashingBusy  # パスワードの暗号化・照合に使用
 import os  # OS関連操作（環境変数など）
-from openai import OpenAI  # OpenAIクライアント
+from llm import client, generate_assists, stream_assists, extract_code_and_language  # ChatGPT呼び出し用
+from llm_cache import llm_cache  # ChatGPT応答キャッシュ
+from tags import get_tags, notify_tags_changed  # タグ一覧キャッシュ
+from search_cache import (search_cache, notify_records_changed, cached_search_validator,  # 検索結果キャッシュ
+                          SEARCH_CACHE_ENABLED)
+from highlight import ensure_code_html, highlight_code  # コードのハイライト
+from assets import asset_path, send_asset, BUILD_VERSION  # ビルド済みの静的ファイル
+from compression import compress_response  # レスポンスの圧縮
+from bulk_import import import_file  # 一括インポート
+from jobs import enqueue, get_job  # バックグラウンドジョブ
+from export import EXPORT_FORMATS, iter_export, resolve_tag_id, parse_updated_since  # エクスポート
+from search import (search_records, estimate_count, parse_search_args, search_etag,
+                    fetch_record, parse_record_fields, RECORD_LIST_FIELDS)  # アシスト検索
 from datetime import datetime  # 登録日時用
-from flask import flash, get_flashed_messages
+from flask import flash, get_flashed_messages, jsonify, Response, make_response
 from psycopg2.extras import RealDictCursor
+from psycopg2.errors import UniqueViolation  # ワード＋タグの重複（一意制約違反）
 from functools import wraps
+import json  # ストリーミング送信用
+import hmac  # /metrics のトークン比較用
+import orjson  # JSON API の高速なシリアライズ
+import metrics  # 処理時間・DB・ChatGPTの計測
+from slow_queries import slow_query_log  # 遅いクエリの記録
 
 
 # ✅ 管理者専用ページにアクセス制限をかけるデコレーター(※今は管理者がadminのみのため、コレを使わずにlogin()関数内で管理者チェックをしている)
@@ -27,10 +45,9 @@ from functools import wraps
 #     return decorated_function
 
 # ================================
-# 環境変数の読み込みとOpenAI初期化
+# 環境変数の読み込み
 # ================================
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # ================================
 # Flaskアプリの初期化
@@ -42,19 +59,53 @@ app.secret_key = 'your_secret_key'  # セッション管理用（開発用）
 # 許可されたユーザーリスト（管理者 or 特定ユーザー）
 AUTHORIZED_USERS = ['tanobi_test_login', 'admin']
 
+# アシスト生成を確認画面に順次表示するか（0にすると生成完了後に確認画面を表示）
+ASSIST_STREAMING = os.getenv("ASSIST_STREAMING", "1") == "1"
+
+# アシスト生成をジョブキューに積み、worker.py に任せるか（1にするとWebのworkerを占有しない）
+ASSIST_QUEUE = os.getenv("ASSIST_QUEUE", "0") == "1"
+
+# Prometheusから /metrics を取得するときのトークン（Authorization: Bearer <トークン>）
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 
 # ================================
-# コードと言語を抽出する関数
+# リクエストごとの計測（処理時間・DBクエリ数）
 # ================================
-def extract_code_and_language(raw_code):
-    if raw_code.startswith("```"):  # コードが ``` で始まる場合
-        lines = raw_code.strip().split('\n')
-        language = lines[0].replace("```", "").strip() or "plaintext"  # 言語名取得
-        code = '\n'.join(lines[1:-1])  # コード本体
-    else:
-        language = "plaintext"
-        code = raw_code
-    return language, code
+@app.before_request
+def start_metrics():
+    metrics.start_request(request.endpoint)
+
+
+@app.after_request
+def finish_metrics(response):
+    metrics.finish_request(request.method, response.status_code)
+    return response
+
+
+# ================================
+# レスポンスの圧縮（gzip / brotli、compression.py）
+# ================================
+@app.after_request
+def compress_output(response):
+    return compress_response(response)
+
+
+# ================================
+# 静的ファイル（python assets.py build でビルドしたもの）
+# ================================
+# url_for('static', filename='style.css') をハッシュ付きのファイル名に置き換える（未ビルドならそのまま）
+@app.url_defaults
+def hashed_static_filename(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = asset_path(values['filename'])
+
+
+# ハッシュ付きのファイルは内容が変わらないので、圧縮版を長期間キャッシュさせて返す
+@app.route('/static/dist/<path:filename>')
+def static_dist(filename):
+    return send_asset(filename)
+
 
 # ================================
 # ルート（ログイン画面）
@@ -63,19 +114,30 @@ def extract_code_and_language(raw_code):
 def login():
     if request.method == 'POST':
         username = request.form['username']
-        password = request.form['password'].encode('utf-8')
+        password = request.form['password']
 
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-            user = cur.fetchone()
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+                user = cur.fetchone()
 
-            if user and bcrypt.checkpw(password, user['password'].encode('utf-8')):
+            if user and check_password(password, user['password']):
                 session['username'] = username
                 session['is_admin'] = user['is_admin']  # ← 🔥追加！
                 print("userの中身:", user)
 
+                # 🔐 保存済みハッシュのコストが今の設定より低ければ作り直す
+                if needs_rehash(user['password']):
+                    try:
+                        new_hash = hash_password(password)
+                        with get_connection() as conn, conn.cursor() as cur:
+                            # 同時にパスワードが変更されていた場合は上書きしない
+                            cur.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                                        (new_hash, user['id'], user['password']))
+                            conn.commit()
+                    except Exception as e:
+                        print("パスワード再ハッシュエラー:", e)  # ログイン自体は成功扱い
+
                 # 👇 adminユーザーなら /admin に飛ばす
                 if username == 'admin':
                     return redirect(url_for('admin'))
@@ -84,14 +146,13 @@ def login():
 
             return render_template('login.html', error='ユーザー名またはパスワードが違います。')
 
+        except HashingBusy:
+            return render_template('login.html', error='ログインが混み合っています。少し待ってから再度お試しください。')
+
         except Exception as e:
             print("ログインエラー:", e)
             return render_template('login.html', error='ログイン中にエラーが発生しました。')
 
-        finally:
-            cur.close()
-            conn.close()
-
     return render_template('login.html')
 
 # ================================
@@ -102,11 +163,13 @@ def signup():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
         try:
-            insert_user(username, hashed_pw.decode('utf-8'))
+            hashed_pw = hash_password(password)
+            insert_user(username, hashed_pw)
             return render_template('signup.html', success='ユーザー登録が完了しました！ログインしてください。')
+        except HashingBusy:
+            return render_template('signup.html', error='登録が混み合っています。少し待ってから再度お試しください。')
         except Exception as e:
             print("登録エラー:", e)
             return render_template('signup.html', error='このユーザーIDはすでに使われています。')
@@ -156,53 +219,48 @@ def manage_users():
     error = None
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        # 🔍 検索条件の処理（POST時）
-        if request.method == 'POST':
-            keyword = request.form.get('keyword', '').strip()
-            selected_admin = request.form.get('is_admin')
-            match_type = request.form.get('match_type', 'partial')
-
-            where_clauses = []
-            params = []
-
-            # ユーザー名による検索
-            if keyword:
-                op = '=' if match_type == 'exact' else 'ILIKE'
-                pattern = keyword if match_type == 'exact' else f'%{keyword}%'
-                where_clauses.append(f"username {op} %s")
-                params.append(pattern)
-
-            # 管理者フラグによる絞り込み
-            if selected_admin in ('0', '1'):
-                where_clauses.append("is_admin = %s")
-                is_admin_bool = True if selected_admin == '1' else False
-                params.append(is_admin_bool)
-
-            # SQL組み立て
-            sql = "SELECT * FROM users"
-            if where_clauses:
-                sql += " WHERE " + " AND ".join(where_clauses)
-            sql += " ORDER BY id"
-
-            cur.execute(sql, tuple(params))
+        with get_connection() as conn, conn.cursor() as cur:
+
+            # 🔍 検索条件の処理（POST時）
+            if request.method == 'POST':
+                keyword = request.form.get('keyword', '').strip()
+                selected_admin = request.form.get('is_admin')
+                match_type = request.form.get('match_type', 'partial')
+
+                where_clauses = []
+                params = []
+
+                # ユーザー名による検索
+                if keyword:
+                    op = '=' if match_type == 'exact' else 'ILIKE'
+                    pattern = keyword if match_type == 'exact' else f'%{keyword}%'
+                    where_clauses.append(f"username {op} %s")
+                    params.append(pattern)
+
+                # 管理者フラグによる絞り込み
+                if selected_admin in ('0', '1'):
+                    where_clauses.append("is_admin = %s")
+                    is_admin_bool = True if selected_admin == '1' else False
+                    params.append(is_admin_bool)
+
+                # SQL組み立て
+                sql = "SELECT * FROM users"
+                if where_clauses:
+                    sql += " WHERE " + " AND ".join(where_clauses)
+                sql += " ORDER BY id"
+
+                cur.execute(sql, tuple(params))
 
-        else:
-            # GET時はすべて表示
-            cur.execute("SELECT * FROM users ORDER BY id")
+            else:
+                # GET時はすべて表示
+                cur.execute("SELECT * FROM users ORDER BY id")
 
-        users = cur.fetchall()
+            users = cur.fetchall()
 
     except Exception as e:
         print("ユーザー検索エラー:", e)
         error = "ユーザー一覧の取得中にエラーが発生しました。"
 
-    finally:
-        cur.close()
-        conn.close()
-
     return render_template("admin_users.html",
                            users=users,
                            error=error,
@@ -223,48 +281,43 @@ def manage_tags():
     error = None
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()  # RealDictCursor は使わない！
-
-        # 🔍 検索条件の処理（POST時）
-        if request.method == 'POST':
-            keyword = request.form.get('keyword', '').strip()
-            match_type = request.form.get('match_type', 'partial')
-
-            where_clauses = []
-            params = []
-
-            # 〇〇で検索（大文字小文字を区別しない）
-            if keyword:
-                if match_type == 'exact':
-                    where_clauses.append("LOWER(name) = LOWER(%s)")
-                    params.append(keyword)
-                else:
-                    where_clauses.append("name ILIKE %s")
-                    params.append(f'%{keyword}%')
-
-            sql = "SELECT * FROM tag"
+        with get_connection() as conn, conn.cursor() as cur:  # RealDictCursor は使わない！
+
+            # 🔍 検索条件の処理（POST時）
+            if request.method == 'POST':
+                keyword = request.form.get('keyword', '').strip()
+                match_type = request.form.get('match_type', 'partial')
+
+                where_clauses = []
+                params = []
+
+                # 〇〇で検索（大文字小文字を区別しない）
+                if keyword:
+                    if match_type == 'exact':
+                        where_clauses.append("LOWER(name) = LOWER(%s)")
+                        params.append(keyword)
+                    else:
+                        where_clauses.append("name ILIKE %s")
+                        params.append(f'%{keyword}%')
+
+                sql = "SELECT * FROM tag"
             
-            if where_clauses:
-                sql += " WHERE " + " AND ".join(where_clauses)
-            sql += " ORDER BY id"
+                if where_clauses:
+                    sql += " WHERE " + " AND ".join(where_clauses)
+                sql += " ORDER BY id"
 
-            cur.execute(sql, tuple(params))
+                cur.execute(sql, tuple(params))
 
-        else:
-            # GET時はすべて表示
-            cur.execute("SELECT * FROM tag ORDER BY id")
+            else:
+                # GET時はすべて表示
+                cur.execute("SELECT * FROM tag ORDER BY id")
         
-        tags = cur.fetchall()
+            tags = cur.fetchall()
 
     except Exception as e:
         print("タグ検索エラー:", e)
         error = "タグ一覧の取得中にエラーが発生しました。"
 
-    finally:
-        cur.close()
-        conn.close()
-
     return render_template("admin_tags.html",
                            tags=tags,
                            error=error,
@@ -281,12 +334,10 @@ def manage_tags():
 def assist_register():
 
     try:
-        # ✅ tagテーブルからタグ一覧を取得
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name FROM tag ORDER BY id")
-        tag_list = cur.fetchall()  # [(1, 'Python'), (2, 'Flask'), ...] のようなリストになる
-        tag_dict = {str(row['id']): row['name'] for row in tag_list}  # 🔸IDと名前の辞書を作成
+        # ✅ タグ一覧を取得（キャッシュ済みならDBにはアクセスしない）
+        tags = get_tags()
+        tag_list = tags['tag_list']  # [{'id': 1, 'name': 'Python'}, ...] のようなリストになる
+        tag_dict = tags['by_id']  # 🔸IDと名前の辞書
 
         # セッションに保存されていたタグ名があれば取り出す
         tag_name = session.pop("last_tag_name", None)
@@ -305,6 +356,7 @@ def assist_register():
         tag = request.form.get('tag')
         assist_summary = 'assist_summary' in request.form
         assist_code = 'assist_code' in request.form
+        force_regenerate = 'force_regenerate' in request.form  # キャッシュを使わずに作り直すか
 
         if not word or not details or not tag:
             error = 'すべての項目を入力・選択してください。'
@@ -320,60 +372,84 @@ def assist_register():
             # ✅ tag_idからtag_nameを取得（ここでしか使わないので辞書から直接取得）
             tag_name = tag_dict.get(tag, "未設定")
 
-            try:
-                # ChatGPTで要約を生成
-                if assist_summary:
-                    summary_prompt = f"""
-    以下のワードに対して、学習者が一目で理解できるような超簡潔な説明を作ってください（30文字以内）。
-    ワード: {word}
-    説明: {details}
-    """
-                    summary_response = client.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": "あなたは要点を簡潔に伝える教育アシスタントです。"},
-                            {"role": "user", "content": summary_prompt}
-                        ]
-                    )
-                    summary_result = summary_response.choices[0].message.content.strip()
-
-                # ChatGPTでコードを生成
-                if assist_code:
-                    code_prompt = f"""
-    以下のワードに関連した実用的なコードを1つだけ提案してください。
-    ワード: {word}
-    説明: {details}
-    タグ: {tag}
-    ワード: {word}
-    説明: {details}
-    上記に関連する{tag}言語のコードを1つ提案してください。Markdown形式でコードのみを表示してください。
-    """
-                    code_response = client.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": "あなたは優秀なプログラミング教師です。"},
-                            {"role": "user", "content": code_prompt}
-                        ]
-                    )
-                    raw_code = code_response.choices[0].message.content.strip()
-
-                    # 言語名とコード本文を分離
-                    code_language, code_result = extract_code_and_language(raw_code)
-
-                # 確認画面にデータを渡す
+            # キューモード：生成はworkerに任せ、確認画面はジョブの完了を待って結果を受け取る
+            if ASSIST_QUEUE and (assist_summary or assist_code):
+                try:
+                    with get_connection() as conn, conn.cursor() as cur:
+                        job_id = enqueue(cur, 'assist_generate', {
+                            'username': session.get('username'),
+                            'word': word,
+                            'details': details,
+                            'tag': tag,
+                            'summary': assist_summary,
+                            'code': assist_code,
+                            'bypass_cache': force_regenerate,
+                        })
+                        conn.commit()
+                except Exception as e:
+                    print("ジョブ登録エラー:", e)
+                    error = 'アシスト生成の受付に失敗しました。しばらくしてからやり直してください。'
+                    return render_template('assist_register.html', error=error, tag_list=tag_list)
+
                 return render_template('assist_confirm.html',
+                                    job_id=job_id,
                                     word=word,
                                     details=details,
-                                    tag=tag,  # 🔥 これが必要！
+                                    tag=tag,
                                     tag_name=tag_name,
-                                    summary_result=summary_result,
-                                    code_result=code_result,
-                                    code_language=code_language)
+                                    assist_summary=assist_summary,
+                                    assist_code=assist_code)
 
-            except Exception as e:
-                print("ChatGPT APIエラー:", e)
-                error = f'ChatGPTとの通信に失敗しました。\n{e}'
+            # ストリーミングモード：確認画面をすぐに表示し、生成結果はブラウザが順次受け取る
+            if ASSIST_STREAMING and (assist_summary or assist_code):
+                return render_template('assist_confirm.html',
+                                    streaming=True,
+                                    word=word,
+                                    details=details,
+                                    tag=tag,
+                                    tag_name=tag_name,
+                                    assist_summary=assist_summary,
+                                    assist_code=assist_code,
+                                    force_regenerate=force_regenerate)
+
+            # ChatGPTで要約とコードを同時に生成（片方が失敗してももう片方は使う）
+            results, errors = generate_assists(word, details, tag,
+                                               summary=assist_summary,
+                                               code=assist_code,
+                                               bypass_cache=force_regenerate)
+            for name, e in errors.items():
+                print(f"ChatGPT APIエラー（{name}）:", e)
+
+            if errors and not results:
+                # すべて失敗した場合は登録画面に戻す
+                error = f'ChatGPTとの通信に失敗しました。\n{next(iter(errors.values()))}'
                 return render_template('assist_register.html', error=error, tag_list=tag_list)
+
+            summary_result = results.get('summary', '')
+
+            if 'code' in results:
+                # 言語名とコード本文を分離
+                code_language, code_result = extract_code_and_language(results['code'])
+
+            # 一部だけ失敗した場合は確認画面にエラーを表示する
+            error = None
+            if errors:
+                labels = {'summary': '説明', 'code': 'コード'}
+                failed = '・'.join(labels[name] for name in errors)
+                error = f'{failed}のアシスト生成に失敗しました。必要なら登録フォームからやり直してください。'
+
+            # 確認画面にデータを渡す
+            return render_template('assist_confirm.html',
+                                word=word,
+                                details=details,
+                                tag=tag,  # 🔥 これが必要！
+                                tag_name=tag_name,
+                                summary_result=summary_result,
+                                code_result=code_result,
+                                code_language=code_language,
+                                code_html=highlight_code(code_result, code_language),
+                                error=error)
+
         else:
             # ❌ ボタンが違う or フォーム再送信された場合は登録画面に戻す
             return render_template('assist_register.html', tag_list=tag_list)
@@ -385,6 +461,69 @@ def assist_register():
     messages = get_flashed_messages(with_categories=True)
     return render_template('assist_register.html', tag_list=tag_list, messages=messages)
 
+# ================================
+# アシスト生成のストリーミング（Server-Sent Events）
+# ================================
+@app.route('/assist_register/stream', methods=['POST'])
+def assist_register_stream():
+    word = request.form.get('word')
+    details = request.form.get('details')
+    tag = request.form.get('tag')
+    assist_summary = 'assist_summary' in request.form
+    assist_code = 'assist_code' in request.form
+    force_regenerate = 'force_regenerate' in request.form
+
+    if not word or not details or not tag:
+        return "すべての項目を入力・選択してください。", 400
+
+    def generate():
+        # 送信するイベント名： summary-delta / summary-done / summary-error / code-… / end
+        for name, event, data in stream_assists(word, details, tag,
+                                                summary=assist_summary,
+                                                code=assist_code,
+                                                bypass_cache=force_regenerate):
+            if name == 'code' and event == 'done':
+                # 最終的なコードは言語名とコード本文に分離してから送る
+                code_language, code_result = extract_code_and_language(data)
+                payload = {'language': code_language, 'code': code_result,
+                           'html': highlight_code(code_result, code_language)}
+            else:
+                if event == 'error':
+                    print(f"ChatGPT APIエラー（{name}）:", data)
+                payload = {'text': data}
+            yield f"event: {name}-{event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+    return Response(generate(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# ================================
+# アシスト生成ジョブの状態（確認画面から定期的に問い合わせる）
+# ================================
+@app.route('/assist_register/jobs/<int:job_id>')
+def assist_job_status(job_id):
+    try:
+        job = get_job(job_id)
+    except Exception as e:
+        print("ジョブ取得エラー:", e)
+        return jsonify({'error': 'ジョブの状態を取得できませんでした。'}), 503
+
+    # 他のユーザーが登録したジョブは見せない
+    if job is None or job['payload'].get('username') != session.get('username'):
+        return jsonify({'error': 'ジョブが見つかりません。'}), 404
+
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'],
+        'result': job['result'],
+        'error': job['last_error'] if job['status'] == 'dead' else None,
+    })
+
+
 # ================================
 # 登録確定 → DB保存（重複チェック付き）
 # ================================
@@ -411,45 +550,23 @@ def assist_register_confirm():
     # 登録日時（created_at）と更新日時（updated_at）を現在時刻で設定
     now = datetime.now()
 
-    conn = None  # ← 🔥 追加（初期化）
-    cur = None   # ← 🔥 追加（初期化）
-
     try:
         # PostgreSQLへ接続
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
+
+            # ▼▼▼ 登録処理（重複チェックとタグ名の取得も同じ1文で行う） ▼▼▼
+            inserted = register_record(cur, word, details, tag, summary, code, code_language, now)
+            if inserted is not None:
+                notify_records_changed(cur)  # 全workerの検索結果キャッシュを無効化
 
-        # ▼▼▼ 既存データとの重複チェックを追加 ▼▼▼
-        cur.execute("""
-            SELECT * FROM records
-            WHERE word = %s AND tag_id = %s
-        """, (word, tag))
-        existing = cur.fetchone()
+            conn.commit()  # 変更を確定
 
-        if existing:
+        if inserted is None:
             # 同じワード＋タグの組み合わせがすでに存在する場合はエラー
             flash("⚠️ このワードとタグの組み合わせはすでに登録されています。", "error")
             return redirect(url_for('assist_register'))
 
-        # ▼▼▼ 登録処理（INSERT） ▼▼▼
-        cur.execute("""
-            INSERT INTO records (word, details, tag_id, summary_result, code_result, code_language, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (word, details, tag, summary, code, code_language, now, now))
-
-        conn.commit()  # 変更を確定
-
-        # タグ名を取得（tag ID から name を取得）
-        cur.execute("SELECT name FROM tag WHERE id = %s", (tag,))
-        tag_name_row = cur.fetchone()
-        print("🛠️ tag_name_row の中身:", tag_name_row)  # ← 追加！
-
-        if tag_name_row and 'name' in tag_name_row:
-            tag_name = tag_name_row['name']
-            session["last_tag_name"] = tag_name # ← タグ名だけ保存しておく
-            print("✅ タグ名取得成功:", tag_name)
-        else:
-            print("❌ タグ名の取得に失敗しました")
+        session["last_tag_name"] = inserted['tag_name'] # ← タグ名だけ保存しておく
 
         # 成功メッセージを表示
         flash("✅ 登録が完了しました！", "success")
@@ -463,13 +580,6 @@ def assist_register_confirm():
         flash(error_message, "error") 
         return redirect(url_for('assist_register'))
 
-    finally:
-        # 安全にクローズ（Noneチェック）
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
 
 # ================================
 # アシスト検索処理
@@ -478,186 +588,229 @@ def assist_register_confirm():
 def assist_search():
     # tag_list = ['Python', 'Flask', 'SQL', 'HTML', 'JavaScript']  # タグの選択肢リスト
 
-    try:
-        # ✅ tagテーブルから全タグ取得
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name FROM tag ORDER BY id")
-        tag_list = cur.fetchall()  # 例: [(1, 'Python'), (2, 'Flask'), ...]
-        tag_dict = {str(row['id']): row['name'] for row in tag_list}  # 🔸id→name辞書を作成
-
-    except Exception as e:
-        print("タグ取得エラー:", e)
-        tag_list = []
-        tag_dict = {}
+    # 🔁 以前のフォーム（POST）からの検索は、同じ条件のGETに付け替える
+    #    （検索条件がURLに載るので、戻るボタンで再送信にならず、ブラウザ・プロキシで再検証できる）
+    if request.method == 'POST':
+        return redirect(url_for('assist_search', **request.form.to_dict()), code=303)
 
+    tag_list = []  # タグの選択肢リスト
+    tag_dict = {}  # id→name辞書
     results = []  # 検索結果を格納するリスト
     no_result = False  # 結果が見つからなかったときに表示するフラグ
+    next_cursor = None  # 次のページのカーソル
+    prev_cursor = None  # 前のページのカーソル
+    approx_total = None  # 該当件数の概算（チェックされたときのみ）
+    etag = None  # 検索結果の ETag（検索したときのみ）
+    last_modified = None  # 該当レコードの最終更新日時
 
-    # 🔍 検索フォームの内容を取得
-    if request.method == 'POST':
-        keyword = request.form.get('keyword')  # 検索キーワード
-        match_type = request.form.get('match_type')  # 完全一致 or 部分一致
-        search_word = 'search_word' in request.form  # ワードも検索対象か
-        search_details = 'search_details' in request.form  # 説明も検索対象か
-        search_assist = 'search_assist' in request.form  # アシストも検索対象か
-        search_code = 'search_code' in request.form  # ← アシストコードも検索対象か
-        selected_tag = request.form.get('tag')  # タグによる絞り込み
+    try:
+        # ✅ タグ一覧を取得（キャッシュ済みならDBにはアクセスしない）
+        tags = get_tags()
+        tag_list = tags['tag_list']  # 例: [{'id': 1, 'name': 'Python'}, ...]
+        tag_dict = tags['by_id']  # 🔸id→name辞書
+
+        # 🔍 検索条件（クエリ文字列）があれば検索する
+        if request.args:
+            params = parse_search_args(request.args)  # キーワード・一致方法・項目・タグ・ページ送り
+            keyword, match_type, fields, tag_id = (params['keyword'], params['match_type'],
+                                                   params['fields'], params['tag_id'])
+            page_size, cursor, direction = params['page_size'], params['cursor'], params['direction']
+            with_count = 'with_count' in request.args  # 件数の概算も表示するか
+
+            filter_key = search_cache.make_key(keyword, match_type, fields, tag_id,
+                                               page_size, cursor, direction, with_count)
+
+            with get_connection() as conn, conn.cursor() as cur:
+                # 該当レコードの件数と最終更新日時（キャッシュ済みならDBは見ない）で、変わっていなければ 304 を返す
+                count, last_modified = cached_search_validator(cur, keyword, match_type, fields, tag_id)
+                etag = search_etag(filter_key, count, last_modified, tag_dict, BUILD_VERSION)
+
+                # 表示待ちのフラッシュメッセージがあるときは、ページを作り直して表示する
+                if request.if_none_match.contains_weak(etag) and not session.get('_flashes'):
+                    response = Response(status=304)
+                    response.set_etag(etag, weak=True)
+                    response.headers['Cache-Control'] = 'no-cache'
+                    return response
+
+                # 同じ条件の検索結果がキャッシュにあれば検索クエリは実行しない
+                cached = search_cache.get(filter_key) if SEARCH_CACHE_ENABLED else None
+
+                if cached is not None:
+                    results, next_cursor, prev_cursor, approx_total = cached
+                else:
+                    generation = search_cache.generation()
 
-        try:
-            conn = get_connection()
-            cur = conn.cursor()
-
-            # 検索条件のリストとパラメータを準備
-            where_clauses = []
-            params = []
-
-            # タグの絞り込み
-            if selected_tag:
-                where_clauses.append("records.tag_id = %s")
-                params.append(int(selected_tag)) # 🔄 数値に変換
-
-            # キーワードの検索対象を構築
-            if keyword:
-                match_op = "=" if match_type == "exact" else "ILIKE"
-                keyword_pattern = keyword if match_type == "exact" else f"%{keyword}%"
-
-                # 検索対象カラムの構築
-                keyword_clauses = []
-                if search_word:
-                    keyword_clauses.append(f"word {match_op} %s")
-                    params.append(keyword_pattern)
-                if search_details:
-                    keyword_clauses.append(f"details {match_op} %s")
-                    params.append(keyword_pattern)
-                if search_assist:
-                    keyword_clauses.append(f"summary_result {match_op} %s")
-                    params.append(keyword_pattern)
-                if search_code:
-                    keyword_clauses.append(f"code_result {match_op} %s")
-                    params.append(keyword_pattern)
-
-                 # 🔽 チェックが一つも入っていなかったら、全対象に対して検索するように変更！
-                if not keyword_clauses:
-                    keyword_clauses.append(f"word {match_op} %s")
-                    keyword_clauses.append(f"details {match_op} %s")
-                    keyword_clauses.append(f"summary_result {match_op} %s")
-                    keyword_clauses.append(f"code_result {match_op} %s")
-                    # パラメータは4つ必要になる
-                    params.extend([keyword_pattern] * 4)
-
-                 # OR 条件でまとめる
-                where_clauses.append(f"({' OR '.join(keyword_clauses)})")
-
-                # # OR 条件でまとめる
-                # if keyword_clauses:
-                #     where_clauses.append(f"({' OR '.join(keyword_clauses)})")
-
-            # WHERE句を組み立て
-            where_sql = " AND ".join(where_clauses)
-            sql = """
-                SELECT records.*, tag.name AS tag_name
-                FROM records
-                JOIN tag ON records.tag_id = tag.id
-            """
-            if where_sql:
-                sql += f" WHERE {where_sql}"
-            sql += " ORDER BY created_at DESC"  # 新しい順に並べる
-
-            # SQL実行
-            cur.execute(sql, tuple(params))
-            results = cur.fetchall()
+                    # 全文検索・トライグラムインデックスを使って1ページ分だけ検索（関連度順）
+                    results, next_cursor, prev_cursor = search_records(
+                        cur, keyword, match_type, fields, tag_id,
+                        page_size=page_size, cursor=cursor, direction=direction)
+                    # ハイライトが未作成（コード変更直後・移行前のデータ）の行はその場で作る
+                    ensure_code_html(results)
+
+                    # 件数の概算（実行計画の見積もりなので全件は数えない）
+                    if with_count:
+                        approx_total = estimate_count(cur, keyword, match_type, fields, tag_id)
+
+                    if SEARCH_CACHE_ENABLED:
+                        search_cache.set(filter_key, (results, next_cursor, prev_cursor, approx_total),
+                                         generation)
 
             # 検索結果が0件ならフラグを立てる
             if not results:
                 no_result = True
 
-        except Exception as e:
-            print("検索処理エラー:", e)
-            return render_template("assist_search.html",
-                                   error="検索中にエラーが発生しました。",
-                                   tag_list=tag_list,
-                                   tag_dict=tag_dict)
-
-        finally:
-            cur.close()
-            conn.close()
-
-    # ページを表示（GET or POST）
-    return render_template("assist_search.html",
-                           tag_list=tag_list,
-                           tag_dict=tag_dict,
-                           results=results,
-                           no_result=no_result)
+    except Exception as e:
+        print("検索処理エラー:", e)
+        return render_template("assist_search.html",
+                               error="検索中にエラーが発生しました。",
+                               tag_list=tag_list,
+                               tag_dict=tag_dict)
+
+    # ページを表示（検索条件なし or 検索結果）
+    response = make_response(render_template("assist_search.html",
+                                              tag_list=tag_list,
+                                              tag_dict=tag_dict,
+                                              results=results,
+                                              no_result=no_result,
+                                              next_cursor=next_cursor,
+                                              prev_cursor=prev_cursor,
+                                              approx_total=approx_total))
+    if etag is not None:
+        # キャッシュしてよいが、使う前に必ず再検証してもらう
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        if last_modified is not None:
+            response.last_modified = last_modified
+    return response
 
 # ================================
-# # 編集ページ（GET: 表示 / POST: 更新処理）
+# アシストデータのJSON API
 # ================================
-@app.route('/assist_edit/<int:record_id>', methods=['GET', 'POST'])
-def assist_edit(record_id):
+# 検索ページと同じ条件（keyword / match_type / search_* / tag / page_size / cursor / direction）で絞り込み、
+# fields=id,word,tag_name のように返す項目を選べる（一覧の既定は大きい details・code_result を含めない）。
+def _json_response(payload, status=200):
+    return Response(orjson.dumps(payload), status=status, content_type='application/json')
+
+
+@app.route('/api/records')
+def api_records():
+    if not session.get('username'):
+        return _json_response({'error': 'ログインしてください。'}, 401)
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()  # ✅ RealDictCursorは使わず、登録画面と同じにする
+        columns = parse_record_fields(request.args.get('fields'), RECORD_LIST_FIELDS)
+        params = parse_search_args(request.args)
+    except ValueError as e:
+        return _json_response({'error': str(e)}, 400)
 
-        # ✅ tagテーブルからタグ一覧を取得（登録画面と同じ方法）
-        cur.execute("SELECT id, name FROM tag ORDER BY id")
-        tag_list = cur.fetchall()
+    try:
+        tag_dict = get_tags()['by_id']  # 接続を借りる前に取る（キャッシュが空のときに2本目の接続を使わない）
+
+        with get_connection() as conn, conn.cursor() as cur:
+            # 検索ページと同じく、変わっていなければ結果を作らずに 304 を返す
+            count, last_modified = cached_search_validator(cur, params['keyword'], params['match_type'],
+                                                           params['fields'], params['tag_id'])
+            filter_key = search_cache.make_key(params['keyword'], params['match_type'], params['fields'],
+                                               params['tag_id'], params['page_size'], params['cursor'],
+                                               params['direction'], False) + (tuple(columns),)
+            etag = search_etag(filter_key, count, last_modified, tag_dict, BUILD_VERSION)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                rows, next_cursor, prev_cursor = search_records(cur, columns=columns, **params)
+                if 'code_html' in columns:
+                    ensure_code_html(rows)  # トリガーで NULL に戻ったものはその場でハイライト
+                response = _json_response({
+                    'records': [{name: row[name] for name in columns} for row in rows],
+                    'next_cursor': next_cursor,
+                    'prev_cursor': prev_cursor,
+                })
+    except Exception as e:
+        print("API検索エラー:", e)
+        return _json_response({'error': '検索中にエラーが発生しました。'}, 500)
 
-        if request.method == 'POST':
-            # フォームから新しいデータを受け取る
-            new_word = request.form.get('word')
-            new_details = request.form.get('details')
-            new_tag_id = request.form.get('tag')  # tagはidとして受け取る（str）
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
 
-            # 編集時の重複チェック
-            cur.execute("""
-                SELECT * FROM records 
-                WHERE word = %s AND tag_id = %s AND id != %s
-            """, (new_word, new_tag_id, record_id))
 
-            existing = cur.fetchone()
+@app.route('/api/records/<int:record_id>')
+def api_record(record_id):
+    if not session.get('username'):
+        return _json_response({'error': 'ログインしてください。'}, 401)
 
-            if existing:
+    try:
+        columns = parse_record_fields(request.args.get('fields'))
+    except ValueError as e:
+        return _json_response({'error': str(e)}, 400)
 
-                # ✅ flashメッセージとリダイレクト（登録画面と完全一致）
-                flash("⚠️ このワードとタグの組み合わせはすでに登録されています。", "error")
-                return redirect(url_for('assist_edit', record_id=record_id))
-                
-                # # 編集対象のデータも再取得
-                # cur.execute("SELECT * FROM records WHERE id = %s", (record_id,))
-                # record = cur.fetchone()
+    try:
+        with get_connection() as conn, conn.cursor() as cur:
+            row = fetch_record(cur, record_id, columns)
+    except Exception as e:
+        print("API取得エラー:", e)
+        return _json_response({'error': '取得中にエラーが発生しました。'}, 500)
 
-                # return render_template("assist_edit.html", record=record, tag_list=tag_list, error=error)
+    if row is None:
+        return _json_response({'error': f"ID {record_id} のデータが見つかりませんでした。"}, 404)
+    if 'code_html' in columns:
+        ensure_code_html([row])
+    return _json_response({name: row[name] for name in columns})
 
 
-            # 更新時刻を記録（更新対象フィールドは word, details, tag, updated_at）
-            from datetime import datetime
-            updated_at = datetime.now()
+# ================================
+# # 編集ページ（GET: 表示 / POST: 更新処理）
+# ================================
+@app.route('/assist_edit/<int:record_id>', methods=['GET', 'POST'])
+def assist_edit(record_id):
 
-            # SQLで更新
-            cur.execute("""
-                UPDATE records
-                SET word = %s, details = %s, tag_id = %s, updated_at = %s
-                WHERE id = %s
-            """, (new_word, new_details, int(new_tag_id), updated_at, record_id))
+    try:
+        # ✅ タグ一覧を取得（登録画面と同じくキャッシュから。接続を借りる前に取る）
+        tag_list = get_tags()['tag_list']
 
-            conn.commit()
+        with get_connection() as conn, conn.cursor() as cur:  # ✅ RealDictCursorは使わず、登録画面と同じにする
 
-            # 更新後、検索結果ページへリダイレクト
-            # return redirect(url_for('assist_search'))
-            flash("✅ 更新登録が完了しました！", "success")
-            return redirect(url_for('assist_search'))
+            if request.method == 'POST':
+                # フォームから新しいデータを受け取る
+                new_word = request.form.get('word')
+                new_details = request.form.get('details')
+                new_tag_id = request.form.get('tag')  # tagはidとして受け取る（str）
 
-        else:
-            # 編集対象のレコードを取得してフォームに表示（GET時）
-            cur.execute("SELECT * FROM records WHERE id = %s", (record_id,))
-            record = cur.fetchone()
+                # 更新時刻を記録（更新対象フィールドは word, details, tag, updated_at）
+                updated_at = datetime.now()
 
-            if not record:
-                return f"ID {record_id} のデータが見つかりませんでした。", 404
+                # SQLで更新（重複は事前に調べず、一意制約の違反で判定する）
+                try:
+                    cur.execute("""
+                        UPDATE records
+                        SET word = %s, details = %s, tag_id = %s, updated_at = %s
+                        WHERE id = %s
+                    """, (new_word, new_details, int(new_tag_id), updated_at, record_id))
+                    notify_records_changed(cur)  # 全workerの検索結果キャッシュを無効化
+                    conn.commit()
+                except UniqueViolation:
+                    conn.rollback()
+
+                    # ✅ flashメッセージとリダイレクト（登録画面と完全一致）
+                    flash("⚠️ このワードとタグの組み合わせはすでに登録されています。", "error")
+                    return redirect(url_for('assist_edit', record_id=record_id))
+
+                # 更新後、検索結果ページへリダイレクト
+                # return redirect(url_for('assist_search'))
+                flash("✅ 更新登録が完了しました！", "success")
+                return redirect(url_for('assist_search'))
+
+            else:
+                # 編集対象のレコードを取得してフォームに表示（GET時）
+                cur.execute("SELECT * FROM records WHERE id = %s", (record_id,))
+                record = cur.fetchone()
 
-            return render_template("assist_edit.html", record=record, tag_list=tag_list)
+                if not record:
+                    return f"ID {record_id} のデータが見つかりませんでした。", 404
+
+                return render_template("assist_edit.html", record=record, tag_list=tag_list)
 
     except Exception as e:
         # ✅ 予期しないエラーをflashしてリダイレクト（登録画面と同じ）
@@ -665,10 +818,6 @@ def assist_edit(record_id):
         flash(error_message, "error")
         return redirect(url_for('assist_edit', record_id=record_id))
 
-    finally:
-        cur.close()
-        conn.close()
-
 
 # ================================
 # データー一覧（削除）
@@ -676,21 +825,17 @@ def assist_edit(record_id):
 @app.route('/assist/delete/<int:record_id>', methods=['POST'])
 def assist_delete(record_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # 該当レコードを削除
-        cur.execute("DELETE FROM records WHERE id = %s", (record_id,))
-        conn.commit()
+            # 該当レコードを削除
+            cur.execute("DELETE FROM records WHERE id = %s", (record_id,))
+            notify_records_changed(cur)  # 全workerの検索結果キャッシュを無効化
+            conn.commit()
 
-        flash("削除が完了しました。", "success")
+            flash("削除が完了しました。", "success")
     except Exception as e:
         print("削除エラー:", e)
         flash("削除中にエラーが発生しました。", "danger")
-    finally:
-        cur.close()
-        conn.close()
-
     return redirect(url_for('assist_search'))
 
 
@@ -701,23 +846,18 @@ def assist_delete(record_id):
 @app.route('/admin/users')
 def admin_users():
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # ユーザー全件取得
-        cur.execute("SELECT id, username, password, is_admin FROM users ORDER BY id")
-        users = cur.fetchall()
+            # ユーザー全件取得
+            cur.execute("SELECT id, username, password, is_admin FROM users ORDER BY id")
+            users = cur.fetchall()
 
-        return render_template('admin_users.html', users=users)
+            return render_template('admin_users.html', users=users)
 
     except Exception as e:
         print("ユーザー一覧取得エラー:", e)
         return render_template('admin_users.html', error='ユーザー情報の取得中にエラーが発生しました。')
 
-    finally:
-        cur.close()
-        conn.close()
-
 
 # ================================
 # 🔸 新規ユーザー登録ページを表示するルート
@@ -738,47 +878,41 @@ def add_user():
             error = "すべての項目を正しく入力してください。"
         else:
             try:
-                conn = get_connection()
-                cur = conn.cursor()
+                with get_connection() as conn, conn.cursor() as cur:
 
-                # 🔸 同じユーザー名が既に存在するかチェック
-                cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-                existing_user = cur.fetchone()
+                    # 🔸 同じユーザー名が既に存在するかチェック
+                    cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+                    existing_user = cur.fetchone()
 
-                if existing_user:
-                    error = "このユーザー名はすでに使用されています。"
-                else:
+                    if existing_user:
+                        error = "このユーザー名はすでに使用されています。"
+                    else:
 
-                    # ✅ パスワードをハッシュ化（bcrypt）
-                    hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-                    hashed_pw_str = hashed_pw.decode('utf-8')  # PostgreSQLに文字列として保存
+                        # ✅ パスワードをハッシュ化（bcrypt）
+                        hashed_pw_str = hash_password(password)  # PostgreSQLに文字列として保存
 
-                    # 🔸 INSERTで登録
-                    cur.execute("""
-                        INSERT INTO users (username, password, is_admin)
-                        VALUES (%s, %s, %s)
-                    """, (username, hashed_pw_str, bool(int(is_admin))))
+                        # 🔸 INSERTで登録
+                        cur.execute("""
+                            INSERT INTO users (username, password, is_admin)
+                            VALUES (%s, %s, %s)
+                        """, (username, hashed_pw_str, bool(int(is_admin))))
 
-                    conn.commit()
+                        conn.commit()
 
-                    # 登録成功後
-                    flash("✅ ユーザーの登録が完了しました！")
-                    return redirect(url_for('manage_users'))
+                        # 登録成功後
+                        flash("✅ ユーザーの登録が完了しました！")
+                        return redirect(url_for('manage_users'))
 
-                    # フォームの入力をクリアしたい場合はここでリダイレクトしてもOK
-                    # return redirect(url_for('manage_users'))
+                        # フォームの入力をクリアしたい場合はここでリダイレクトしてもOK
+                        # return redirect(url_for('manage_users'))
+
+            except HashingBusy:
+                error = "パスワード処理が混み合っています。少し待ってから再度お試しください。"
 
             except Exception as e:
                 print("ユーザー登録エラー:", e)
                 error = "登録中にエラーが発生しました。"
 
-            finally:
-                # 安全にクローズ（存在確認）
-                if cur:
-                    cur.close()
-                if conn:
-                    conn.close()
-
     # GET または エラー時はフォーム再表示
     return render_template("admin_users_add.html", error=error, message=message)
 
@@ -789,71 +923,66 @@ def add_user():
 @app.route('/admin/users/edit/<int:user_id>', methods=['GET', 'POST'])
 def edit_user(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # GET: 編集対象のユーザー情報を取得
-        if request.method == 'GET':
-            cur.execute("SELECT id, username, is_admin FROM users WHERE id = %s", (user_id,))
-            user = cur.fetchone()
+            # GET: 編集対象のユーザー情報を取得
+            if request.method == 'GET':
+                cur.execute("SELECT id, username, is_admin FROM users WHERE id = %s", (user_id,))
+                user = cur.fetchone()
 
-            if not user:
-                return f"ID {user_id} のユーザーが見つかりませんでした。", 404
+                if not user:
+                    return f"ID {user_id} のユーザーが見つかりませんでした。", 404
 
-            return render_template("admin_users_edit.html", user=user)
+                return render_template("admin_users_edit.html", user=user)
 
-        # POST: フォームから新しい情報を取得
-        new_username = request.form.get('username', '').strip()
-        new_is_admin = request.form.get('is_admin', '').strip()
+            # POST: フォームから新しい情報を取得
+            new_username = request.form.get('username', '').strip()
+            new_is_admin = request.form.get('is_admin', '').strip()
 
-        # バリデーション
-        if not new_username or new_is_admin not in ('0', '1'):
-            flash("⚠️ ユーザー名と権限を正しく入力してください。", "error")
-            return redirect(url_for('edit_user', user_id=user_id))
+            # バリデーション
+            if not new_username or new_is_admin not in ('0', '1'):
+                flash("⚠️ ユーザー名と権限を正しく入力してください。", "error")
+                return redirect(url_for('edit_user', user_id=user_id))
 
-        # 同じユーザー名が他のIDで使われていないかチェック
-        cur.execute("SELECT id FROM users WHERE username = %s AND id != %s", (new_username, user_id))
-        existing = cur.fetchone()
+            # 同じユーザー名が他のIDで使われていないかチェック
+            cur.execute("SELECT id FROM users WHERE username = %s AND id != %s", (new_username, user_id))
+            existing = cur.fetchone()
 
-        if existing:
-            flash("⚠️ このユーザー名は既に使用されています。", "error")
-            return redirect(url_for('edit_user', user_id=user_id))
+            if existing:
+                flash("⚠️ このユーザー名は既に使用されています。", "error")
+                return redirect(url_for('edit_user', user_id=user_id))
 
-        # パスワード取得（空なら更新しない）
-        new_password = request.form.get('password', '').strip()
+            # パスワード取得（空なら更新しない）
+            new_password = request.form.get('password', '').strip()
 
-        # 条件によってSQLを分岐
-        if new_password:
-            # パスワードをハッシュ化して含めて更新
-            hashed_pw = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+            # 条件によってSQLを分岐
+            if new_password:
+                # パスワードをハッシュ化して含めて更新
+                hashed_pw = hash_password(new_password)
 
-            cur.execute("""
-                UPDATE users
-                SET username = %s, is_admin = %s, password = %s
-                WHERE id = %s
-            """, (new_username, new_is_admin == '1', hashed_pw.decode('utf-8'), user_id))
+                cur.execute("""
+                    UPDATE users
+                    SET username = %s, is_admin = %s, password = %s
+                    WHERE id = %s
+                """, (new_username, new_is_admin == '1', hashed_pw, user_id))
 
-        else:
-            # パスワード以外のみ更新
-            cur.execute("""
-                UPDATE users
-                SET username = %s, is_admin = %s
-                WHERE id = %s
-            """, (new_username, new_is_admin == '1', user_id))
+            else:
+                # パスワード以外のみ更新
+                cur.execute("""
+                    UPDATE users
+                    SET username = %s, is_admin = %s
+                    WHERE id = %s
+                """, (new_username, new_is_admin == '1', user_id))
 
 
-        conn.commit()
-        flash("✅ ユーザー情報を更新しました！", "success")
-        return redirect(url_for('manage_users'))
+            conn.commit()
+            flash("✅ ユーザー情報を更新しました！", "success")
+            return redirect(url_for('manage_users'))
 
     except Exception as e:
         flash(f"⚠️ 編集中にエラーが発生しました: {e}", "error")
         return redirect(url_for('edit_user', user_id=user_id))
 
-    finally:
-        cur.close()
-        conn.close()
-
     # return f"ユーザーID {user_id} の編集ページ（仮）"
 
 
@@ -863,25 +992,20 @@ def edit_user(user_id):
 @app.route('/admin/users/delete/<int:user_id>', methods=['POST'])
 def delete_user(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # 対象ユーザーを削除
-        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
-        conn.commit()
+            # 対象ユーザーを削除
+            cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            conn.commit()
 
-        flash("✅ ユーザーを削除しました。", "success")
-        return redirect(url_for('manage_users'))
+            flash("✅ ユーザーを削除しました。", "success")
+            return redirect(url_for('manage_users'))
 
     except Exception as e:
         print("削除エラー:", e)
         flash("⚠️ 削除中にエラーが発生しました。", "error")
         return redirect(url_for('manage_users'))
 
-    finally:
-        cur.close()
-        conn.close()
-
 
 # ================================
 # 〇〇〇〇〇〇〇〇〇〇〇〇〇〇〇
@@ -891,6 +1015,62 @@ def manage_records():
     return "<h1>登録データ管理ページ（準備中）</h1>"
 
 
+# ================================
+# アシストデータの一括インポート（CSV / JSONL）
+# ================================
+@app.route('/admin/records/import', methods=['GET', 'POST'])
+def import_records_page():
+    if not session.get('is_admin'):
+        return redirect(url_for('assist_select'))
+
+    error = None
+    summary = None
+
+    if request.method == 'POST':
+        upload = request.files.get('file')
+
+        if not upload or not upload.filename:
+            error = "インポートするファイルを選択してください。"
+        else:
+            try:
+                summary = import_file(upload.stream, upload.filename,
+                                      generate='generate' in request.form)
+            except Exception as e:
+                print("一括インポートエラー:", e)
+                error = f"⚠️ インポート中にエラーが発生しました: {e}"
+
+    return render_template('admin_records_import.html', error=error, summary=summary)
+
+
+# ================================
+# アシストデータのエクスポート（CSV / JSONL をストリーミングで返す）
+# ================================
+# /admin/records/export?format=jsonl&tag=Python&updated_since=2024-01-01
+@app.route('/admin/records/export')
+def export_records():
+    if not session.get('is_admin'):
+        return redirect(url_for('assist_select'))
+
+    fmt = request.args.get('format', 'csv')
+    try:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"未対応の形式です: {fmt}")
+        tag_id = resolve_tag_id(request.args.get('tag'))
+        updated_since = parse_updated_since(request.args.get('updated_since'))
+    except ValueError as e:
+        flash(f"⚠️ エクスポートできません: {e}", "error")
+        return redirect(url_for('admin'))
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"records_{datetime.now():%Y%m%d_%H%M%S}.{extension}"
+
+    # 1行ずつ送る（全件をメモリに載せない）
+    return Response(iter_export(fmt, tag_id, updated_since),
+                    content_type=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
+
 # ================================
 # 新規タグ登録ページを表示するルート
 # ================================
@@ -900,40 +1080,37 @@ def add_tag():
     success = None
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        if request.method == 'POST':
-            tag_name = request.form.get('name', '').strip()
+        with get_connection() as conn, conn.cursor() as cur:
 
-            # 入力チェック
-            if not tag_name:
-                error = "タグ名を入力してください。"
-            else:
-                # 重複チェック（同名タグが存在するか）
-                cur.execute("SELECT * FROM tag WHERE name = %s", (tag_name,))
-                existing = cur.fetchone()
+            if request.method == 'POST':
+                tag_name = request.form.get('name', '').strip()
 
-                if existing:
-                    error = "⚠️ そのタグ名はすでに存在しています。"
+                # 入力チェック
+                if not tag_name:
+                    error = "タグ名を入力してください。"
                 else:
-                    # 新規追加
-                    cur.execute("INSERT INTO tag (name) VALUES (%s)", (tag_name,))
-                    conn.commit()
-                    flash("✅ タグの追加が完了しました！", "success")
-                    return redirect(url_for('manage_tags'))
-
-        return render_template('admin_tags_add.html', error=error)
+                    # 重複チェック（同名タグが存在するか）
+                    cur.execute("SELECT * FROM tag WHERE name = %s", (tag_name,))
+                    existing = cur.fetchone()
+
+                    if existing:
+                        error = "⚠️ そのタグ名はすでに存在しています。"
+                    else:
+                        # 新規追加
+                        cur.execute("INSERT INTO tag (name) VALUES (%s)", (tag_name,))
+                        notify_tags_changed(cur)  # 全workerのタグキャッシュを無効化
+                        notify_records_changed(cur)  # 検索結果キャッシュも無効化
+                        conn.commit()
+                        flash("✅ タグの追加が完了しました！", "success")
+                        return redirect(url_for('manage_tags'))
+
+            return render_template('admin_tags_add.html', error=error)
 
     except Exception as e:
         print("タグ追加エラー:", e)
         error = f"⚠️ タグの追加中にエラーが発生しました：{e}"
         return render_template('admin_tags_add.html', error=error)
 
-    finally:
-        cur.close()
-        conn.close()
-
 
 # ================================
 # タグ編集画面の表示
@@ -941,50 +1118,47 @@ def add_tag():
 @app.route('/admin/tags/edit/<int:tag_id>', methods=['GET', 'POST'])
 def edit_tag(tag_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # GET: 編集対象のタグ情報を取得
-        if request.method == 'GET':
-            cur.execute("SELECT id, name FROM tag WHERE id = %s", (tag_id,))
-            tag = cur.fetchone()
+            # GET: 編集対象のタグ情報を取得
+            if request.method == 'GET':
+                cur.execute("SELECT id, name FROM tag WHERE id = %s", (tag_id,))
+                tag = cur.fetchone()
 
-            if not tag:
-                return f"ID {tag_id} のタグが見つかりませんでした。", 404
+                if not tag:
+                    return f"ID {tag_id} のタグが見つかりませんでした。", 404
 
-            return render_template("admin_tags_edit.html", tag=tag)
+                return render_template("admin_tags_edit.html", tag=tag)
 
-        # POST: 新しいタグ名を取得
-        new_name = request.form.get('name', '').strip()
+            # POST: 新しいタグ名を取得
+            new_name = request.form.get('name', '').strip()
 
-        # バリデーション：空チェック
-        if not new_name:
-            flash("⚠️ タグ名を入力してください。", "error")
-            return redirect(url_for('edit_tag', tag_id=tag_id))
+            # バリデーション：空チェック
+            if not new_name:
+                flash("⚠️ タグ名を入力してください。", "error")
+                return redirect(url_for('edit_tag', tag_id=tag_id))
 
-        # 同名チェック（同じID以外に同名があるか）
-        cur.execute("SELECT id FROM tag WHERE name = %s AND id != %s", (new_name, tag_id))
-        duplicate = cur.fetchone()
+            # 同名チェック（同じID以外に同名があるか）
+            cur.execute("SELECT id FROM tag WHERE name = %s AND id != %s", (new_name, tag_id))
+            duplicate = cur.fetchone()
 
-        if duplicate:
-            flash("⚠️ 同じ名前のタグが既に存在します。", "error")
-            return redirect(url_for('edit_tag', tag_id=tag_id))
+            if duplicate:
+                flash("⚠️ 同じ名前のタグが既に存在します。", "error")
+                return redirect(url_for('edit_tag', tag_id=tag_id))
 
-        # 更新処理
-        cur.execute("UPDATE tag SET name = %s WHERE id = %s", (new_name, tag_id))
-        conn.commit()
+            # 更新処理
+            cur.execute("UPDATE tag SET name = %s WHERE id = %s", (new_name, tag_id))
+            notify_tags_changed(cur)  # 全workerのタグキャッシュを無効化
+            notify_records_changed(cur)  # 検索結果キャッシュも無効化
+            conn.commit()
 
-        flash("✅ タグ情報を更新しました！", "success")
-        return redirect(url_for('manage_tags'))
+            flash("✅ タグ情報を更新しました！", "success")
+            return redirect(url_for('manage_tags'))
 
     except Exception as e:
         flash(f"⚠️ タグ編集中にエラーが発生しました: {e}", "error")
         return redirect(url_for('edit_tag', tag_id=tag_id))
 
-    finally:
-        cur.close()
-        conn.close()
-
 
 
 # ================================
@@ -995,23 +1169,20 @@ def delete_tag(tag_id):
 
     error = None
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # 削除クエリの実行
-        cur.execute("DELETE FROM tag WHERE id = %s", (tag_id,))
-        conn.commit()
+            # 削除クエリの実行
+            cur.execute("DELETE FROM tag WHERE id = %s", (tag_id,))
+            notify_tags_changed(cur)  # 全workerのタグキャッシュを無効化
+            notify_records_changed(cur)  # 検索結果キャッシュも無効化
+            conn.commit()
 
-        flash("タグを削除しました。", "success")
+            flash("タグを削除しました。", "success")
 
     except Exception as e:
         print("タグ削除エラー:", e)
         flash("タグの削除中にエラーが発生しました。", "error")
 
-    finally:
-        cur.close()
-        conn.close()
-
     return redirect(url_for('manage_tags'))
 
 
@@ -1052,17 +1223,84 @@ def dashboard():
 @app.route("/test_db")
 def test_db():
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT now();")  # 現在時刻を取得
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT now();")  # 現在時刻を取得
+            result = cur.fetchall()
         return f"✅ PostgreSQL接続成功！現在時刻: {result[0]['now']}"
     except Exception as e:
         return f"❌ PostgreSQL接続エラー:<br>{e}"
 
 
+# ----------------------------------------
+# DBコネクションプールの状態確認用（管理者のみ）
+# ----------------------------------------
+@app.route("/admin/db_pool")
+def db_pool_stats():
+    if not session.get('is_admin'):
+        return redirect(url_for('assist_select'))
+
+    # 使用中・待機中の接続数、待ち時間、取得失敗回数などをJSONで返す
+    return jsonify(pool_stats())
+
+
+# ----------------------------------------
+# ChatGPT応答キャッシュの状態確認用（管理者のみ）
+# ----------------------------------------
+@app.route("/admin/llm_cache")
+def llm_cache_stats():
+    if not session.get('is_admin'):
+        return redirect(url_for('assist_select'))
+
+    # ヒット・ミス回数、節約できた生成時間などをJSONで返す
+    return jsonify(llm_cache.stats())
+
+
+# ----------------------------------------
+# 遅いクエリの一覧（管理者のみ）
+# ----------------------------------------
+@app.route("/admin/slow_queries", methods=['GET', 'POST'])
+def slow_queries_page():
+    if not session.get('is_admin'):
+        return redirect(url_for('assist_select'))
+
+    if request.method == 'POST':
+        slow_query_log.clear()
+        flash("✅ 遅いクエリの記録をリセットしました。", "success")
+        return redirect(url_for('slow_queries_page'))
+
+    order = request.args.get('order', 'total')
+    if order not in ('total', 'max', 'avg', 'count'):
+        order = 'total'
+
+    return render_template('admin_slow_queries.html',
+                           entries=slow_query_log.top(order=order),
+                           order=order,
+                           threshold_ms=slow_query_log.threshold * 1000,
+                           explain_sample=slow_query_log.explain_sample)
+
+
+# ----------------------------------------
+# Prometheus形式のメトリクス（管理者、または METRICS_TOKEN を持つ収集元のみ）
+# ----------------------------------------
+@app.route("/metrics")
+def metrics_page():
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not session.get('is_admin') and not (METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN)):
+        return "Forbidden", 403
+
+    # その時点の値（接続プール・キャッシュの状態）
+    gauges = {}
+    for name, value in pool_stats().items():
+        gauges[f"db_pool_{name}"] = ("接続プールの状態", value)
+    for name, value in llm_cache.stats().items():
+        gauges[f"llm_cache_{name}"] = ("ChatGPT応答キャッシュの状態", value)
+    for name, value in search_cache.stats().items():
+        gauges[f"search_cache_{name}"] = ("検索結果キャッシュの状態", value)
+
+    return Response(metrics.registry.render(gauges),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 
 # # ================================
 # # Flaskアプリ起動
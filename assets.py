@@ -0,0 +1,197 @@
+# ================================
+# 静的ファイルのビルド（圧縮・ハッシュ付きファイル名・gzip/brotli）
+# ================================
+# static/ のCSS・JSを縮小し、内容のハッシュを入れたファイル名で static/dist/ に書き出す。
+# 同じ場所に .gz（gzip）と .br（brotli）も作っておき、配信時はブラウザの Accept-Encoding で選ぶだけにする
+# （リクエストごとに圧縮しない）。ファイル名が内容で決まるので、ブラウザには1年間キャッシュさせてよい。
+#
+#   python assets.py build    # static/dist/ と manifest.json を作る（CSS・JSを変更したら実行してアプリを再起動）
+#   python assets.py clean    # static/dist/ を削除する（元のファイルをそのまま配信する状態に戻る）
+#
+# テンプレートは今まで通り url_for('static', filename='style.css') と書く。
+# manifest.json に載っているファイルは、app.py の url_defaults で dist/style.<ハッシュ>.css に置き換わる。
+# ビルドしていない（manifest.json がない）ときは、元のファイルがそのまま使われる。
+#
+# 外部のCDNから読み込むファイルは使わない（オフラインの教室ネットワークで表示が崩れないように）。
+# ライブラリのファイルが必要になったら static/vendor/ に置けば、ほかのファイルと同じくビルドされる。
+from flask import request, send_from_directory  # 配信用
+import argparse  # コマンドライン引数
+import gzip  # gzip版の作成
+import hashlib  # ファイル名に入れるハッシュ
+import json  # manifest.json
+import mimetypes  # 元のファイルの Content-Type
+import os  # パス操作
+import shutil  # clean
+import sys  # 進捗の表示先
+
+try:
+    import brotli  # brotli版の作成（なければ gzip だけ作る）
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+# ハッシュ付きのファイルをブラウザにキャッシュさせる期間（秒）
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# これより小さいファイルは圧縮版を作らない（ヘッダーの分だけ得にならない）
+ASSET_COMPRESS_MIN_SIZE = 256
+
+# 配信時に優先する順（拡張子, Content-Encoding）
+ASSET_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+# ================================
+# ビルド
+# ================================
+def minify(name, data):
+    """CSS・JSを縮小する（すでに縮小済みの *.min.* とそれ以外のファイルはそのまま）"""
+    if ".min." in name:
+        return data
+    if name.endswith(".css"):
+        from rcssmin import cssmin
+        return cssmin(data.decode("utf-8")).encode("utf-8")
+    if name.endswith(".js"):
+        from rjsmin import jsmin
+        return jsmin(data.decode("utf-8")).encode("utf-8")
+    return data
+
+
+def hashed_name(name, data):
+    """style.css -> style.<内容のハッシュ8桁>.css"""
+    digest = hashlib.sha256(data).hexdigest()[:8]
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+
+def source_files():
+    """ビルド対象（static/ 以下の dist/ 以外のファイル。static/ からの相対パス）"""
+    for root, dirs, files in os.walk(STATIC_DIR):
+        if os.path.abspath(root) == STATIC_DIR:
+            dirs[:] = [d for d in dirs if d != "dist"]
+        for filename in sorted(files):
+            yield os.path.relpath(os.path.join(root, filename), STATIC_DIR).replace(os.sep, "/")
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def build(progress=None):
+    """static/dist/ にハッシュ付きのファイルと圧縮版を書き出し、manifest（元の名前 -> ハッシュ付きの名前）を返す"""
+    manifest = {}
+    for name in source_files():
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            data = minify(name, f.read())
+        output = hashed_name(name, data)
+        path = os.path.join(DIST_DIR, output)
+        manifest[name] = output
+
+        # 同じ内容のものは前回のビルドで作成済み
+        if not os.path.exists(path):
+            _write(path, data)
+            if len(data) >= ASSET_COMPRESS_MIN_SIZE:
+                # mtime=0 … 同じ内容なら毎回同じ .gz になるようにする
+                _write(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(path + ".br", brotli.compress(data, quality=11))
+        if progress:
+            progress(name, output)
+
+    # 古いハッシュのファイルは残す（配信中のページが参照していることがあるため。不要なら clean）
+    os.makedirs(DIST_DIR, exist_ok=True)
+    temp_path = MANIFEST_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, MANIFEST_PATH)
+    return manifest
+
+
+def clean():
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+
+
+# ================================
+# 配信
+# ================================
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print("manifest.json 読み込みエラー:", e)
+        return {}
+
+
+# 起動時に1回だけ読み込む（ビルドし直したらアプリを再起動する）
+manifest = load_manifest()
+
+
+def _build_version():
+    """テンプレートと manifest.json の内容から作るバージョン（デプロイでページの中身が変わると変わる）"""
+    digest = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8"))
+    templates_dir = os.path.join(os.path.dirname(STATIC_DIR), "templates")
+    for root, dirs, files in sorted(os.walk(templates_dir)):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            digest.update(os.path.relpath(path, templates_dir).encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+# ETag に入れて、デプロイ前に受け取ったページが 304 で使い回されないようにする（search.search_etag）
+BUILD_VERSION = _build_version()
+
+
+def asset_path(filename):
+    """url_for('static', filename=...) に渡すファイル名（ビルド済みならハッシュ付きのもの）"""
+    output = manifest.get(filename)
+    return f"dist/{output}" if output else filename
+
+
+def send_asset(filename):
+    """static/dist/ のファイルを、ブラウザが受け取れる圧縮版があればそれで返す"""
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    encoding = None
+    for name, ext in ASSET_ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(os.path.join(DIST_DIR, filename + ext)):
+            encoding = name
+            filename += ext
+            break
+
+    response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="静的ファイルのビルド")
+    parser.add_argument("command", choices=["build", "clean"])
+    args = parser.parse_args()
+
+    if args.command == "clean":
+        clean()
+        print("🧹 static/dist/ を削除しました。", file=sys.stderr)
+        return
+
+    if brotli is None:
+        print("⚠️ brotli が入っていないため、gzip版だけを作成します。", file=sys.stderr)
+    manifest = build(progress=lambda name, output: print(f"{name} -> dist/{output}", file=sys.stderr))
+    print(f"✅ {len(manifest)} 件のファイルをビルドしました。アプリを再起動すると反映されます。", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# ================================
+# 要約の補完（バックフィル）
+# ================================
+# summary_result が空のレコードに、まとめて生成した要約を書き込む。
+#
+#   python backfill.py
+#   python backfill.py --tag Python --limit 500 --dry-run
+from db import get_connection, notify, RECORDS_CHANNEL  # DB処理用関数
+from export import resolve_tag_id  # タグ名・IDの解決
+from llm import generate_summaries  # 複数ワードの要約をまとめて生成
+from psycopg2.extras import execute_values  # まとめて更新
+import argparse  # コマンドライン引数
+import json  # 結果の出力
+import sys  # 進捗の表示先
+
+# 1回に読み込んで生成・更新する件数
+BACKFILL_CHUNK_SIZE = 200
+
+
+def _fetch_missing(cur, after_id, tag_id, limit):
+    conditions = ["(records.summary_result IS NULL OR records.summary_result = '')", "records.id > %s"]
+    params = [after_id]
+    if tag_id is not None:
+        conditions.append("records.tag_id = %s")
+        params.append(tag_id)
+    params.append(limit)
+    cur.execute(f"""
+        SELECT records.id, records.word, records.details
+        FROM records
+        WHERE {" AND ".join(conditions)}
+        ORDER BY records.id
+        LIMIT %s
+    """, params)
+    return cur.fetchall()
+
+
+def backfill_summaries(tag_id=None, limit=None, chunk_size=BACKFILL_CHUNK_SIZE, dry_run=False, progress=None):
+    """要約が空のレコードを id 順に chunk_size 件ずつ補完し、件数の集計を返す"""
+    progress = progress or (lambda done, errors: None)
+    summary = {'processed': 0, 'updated': 0, 'errors': 0}
+    after_id = 0
+
+    while limit is None or summary['processed'] < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - summary['processed'])
+        with get_connection() as conn, conn.cursor() as cur:
+            rows = _fetch_missing(cur, after_id, tag_id, size)
+        if not rows:
+            break
+        after_id = rows[-1]['id']
+        summary['processed'] += len(rows)
+
+        if dry_run:
+            continue
+
+        results, errors = generate_summaries([(row['word'], row['details']) for row in rows])
+        for index, e in errors.items():
+            print(f"要約生成エラー（id={rows[index]['id']}）:", e, file=sys.stderr)
+        summary['errors'] += len(errors)
+
+        if results:
+            with get_connection() as conn, conn.cursor() as cur:
+                # 生成中に他で要約が入力された場合は上書きしない
+                # page_size ごとに分けて実行されるので、件数は cur.rowcount（最後の分だけ）ではなく RETURNING で数える
+                updated = execute_values(cur, """
+                    UPDATE records
+                    SET summary_result = data.summary_result, updated_at = now()
+                    FROM (VALUES %s) AS data(id, summary_result)
+                    WHERE records.id = data.id
+                      AND (records.summary_result IS NULL OR records.summary_result = '')
+                    RETURNING records.id
+                """, [(rows[index]['id'], text) for index, text in results.items()], fetch=True)
+                summary['updated'] += len(updated)
+                if updated:
+                    notify(cur, RECORDS_CHANNEL)  # 起動中のアプリの検索結果キャッシュを無効化
+                conn.commit()
+        progress(summary['processed'], summary['errors'])
+
+    return summary
+
+
+# ================================
+# コマンドラインからの実行
+# ================================
+def main():
+    parser = argparse.ArgumentParser(description="要約が空のレコードに要約をまとめて生成する")
+    parser.add_argument("--tag", help="タグ名またはタグIDで絞り込む")
+    parser.add_argument("--limit", type=int, help="処理する最大件数")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="1回に読み込む件数")
+    parser.add_argument("--dry-run", action="store_true", help="生成せずに対象件数だけ確認する")
+    args = parser.parse_args()
+
+    try:
+        tag_id = resolve_tag_id(args.tag)
+    except ValueError as e:
+        parser.error(str(e))
+
+    def progress(done, errors):
+        print(f"\r[backfill] {done}件処理（エラー {errors}件）", end="", file=sys.stderr, flush=True)
+
+    summary = backfill_summaries(tag_id=tag_id, limit=args.limit, chunk_size=args.chunk_size,
+                                 dry_run=args.dry_run, progress=progress)
+    print(file=sys.stderr)
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
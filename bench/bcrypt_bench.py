@@ -0,0 +1,71 @@
+# ================================
+# bcryptのコスト別ベンチマーク
+# ================================
+# コスト（BCRYPT_ROUNDS）ごとに、1コアあたり1秒間に何回ハッシュ化できるかを計測する。
+# ワーカー数・BCRYPT_MAX_WORKERS を決める目安にする。
+#
+#   python bench/bcrypt_bench.py                  # コスト 10〜13 を計測
+#   python bench/bcrypt_bench.py --costs 12 14 --threads 4 --json
+import argparse  # コマンドライン引数
+import json  # 結果のJSON出力
+import os  # CPU数の取得
+import time  # 計測用
+from concurrent.futures import ThreadPoolExecutor  # 複数コアでの計測用
+
+import bcrypt  # パスワードの暗号化・照合に使用
+
+
+def measure(cost, threads, min_seconds):
+    """指定コストで min_seconds 以上ハッシュ化を繰り返し、1秒あたりの回数を返す"""
+    salt = bcrypt.gensalt(cost)
+    password = b"benchmark-password"
+
+    # 1回あたりの時間から、計測に必要な回数を見積もる
+    start = time.perf_counter()
+    bcrypt.hashpw(password, salt)
+    single = time.perf_counter() - start
+    per_thread = max(1, int(min_seconds / single))
+    total = per_thread * threads
+
+    def work(_):
+        for _ in range(per_thread):
+            bcrypt.hashpw(password, salt)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "cost": cost,
+        "threads": threads,
+        "hashes": total,
+        "seconds": round(elapsed, 3),
+        "ms_per_hash": round(elapsed / total * threads * 1000, 2),
+        "hashes_per_sec": round(total / elapsed, 2),
+        "hashes_per_sec_per_core": round(total / elapsed / threads, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bcryptのコスト別スループットを計測する")
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 11, 12, 13], help="計測するコスト")
+    parser.add_argument("--threads", type=int, default=1, help="同時に計算するスレッド数（既定: 1）")
+    parser.add_argument("--min-seconds", type=float, default=2.0, help="コストごとの最低計測時間")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    results = [measure(cost, args.threads, args.min_seconds) for cost in args.costs]
+
+    if args.json:
+        print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, indent=2))
+        return
+
+    print(f"CPU数: {os.cpu_count()}  スレッド数: {args.threads}")
+    print(f"{'cost':>4}  {'ms/hash':>9}  {'hash/s':>9}  {'hash/s/core':>12}")
+    for r in results:
+        print(f"{r['cost']:>4}  {r['ms_per_hash']:>9}  {r['hashes_per_sec']:>9}  {r['hashes_per_sec_per_core']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# ================================
+# 同期worker と 非同期（gevent）worker の比較
+# ================================
+# 同じコミット・同じデータ・同じ負荷で、gunicorn を起動方式ごとに立ち上げ直して
+# bench/load_bench.py で計測し、結果を並べたJSONと表を出力する。
+#
+#   python bench/load_bench.py seed --users 100 --tags 20 --records 50000
+#   python bench/compare_serving.py --workers 2 --concurrency 64 --duration 30 -o compare.json
+#
+# 比較の条件（数値を読むときの前提）:
+#   ・アプリは LLM_BACKEND=fake（llm_fake.py）・ASSIST_STREAMING=0・LLM_CACHE_ENABLED=0 で起動する。
+#   ・BCRYPT_ROUNDS は --bcrypt-rounds（既定4）で起動する。seed も同じ値で行う（BCRYPT_ROUNDS=4 python bench/load_bench.py seed …）。
+#     アプリの既定（12）だと、ログイン時にハッシュが作り直され、計測開始時の全スレッドのログインで
+#     bcrypt の計算待ち（BCRYPT_MAX_QUEUE）があふれて計測にならない。
+#     ChatGPTの待ち時間は LLM_FAKE_LATENCY_MEDIAN / LLM_FAKE_LATENCY_SIGMA で決まり、外部APIの混み具合に左右されない。
+#   ・既定のシナリオは待ち時間の長い register:assist と、DB中心の検索・管理画面の一覧。
+#     bcrypt（login）はCPUを使うだけなので、起動方式による差はほとんど出ない。
+#   ・どの方式もプロセス数（--workers）は同じにし、1プロセスあたりの同時処理数だけが違う
+#     （sync: 1 / gthread: --threads / gevent: ASYNC_WORKER_CONNECTIONS）。
+#   ・負荷をかける側もPythonのスレッドなので、同じマシンで動かすとCPUを取り合う。
+#     --concurrency を増やしても req/s が伸びないときは、負荷側を別のマシンから実行する。
+#   ・結果にはコミット・データ件数・設定が入るので、コミットごとに保存して比べられる。
+import argparse  # コマンドライン引数
+import json  # 結果のJSON出力
+import os  # 環境変数
+import subprocess  # gunicorn・負荷テストの起動
+import sys  # 実行中のPython
+import time  # 起動待ち
+
+import httpx  # 起動確認
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOAD_BENCH = os.path.join(ROOT, "bench", "load_bench.py")
+
+DEFAULT_SCENARIOS = ["register:assist", "search:partial:all", "search:exact:word", "search:list", "admin:users"]
+
+
+def gunicorn_command(mode, workers, threads, connections, bind):
+    command = [sys.executable, "-m", "gunicorn", "--bind", bind, "--workers", str(workers)]
+    if mode == "sync":
+        command += ["--worker-class", "sync"]
+    elif mode == "gthread":
+        command += ["--worker-class", "gthread", "--threads", str(threads)]
+    elif mode == "gevent":
+        command += ["--config", os.path.join(ROOT, "gunicorn_async_conf.py"),
+                    "--worker-connections", str(connections)]
+    else:
+        raise ValueError(f"未対応の起動方式です: {mode}")
+    return command + ["app:app"]
+
+
+def wait_until_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} が {timeout} 秒以内に起動しませんでした。")
+
+
+def measure(mode, args):
+    bind = f"127.0.0.1:{args.port}"
+    url = f"http://{bind}"
+    env = dict(os.environ,
+               LLM_BACKEND="fake", ASSIST_STREAMING="0", LLM_CACHE_ENABLED="0",
+               LLM_FAKE_LATENCY_MEDIAN=str(args.llm_latency), LLM_FAKE_LATENCY_SIGMA=str(args.llm_sigma),
+               ASYNC_WORKER_CONNECTIONS=str(args.connections), WEB_CONCURRENCY=str(args.workers),
+               BCRYPT_ROUNDS=str(args.bcrypt_rounds))
+    server = subprocess.Popen(gunicorn_command(mode, args.workers, args.threads, args.connections, bind),
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(url)
+        result = subprocess.run(
+            [sys.executable, LOAD_BENCH, "run", "--url", url, "--json",
+             "--users", str(args.users), "--concurrency", str(args.concurrency),
+             "--duration", str(args.duration), "--warmup", str(args.warmup),
+             "--only", *args.only],
+            cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{mode} の計測に失敗しました:\n{result.stderr}")
+        return json.loads(result.stdout)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def print_comparison(reports):
+    modes = list(reports)
+    routes = sorted({name for report in reports.values() for name in report["routes"]})
+    header = f"{'route':<22}" + "".join(f" {mode + ' req/s':>14} {mode + ' p95':>12}" for mode in modes)
+    print(header)
+    for name in routes + ["TOTAL"]:
+        line = f"{name:<22}"
+        for mode in modes:
+            r = reports[mode]["total"] if name == "TOTAL" else reports[mode]["routes"].get(name)
+            if r is None:
+                line += f" {'-':>14} {'-':>12}"
+            else:
+                line += f" {r['throughput_rps']:>14} {r['latency_ms']['p95']:>12}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gunicorn の起動方式ごとに負荷テストを行い、結果を並べる")
+    parser.add_argument("--modes", nargs="+", default=["sync", "gevent"], choices=["sync", "gthread", "gevent"],
+                        help="比べる起動方式（既定: sync gevent）")
+    parser.add_argument("--workers", type=int, default=2, help="プロセス数（どの方式も同じ）")
+    parser.add_argument("--threads", type=int, default=8, help="gthread の1プロセスあたりのスレッド数")
+    parser.add_argument("--connections", type=int, default=200, help="gevent の1プロセスあたりの同時処理数")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=100, help="seed したユーザー数")
+    parser.add_argument("--concurrency", type=int, default=32, help="負荷をかけるスレッド数")
+    parser.add_argument("--duration", type=float, default=30.0, help="起動方式ごとの計測秒数")
+    parser.add_argument("--warmup", type=float, default=3.0, help="集計しない最初の秒数")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="偽のChatGPTの応答時間の中央値（秒）")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="偽のChatGPTの応答時間のばらつき")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="アプリの BCRYPT_ROUNDS（seed と同じ値にする）")
+    parser.add_argument("--only", nargs="+", default=DEFAULT_SCENARIOS, help="実行するシナリオ")
+    parser.add_argument("-o", "--output", help="結果のJSONを書き出すファイル")
+    args = parser.parse_args()
+
+    reports = {}
+    for mode in args.modes:
+        print(f"⏱️ {mode} を計測中…", file=sys.stderr)
+        reports[mode] = measure(mode, args)
+
+    comparison = {
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": reports,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(comparison, f, ensure_ascii=False, indent=2)
+    print_comparison(reports)
+
+
+if __name__ == '__main__':
+    main()
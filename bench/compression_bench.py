@@ -0,0 +1,201 @@
+# ================================
+# レスポンス圧縮の効果とコスト（ルートごと）
+# ================================
+# bench/load_bench.py seed で入れたデータを使い、アプリをこのプロセス内（Flaskのテストクライアント）で動かして
+# 主要な画面・API・エクスポートを「圧縮なし / gzip / brotli」で取得し、ルートごとに次を出力する。
+#   ・転送バイト数と削減率
+#   ・1リクエストあたりのCPU時間（圧縮なしとの差が圧縮のコスト）
+#   ・--levels を付けると、同じ本文を gzip / brotli の各レベルで圧縮したときのサイズと時間
+#
+#   python bench/load_bench.py seed --users 10 --tags 20 --records 20000
+#   python bench/compression_bench.py --requests 30 --levels -o compression.json
+#
+# CPU時間はこのプロセスのもの（テンプレート描画・DBドライバ・圧縮）で、PostgreSQL側の時間は含まない。
+# ネットワークを通さないので、転送時間の短縮は「削減したバイト数 ÷ 回線速度」で見積もる。
+# 圧縮レベルの既定値は compression.py の COMPRESS_GZIP_LEVEL / COMPRESS_BROTLI_QUALITY（.envで変更可能）。
+import argparse  # コマンドライン引数
+import json  # 結果のJSON出力
+import sys  # 進捗の表示先
+import time  # 計測用
+from datetime import datetime, timezone  # 計測日時
+
+from load_bench import ADMIN_USERNAME, BENCH_PASSWORD, _bench_tag_ids, _git_commit, _seeded_counts
+
+# --levels で比べる圧縮レベル
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 4, 6, 11)
+
+
+def build_routes(tag_id):
+    """ルート名 -> パス（すべて管理者のセッションで取得する）"""
+    return {
+        "search:partial": "/assist_search?keyword=python&match_type=partial",
+        "search:list": f"/assist_search?keyword=&match_type=partial&tag={tag_id}&page_size=100",
+        "admin:users": "/admin/users",
+        "admin:tags": "/admin/tags",
+        "api:records": "/api/records?page_size=100",
+        "api:records:full": "/api/records?page_size=100&fields=id,word,details,summary_result,code_result",
+        "export:csv": f"/admin/records/export?format=csv&tag={tag_id}",
+    }
+
+
+def _fetch_all(client, path, encodings, requests):
+    """圧縮方式ごとに同じパスを requests 回取得し、方式 -> (本文, ヘッダー, 1回あたりのCPUミリ秒, 経過ミリ秒) を返す
+
+    方式を1回ずつ交互に取得する（キャッシュの温まり方や負荷の揺れが、どの方式にも同じようにかかるように）。
+    """
+    cpu = dict.fromkeys(encodings, 0.0)
+    wall = dict.fromkeys(encodings, 0.0)
+    last = {}
+    for encoding in encodings:
+        client.get(path, headers={'Accept-Encoding': encoding}).get_data()  # 1回目は計測しない
+
+    for _ in range(requests):
+        for encoding in encodings:
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            response = client.get(path, headers={'Accept-Encoding': encoding})
+            body = response.get_data()  # ストリーミングのレスポンスも最後まで読む
+            cpu[encoding] += time.process_time() - cpu_start
+            wall[encoding] += time.perf_counter() - wall_start
+            last[encoding] = (body, response)
+
+    results = {}
+    for encoding in encodings:
+        body, response = last[encoding]
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} の取得に失敗しました（{response.status_code}）。")
+        results[encoding] = (body, response.headers,
+                             cpu[encoding] * 1000 / requests, wall[encoding] * 1000 / requests)
+    return results
+
+
+def _level_table(body, repeat):
+    from compression import compress  # 圧縮処理（アプリと同じもの）
+
+    table = {}
+    options = [("gzip", level, {'gzip_level': level}) for level in GZIP_LEVELS]
+    options += [("br", quality, {'brotli_quality': quality}) for quality in BROTLI_QUALITIES]
+    for encoding, level, kwargs in options:
+        start = time.process_time()
+        for _ in range(repeat):
+            compressed = compress(body, encoding, **kwargs)
+        table[f"{encoding}-{level}"] = {
+            "bytes": len(compressed),
+            "ratio": round(len(compressed) / len(body), 3) if body else None,
+            "cpu_ms": round((time.process_time() - start) * 1000 / repeat, 3),
+        }
+    return table
+
+
+def measure_route(client, path, args):
+    from compression import brotli  # brotli が使えるか
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    fetched = _fetch_all(client, path, encodings, args.requests)
+
+    body, headers, identity_cpu, identity_wall = fetched["identity"]
+    result = {
+        "path": path,
+        "content_type": headers.get('Content-Type'),
+        "identity": {"bytes": len(body), "cpu_ms": round(identity_cpu, 3), "wall_ms": round(identity_wall, 3)},
+    }
+
+    for encoding in encodings[1:]:
+        compressed, headers, cpu_ms, wall_ms = fetched[encoding]
+        applied = headers.get('Content-Encoding') == encoding
+        result[encoding] = {
+            "applied": applied,  # しきい値未満などで圧縮されなかったときは False
+            "bytes": len(compressed),
+            "saved_bytes": len(body) - len(compressed),
+            "saved_ratio": round(1 - len(compressed) / len(body), 3) if body else 0.0,
+            "cpu_ms": round(cpu_ms, 3),
+            "extra_cpu_ms": round(cpu_ms - identity_cpu, 3),
+            "wall_ms": round(wall_ms, 3),
+        }
+
+    if args.levels:
+        result["levels"] = _level_table(body, args.requests)
+    return result
+
+
+def run(args):
+    from app import app  # アプリ（このプロセス内で動かす）
+    import compression  # 圧縮の設定
+
+    tag_ids = _bench_tag_ids()
+    if not tag_ids:
+        raise SystemExit("ベンチマーク用のタグがありません。先に load_bench.py seed を実行してください。")
+
+    client = app.test_client()
+    response = client.post("/", data={'username': ADMIN_USERNAME, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f"{ADMIN_USERNAME} でログインできません。先に load_bench.py seed を実行してください。")
+
+    routes = build_routes(tag_ids[0])
+    if args.only:
+        unknown = [name for name in args.only if name not in routes]
+        if unknown:
+            raise SystemExit(f"不明なルート: {', '.join(unknown)}（{', '.join(routes)}）")
+        routes = {name: routes[name] for name in args.only}
+
+    results = {}
+    for name, path in routes.items():
+        print(f"⏱️ {name} を計測中…", file=sys.stderr)
+        results[name] = measure_route(client, path, args)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "requests_per_route": args.requests,
+            "min_size": compression.COMPRESS_MIN_SIZE,
+            "gzip_level": compression.COMPRESS_GZIP_LEVEL,
+            "brotli_quality": compression.COMPRESS_BROTLI_QUALITY if compression.brotli else None,
+            "data": _seeded_counts(),
+        },
+        "routes": results,
+    }
+
+
+def print_table(report):
+    meta = report['meta']
+    print(f"commit: {meta['commit']}  gzip level: {meta['gzip_level']}  brotli quality: {meta['brotli_quality']}  "
+          f"データ: {meta['data']}")
+    print(f"{'route':<18} {'raw':>9} {'gzip':>9} {'saved':>6} {'+cpu ms':>8} {'br':>9} {'saved':>6} {'+cpu ms':>8}"
+          f" {'base cpu ms':>11}")
+    for name, r in report['routes'].items():
+        line = f"{name:<18} {r['identity']['bytes']:>9}"
+        for encoding in ("gzip", "br"):
+            e = r.get(encoding)
+            if e is None:
+                line += f" {'-':>9} {'-':>6} {'-':>8}"
+            else:
+                line += f" {e['bytes']:>9} {e['saved_ratio']:>6.0%} {e['extra_cpu_ms']:>8}"
+        print(line + f" {r['identity']['cpu_ms']:>11}")
+
+        for level, v in r.get('levels', {}).items():
+            print(f"    {level:<10} {v['bytes']:>9} bytes  {v['ratio']:>6}  {v['cpu_ms']:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レスポンス圧縮の削減バイト数とCPU時間をルートごとに計測する")
+    parser.add_argument("--requests", type=int, default=20, help="ルート・圧縮方式ごとのリクエスト数")
+    parser.add_argument("--levels", action="store_true", help="圧縮レベルごとのサイズと時間も計測する")
+    parser.add_argument("--only", nargs="+", help="計測するルート")
+    parser.add_argument("-o", "--output", help="結果のJSONを書き出すファイル")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで標準出力に出す")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_table(report)
+
+
+if __name__ == '__main__':
+    main()
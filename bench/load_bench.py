@@ -0,0 +1,473 @@
+# ================================
+# 負荷テスト（主要な画面の応答時間とスループット）
+# ================================
+# ローカルのPostgreSQLにベンチマーク用のユーザー・タグ・レコードを入れ、
+# 起動中のアプリに複数スレッドから実際のHTTPリクエストを送って、
+# 画面ごとのスループットと p50 / p95 / p99 をJSONで出力する。
+# コミットごとの結果を保存しておけば、変更前後で比べられる。
+#
+#   python bench/load_bench.py seed --users 200 --tags 20 --records 50000
+#   gunicorn -w 4 -b 127.0.0.1:8000 app:app          # 別の端末でアプリを起動
+#   python bench/load_bench.py run --url http://127.0.0.1:8000 --concurrency 16 --duration 30 -o result.json
+#   python bench/load_bench.py run --only login search:partial:all --duration 10
+#   python bench/load_bench.py clean                  # ベンチマーク用のデータを削除
+#
+# データはすべて名前が "bench-" で始まるので、既存のデータとは混ざらない。
+# 登録（assist_register）はアシスト生成のチェックを外して送るので、ChatGPTは呼び出さない。
+# 生成まで含めて計るときは、アプリを LLM_BACKEND=fake（llm_fake.py）で起動して
+# register:assist シナリオを --only で指定する（重み0なので既定の混合には含まれない）。
+# ストリーミング（ASSIST_STREAMING=1、既定）では確認画面はすぐ返るので、生成の時間を含めるには ASSIST_STREAMING=0 にする。
+import argparse  # コマンドライン引数
+import json  # 結果のJSON出力
+import os  # CPU数の取得
+import random  # シナリオ・検索語の選択
+import subprocess  # 計測したコミットの記録
+import sys  # import パスの設定
+import threading  # 結果の集計用
+import time  # 計測用
+import uuid  # 登録するワードを重複させない
+from concurrent.futures import ThreadPoolExecutor  # 同時アクセス用
+from datetime import datetime, timezone  # 計測日時
+
+import httpx  # HTTPクライアント（Cookieでセッションを保持する）
+
+# リポジトリ直下のモジュール（db.py など）を読み込めるようにする
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PREFIX = "bench-"
+BENCH_PASSWORD = "bench-password"
+ADMIN_USERNAME = PREFIX + "admin"
+
+# レコードのワード・説明文に使う単語（検索のヒット件数がばらつくように数を絞る）
+VOCABULARY = ("python", "flask", "postgres", "index", "cursor", "session", "template", "thread",
+              "process", "cache", "query", "bcrypt", "stream", "json", "router", "worker")
+
+# 検索対象の項目の組み合わせ（フォームのチェックボックス名。空なら全項目）
+SEARCH_FIELD_SETS = {
+    "all": (),
+    "word": ("search_word",),
+    "summary": ("search_assist",),
+    "details": ("search_details",),
+    "code": ("search_code",),
+    "word+details": ("search_word", "search_details"),
+}
+
+
+# ================================
+# ベンチマーク用データの投入・削除
+# ================================
+def seed(users, tags, records):
+    from db import get_connection, notify, RECORDS_CHANNEL  # DB処理用関数
+    from passwords import hash_password  # 全ユーザー共通のハッシュを1回だけ計算する
+    from tags import notify_tags_changed  # 起動中のアプリのタグキャッシュを捨てる
+
+    password_hash = hash_password(BENCH_PASSWORD)
+    words = list(VOCABULARY)
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO users (username, password, is_admin)
+            VALUES (%s, %s, true)
+            ON CONFLICT (username) DO NOTHING
+        """, (ADMIN_USERNAME, password_hash))
+        cur.execute("""
+            INSERT INTO users (username, password, is_admin)
+            SELECT %s || 'user-' || g, %s, false FROM generate_series(1, %s) g
+            ON CONFLICT (username) DO NOTHING
+        """, (PREFIX, password_hash, users))
+
+        cur.execute("SELECT count(*) AS count FROM tag WHERE name LIKE %s", (PREFIX + "%",))
+        existing_tags = cur.fetchone()['count']
+        cur.execute("""
+            INSERT INTO tag (name)
+            SELECT %s || 'tag-' || g FROM generate_series(%s, %s) g
+        """, (PREFIX, existing_tags + 1, tags))
+        notify_tags_changed(cur)
+
+        # ワード・説明文・要約・コードに単語を散らし、どの検索モードでもヒットするようにする
+        cur.execute("""
+            INSERT INTO records (word, details, tag_id, summary_result, code_result, code_language,
+                                 created_at, updated_at)
+            SELECT %(prefix)s || w.words[1 + g %% w.n] || '-' || g,
+                   'details about ' || w.words[1 + (g / 7) %% w.n] || ' and ' || w.words[1 + (g / 3) %% w.n]
+                       || ' ' || md5(g::text),
+                   t.ids[1 + g %% array_length(t.ids, 1)],
+                   CASE WHEN g %% 10 = 0 THEN '' ELSE 'summary of ' || w.words[1 + (g / 5) %% w.n] END,
+                   'def ' || w.words[1 + (g / 11) %% w.n] || '_' || g || '(): return ' || g,
+                   'python',
+                   now() - g * interval '1 minute', now() - g * interval '1 minute'
+            FROM generate_series(1, %(records)s) g,
+                 (SELECT %(words)s::text[] AS words, %(n)s AS n) w,
+                 (SELECT array_agg(id) AS ids FROM tag WHERE name LIKE %(pattern)s) t
+            ON CONFLICT DO NOTHING
+        """, {'prefix': PREFIX, 'words': words, 'n': len(words), 'records': records,
+              'pattern': PREFIX + "%"})
+        inserted = cur.rowcount
+        notify(cur, RECORDS_CHANNEL)  # 起動中のアプリの検索結果キャッシュを捨てる
+
+        conn.commit()
+
+        for table in ("users", "tag", "records"):
+            cur.execute(f"ANALYZE {table}")
+        conn.commit()
+
+    print(f"✅ ユーザー {users} 件（＋管理者 {ADMIN_USERNAME}）・タグ {tags} 件・レコード {inserted} 件を追加しました。")
+
+
+def clean():
+    from db import get_connection, notify, RECORDS_CHANNEL  # DB処理用関数
+    from tags import notify_tags_changed  # 起動中のアプリのタグキャッシュを捨てる
+
+    pattern = PREFIX + "%"
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM records
+            WHERE word LIKE %s OR tag_id IN (SELECT id FROM tag WHERE name LIKE %s)
+        """, (pattern, pattern))
+        records = cur.rowcount
+        cur.execute("DELETE FROM tag WHERE name LIKE %s", (pattern,))
+        tags = cur.rowcount
+        cur.execute("DELETE FROM users WHERE username LIKE %s", (pattern,))
+        users = cur.rowcount
+        notify_tags_changed(cur)
+        notify(cur, RECORDS_CHANNEL)
+        conn.commit()
+
+    print(f"🗑️ ユーザー {users} 件・タグ {tags} 件・レコード {records} 件を削除しました。")
+
+
+def _seeded_counts():
+    """計測時点のデータ件数（結果のJSONに残す）"""
+    from db import get_connection  # DB処理用関数
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT (SELECT count(*) FROM users) AS users,
+                   (SELECT count(*) FROM tag) AS tags,
+                   (SELECT count(*) FROM records) AS records
+        """)
+        return dict(cur.fetchone())
+
+
+def _bench_tag_ids():
+    from db import get_connection  # DB処理用関数
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id FROM tag WHERE name LIKE %s ORDER BY id", (PREFIX + "%",))
+        return [row['id'] for row in cur.fetchall()]
+
+
+# ================================
+# シナリオ（レスポンスのリストを返す。時間は呼び出し全体で計る）
+# ================================
+class Session:
+    """負荷をかけるスレッドごとのHTTPクライアント（一般ユーザーと管理者のセッション）"""
+
+    def __init__(self, base_url, users, tag_ids, timeout):
+        self.base_url = base_url
+        self.tag_ids = tag_ids
+        self.timeout = timeout
+        self.username = f"{PREFIX}user-{random.randint(1, users)}"
+        self.etags = {}  # 検索URL -> 前回の ETag（再検証シナリオ用）
+        self.user = self._login(self.username)
+        self.admin = self._login(ADMIN_USERNAME)
+
+    def _login(self, username):
+        client = httpx.Client(base_url=self.base_url, timeout=self.timeout)
+        response = client.post("/", data={'username': username, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f"{username} でログインできません（{response.status_code}）。seed を実行しましたか？")
+        return client
+
+    def close(self):
+        self.user.close()
+        self.admin.close()
+
+
+def scenario_login(s):
+    # 毎回新しいクライアントで（bcrypt の照合を含めて）ログインする
+    with httpx.Client(base_url=s.base_url, timeout=s.timeout) as client:
+        return [client.post("/", data={'username': s.username, 'password': BENCH_PASSWORD})]
+
+
+def make_search(match_type, field_set):
+    fields = SEARCH_FIELD_SETS[field_set]
+
+    def scenario(s):
+        keyword = random.choice(VOCABULARY)
+        if match_type == "exact":
+            # 完全一致はワード全体と一致させる（seed のワードは "bench-<単語>-<番号>"）
+            keyword = f"{PREFIX}{keyword}-{random.randint(1, 1000)}"
+        data = {'keyword': keyword, 'match_type': match_type}
+        data.update({name: 'on' for name in fields})
+        if s.tag_ids and random.random() < 0.3:
+            data['tag'] = str(random.choice(s.tag_ids))
+        return [s.user.get("/assist_search", params=data)]
+
+    return scenario
+
+
+def scenario_search_revalidate(s):
+    # 前回と同じ検索を If-None-Match 付きで送る（変更がなければ 304 が返る）
+    params = {'keyword': '', 'match_type': 'partial', 'tag': str(random.choice(s.tag_ids))}
+    etag = s.etags.get(params['tag'])
+    headers = {'If-None-Match': etag} if etag else {}
+    response = s.user.get("/assist_search", params=params, headers=headers)
+    if response.headers.get('ETag'):
+        s.etags[params['tag']] = response.headers['ETag']
+    return [response]
+
+
+def scenario_register(s):
+    data = {
+        'word': f"{PREFIX}reg-{uuid.uuid4().hex[:12]}",
+        'details': "benchmark registration",
+        'tag': str(random.choice(s.tag_ids)),
+        'confirm_submit': '1',
+    }
+    return [s.user.post("/assist_register", data=data)]
+
+
+def scenario_register_assist(s):
+    # 要約とコードの生成を含めた確認画面の表示（LLM_BACKEND=fake で使う）
+    data = {
+        'word': f"{PREFIX}reg-{uuid.uuid4().hex[:12]}",
+        'details': "benchmark registration",
+        'tag': str(random.choice(s.tag_ids)),
+        'confirm_submit': '1',
+        'assist_summary': 'on',
+        'assist_code': 'on',
+    }
+    return [s.user.post("/assist_register", data=data)]
+
+
+def scenario_register_confirm(s):
+    # 確認画面の表示と登録（フォームの送信からリダイレクトまで）を続けて行う
+    data = {
+        'word': f"{PREFIX}reg-{uuid.uuid4().hex[:12]}",
+        'details': "benchmark registration",
+        'tag': str(random.choice(s.tag_ids)),
+    }
+    confirm = s.user.post("/assist_register", data=dict(data, confirm_submit='1'))
+    register = s.user.post("/assist_register/confirm",
+                           data=dict(data, summary_result='', code_result='', code_language=''))
+    return [confirm, register]
+
+
+def scenario_search_list(s):
+    # キーワードなし（タグの絞り込みだけ・新しい順の一覧）
+    data = {'keyword': '', 'match_type': 'partial'}
+    if s.tag_ids:
+        data['tag'] = str(random.choice(s.tag_ids))
+    return [s.user.get("/assist_search", params=data)]
+
+
+def _get(client_name, path):
+    def scenario(s):
+        return [getattr(s, client_name).get(path)]
+    return scenario
+
+
+def build_scenarios():
+    """シナリオ名 -> (関数, 重み)"""
+    scenarios = {
+        "login": (scenario_login, 1),
+        "search:list": (scenario_search_list, 2),
+        "search:revalidate": (scenario_search_revalidate, 1),
+        "register": (scenario_register, 1),
+        "register+confirm": (scenario_register_confirm, 1),
+        "register:assist": (scenario_register_assist, 0),
+        "assist_search:page": (_get("user", "/assist_search"), 1),
+        "admin:users": (_get("admin", "/admin/users"), 1),
+        "admin:tags": (_get("admin", "/admin/tags"), 1),
+        "admin:records": (_get("admin", "/admin/records"), 1),
+    }
+    for match_type in ("partial", "exact"):
+        for field_set in SEARCH_FIELD_SETS:
+            scenarios[f"search:{match_type}:{field_set}"] = (make_search(match_type, field_set), 2)
+    return scenarios
+
+
+# ================================
+# 計測
+# ================================
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # シナリオ名 -> [秒, ...]
+        self.errors = {}  # シナリオ名 -> 件数
+        self.statuses = {}  # シナリオ名 -> {ステータス: 件数}
+
+    def add(self, name, seconds, statuses, error=None):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            counts = self.statuses.setdefault(name, {})
+            for status in statuses:
+                counts[status] = counts.get(status, 0) + 1
+            if error is not None or any(not isinstance(status, int) or status >= 400 for status in statuses):
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def percentile(sorted_values, p):
+    """最近傍順位法のパーセンタイル（sorted_values は昇順）"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, statuses, elapsed):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "status_counts": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(values) / len(values) * 1000, 2) if values else None,
+            "p50": round(percentile(values, 50) * 1000, 2) if values else None,
+            "p95": round(percentile(values, 95) * 1000, 2) if values else None,
+            "p99": round(percentile(values, 99) * 1000, 2) if values else None,
+            "max": round(values[-1] * 1000, 2) if values else None,
+        },
+    }
+
+
+def run_worker(base_url, users, tag_ids, timeout, scenarios, deadline, warmup_until, results):
+    names = list(scenarios)
+    weights = [scenarios[name][1] for name in names]
+    session = Session(base_url, users, tag_ids, timeout)
+    try:
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            func = scenarios[name][0]
+            start = time.perf_counter()
+            error = None
+            try:
+                statuses = [response.status_code for response in func(session)]
+            except httpx.HTTPError as e:
+                statuses = [type(e).__name__]
+                error = e
+            seconds = time.perf_counter() - start
+            if start >= warmup_until:
+                results.add(name, seconds, statuses, error)
+    finally:
+        session.close()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    scenarios = build_scenarios()
+    if args.only:
+        unknown = [name for name in args.only if name not in scenarios]
+        if unknown:
+            raise SystemExit(f"不明なシナリオ: {', '.join(unknown)}（--list で一覧を表示）")
+        # 指定したシナリオは重み0のものも実行する
+        scenarios = {name: (scenarios[name][0], scenarios[name][1] or 1) for name in args.only}
+
+    tag_ids = _bench_tag_ids()
+    if not tag_ids:
+        raise SystemExit("ベンチマーク用のタグがありません。先に seed を実行してください。")
+
+    results = Results()
+    started_at = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    warmup_until = start + args.warmup
+    deadline = warmup_until + args.duration
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_worker, args.url, args.users, tag_ids, args.timeout,
+                                   scenarios, deadline, warmup_until, results)
+                   for _ in range(args.concurrency)]
+        for future in futures:
+            future.result()
+
+    elapsed = time.perf_counter() - warmup_until
+    routes = {name: summarize(results.latencies[name], results.errors.get(name, 0),
+                              results.statuses[name], elapsed)
+              for name in sorted(results.latencies)}
+    all_latencies = [seconds for values in results.latencies.values() for seconds in values]
+    all_statuses = {}
+    for counts in results.statuses.values():
+        for status, count in counts.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": started_at,
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "client_cpu_count": os.cpu_count(),
+            "data": _seeded_counts(),
+        },
+        "total": summarize(all_latencies, sum(results.errors.values()), all_statuses, elapsed),
+        "routes": routes,
+    }
+
+
+def print_table(report):
+    print(f"commit: {report['meta']['commit']}  同時接続: {report['meta']['concurrency']}  "
+          f"計測: {report['meta']['duration_seconds']}秒  データ: {report['meta']['data']}")
+    print(f"{'route':<26} {'req':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, r in list(report['routes'].items()) + [("TOTAL", report['total'])]:
+        latency = r['latency_ms']
+        print(f"{name:<26} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps']:>8} "
+              f"{latency['p50']:>8} {latency['p95']:>8} {latency['p99']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用データの投入と負荷テスト")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = sub.add_parser("seed", help="ベンチマーク用のユーザー・タグ・レコードを追加する")
+    seed_parser.add_argument("--users", type=int, default=100, help="一般ユーザー数（既定: 100）")
+    seed_parser.add_argument("--tags", type=int, default=20, help="タグ数（既定: 20）")
+    seed_parser.add_argument("--records", type=int, default=10000, help="レコード数（既定: 10000）")
+
+    sub.add_parser("clean", help="ベンチマーク用のデータを削除する")
+
+    run_parser = sub.add_parser("run", help="起動中のアプリに負荷をかけて計測する")
+    run_parser.add_argument("--url", default="http://127.0.0.1:5000", help="アプリのURL")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="同時に送るスレッド数（既定: 8）")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="計測する秒数（既定: 30）")
+    run_parser.add_argument("--warmup", type=float, default=3.0, help="集計しない最初の秒数（既定: 3）")
+    run_parser.add_argument("--timeout", type=float, default=30.0, help="1リクエストのタイムアウト秒数")
+    run_parser.add_argument("--users", type=int, default=100, help="seed したユーザー数（ログインに使う）")
+    run_parser.add_argument("--only", nargs="+", help="実行するシナリオ（省略時はすべてを重み付きで混ぜる）")
+    run_parser.add_argument("--list", action="store_true", help="シナリオの一覧を表示して終了する")
+    run_parser.add_argument("-o", "--output", help="結果のJSONを書き出すファイル")
+    run_parser.add_argument("--json", action="store_true", help="結果をJSONで標準出力に出す")
+
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed(args.users, args.tags, args.records)
+    elif args.command == "clean":
+        clean()
+    elif args.list:
+        for name, (_, weight) in build_scenarios().items():
+            print(f"{name:<26} 重み {weight}")
+    else:
+        report = run(args)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            print_table(report)
+
+
+if __name__ == '__main__':
+    main()
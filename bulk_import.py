@@ -0,0 +1,204 @@
+# ================================
+# アシストデータの一括インポート
+# ================================
+# CSV（word,details,tag のヘッダー付き）または JSONL（1行1オブジェクト）から
+# recordsテーブルへまとめて登録する。
+#
+#   python bulk_import.py terms.csv
+#   python bulk_import.py terms.jsonl --generate --concurrency 4
+#
+# 管理画面（/admin/records/import）からのアップロードも同じ import_records() を使う。
+from concurrent.futures import ThreadPoolExecutor, as_completed  # アシスト生成の並列実行用
+from datetime import datetime  # 登録日時用
+from db import get_connection, insert_records  # DB処理用関数
+from llm import generate_summaries, generate_code, extract_code_and_language  # ChatGPT呼び出し用
+from tags import get_tags  # タグ一覧キャッシュ
+import argparse  # コマンドライン引数
+import csv  # CSV読み込み
+import io  # アップロードされたファイルの読み込み
+import json  # JSONL読み込み
+import sys  # 進捗の表示先
+
+# 同時に実行するアシスト生成の既定数（OpenAIのレート制限に合わせて調整する）
+DEFAULT_CONCURRENCY = 4
+
+
+def read_rows(stream, fmt):
+    """テキストストリームから {'word', 'details', 'tag'} の辞書のリストを読み込む"""
+    if fmt == 'jsonl':
+        rows = []
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError(f"{number}行目: JSONのオブジェクトではありません")
+            rows.append(row)
+        return rows
+    return list(csv.DictReader(stream))
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def _resolve_tag(value, tags):
+    """タグ名（大文字小文字を区別しない）またはタグIDからIDを返す"""
+    value = str(value or '').strip()
+    if value in tags['by_id']:
+        return int(value)
+    return tags['by_name'].get(value.lower())
+
+
+def _existing_pairs(cur, pairs):
+    """(word, tag_id) の組み合わせのうち、すでに登録済みのものを1回のクエリで調べる"""
+    if not pairs:
+        return set()
+    words = [word for word, _ in pairs]
+    tag_ids = [tag_id for _, tag_id in pairs]
+    cur.execute("""
+        SELECT records.word, records.tag_id
+        FROM records
+        JOIN unnest(%s::text[], %s::int[]) AS incoming(word, tag_id)
+          ON records.word = incoming.word AND records.tag_id = incoming.tag_id
+    """, (words, tag_ids))
+    return {(row['word'], row['tag_id']) for row in cur.fetchall()}
+
+
+def _generate(items, concurrency, progress):
+    """各行の要約とコードを生成する（失敗した行は空のまま登録）
+
+    要約は複数件をまとめたプロンプトで生成し、コードは1件ずつ同時実行数を制限しながら生成する。
+    """
+    errors = 0
+    total = len(items) * 2
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(generate_summaries, [(item['word'], item['details']) for item in items]): None}
+        for item in items:
+            futures[executor.submit(generate_code, item['word'], item['details'], item['tag_name'])] = item
+
+        for future in as_completed(futures):
+            item = futures[future]
+
+            if item is None:
+                # まとめて生成した要約
+                try:
+                    summaries, summary_errors = future.result()
+                except Exception as e:
+                    summaries, summary_errors = {}, {index: e for index in range(len(items))}
+                for index, summary in summaries.items():
+                    items[index]['summary_result'] = summary
+                for index, e in summary_errors.items():
+                    print(f"アシスト生成エラー（{items[index]['word']} / summary）:", e, file=sys.stderr)
+                errors += len(summary_errors)
+                done += len(items)
+            else:
+                try:
+                    item['code_language'], item['code_result'] = extract_code_and_language(future.result())
+                except Exception as e:
+                    print(f"アシスト生成エラー（{item['word']} / code）:", e, file=sys.stderr)
+                    errors += 1
+                done += 1
+            progress('generate', done, total)
+
+    return errors
+
+
+def import_records(rows, generate=False, concurrency=DEFAULT_CONCURRENCY, dry_run=False, progress=None):
+    """読み込んだ行を検証・重複除外してまとめて登録し、件数の集計を返す
+
+    ・タグはキャッシュ済みのタグ一覧から名前（またはID）で解決する
+    ・既存データとの重複は (word, tag_id) の組をまとめて1回のクエリで判定する
+    ・ファイル内の重複は最初の1件だけ登録する
+    ・generate=True のときは要約とコードを concurrency 件ずつ並列に生成する
+    """
+    progress = progress or (lambda stage, done, total: None)
+    summary = {'total': len(rows), 'invalid': 0, 'unknown_tag': 0, 'duplicates': 0,
+               'inserted': 0, 'generation_errors': 0}
+
+    tags = get_tags()
+
+    # 入力チェックとタグの解決
+    items = []
+    seen = set()
+    for row in rows:
+        word = str(row.get('word') or '').strip()
+        details = str(row.get('details') or '').strip()
+        if not word or not details or not row.get('tag'):
+            summary['invalid'] += 1
+            continue
+
+        tag_id = _resolve_tag(row.get('tag'), tags)
+        if tag_id is None:
+            summary['unknown_tag'] += 1
+            continue
+
+        if (word, tag_id) in seen:
+            summary['duplicates'] += 1
+            continue
+        seen.add((word, tag_id))
+
+        items.append({'word': word, 'details': details, 'tag_id': tag_id,
+                      'tag_name': tags['by_id'][str(tag_id)],
+                      'summary_result': '', 'code_result': '', 'code_language': ''})
+    progress('validate', len(rows), len(rows))
+
+    # 既存データとの重複を除外
+    with get_connection() as conn, conn.cursor() as cur:
+        existing = _existing_pairs(cur, [(item['word'], item['tag_id']) for item in items])
+    if existing:
+        summary['duplicates'] += sum(1 for item in items if (item['word'], item['tag_id']) in existing)
+        items = [item for item in items if (item['word'], item['tag_id']) not in existing]
+
+    if generate and items and not dry_run:
+        summary['generation_errors'] = _generate(items, concurrency, progress)
+
+    if items and not dry_run:
+        now = datetime.now()
+        inserted = insert_records([
+            (item['word'], item['details'], item['tag_id'], item['summary_result'],
+             item['code_result'], item['code_language'], now, now)
+            for item in items
+        ])
+        # 確認後に他で登録されたものは飛ばされるので、その分は重複として数える
+        summary['inserted'] = inserted
+        summary['duplicates'] += len(items) - inserted
+    progress('insert', summary['inserted'], len(items))
+
+    return summary
+
+
+def import_file(stream, filename, **options):
+    """アップロードされたファイル（バイナリ）を読み込んでインポートする"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return import_records(read_rows(text, detect_format(filename)), **options)
+
+
+# ================================
+# コマンドラインからの実行
+# ================================
+def main():
+    parser = argparse.ArgumentParser(description="CSV / JSONL からアシストデータを一括登録する")
+    parser.add_argument("path", help="インポートするファイル（word,details,tag）")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="ファイル形式（省略時は拡張子で判定）")
+    parser.add_argument("--generate", action="store_true", help="要約とコードをChatGPTで生成する")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="アシスト生成の同時実行数")
+    parser.add_argument("--dry-run", action="store_true", help="登録せずに件数だけ確認する")
+    args = parser.parse_args()
+
+    def progress(stage, done, total):
+        print(f"\r[{stage}] {done}/{total}", end="\n" if done >= total else "", file=sys.stderr, flush=True)
+
+    with open(args.path, encoding="utf-8-sig", newline="") as f:
+        rows = read_rows(f, args.format or detect_format(args.path))
+
+    summary = import_records(rows, generate=args.generate, concurrency=args.concurrency,
+                             dry_run=args.dry_run, progress=progress)
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
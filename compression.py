@@ -0,0 +1,139 @@
+# ================================
+# レスポンスの圧縮（gzip / brotli）
+# ================================
+# HTML・JSON・CSVなどのテキストのレスポンスを、ブラウザの Accept-Encoding に合わせて圧縮する。
+# app.py の after_request から compress_response() を呼ぶ。
+#
+#   ・COMPRESS_MIN_SIZE バイト未満のレスポンスは圧縮しない（小さいものは圧縮しても得にならない）
+#   ・ストリーミングのレスポンス（エクスポートなど）は全体をためずに、送りながら圧縮する
+#   ・Content-Encoding 設定済みのもの（assets.py の圧縮済みファイル）や send_file のファイルはそのまま
+#   ・Server-Sent Events は1イベントずつすぐ届ける必要があるので圧縮しない
+#
+# 圧縮率とCPU時間のルートごとの比較は bench/compression_bench.py を参照。
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from flask import request  # Accept-Encoding の参照
+import os  # OS関連操作（環境変数など）
+import zlib  # gzip圧縮
+
+try:
+    import brotli  # brotli圧縮（なければ gzip だけ使う）
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+# 圧縮の設定（.envで上書き可能）
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "1") == "1"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))  # これ未満のバイト数は圧縮しない
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))  # 1（速い）〜9（小さい）
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))  # 0（速い）〜11（小さい）
+
+# 圧縮するContent-Type（text/event-stream は含めない）
+COMPRESS_MIMETYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'text/xml',
+    'application/json', 'application/javascript', 'application/x-ndjson', 'application/xml',
+}
+
+# 優先する順
+COMPRESS_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+# ================================
+# 圧縮器（一括・ストリーミング共通）
+# ================================
+class _GzipCompressor:
+    def __init__(self, level):
+        # wbits=31 … zlib形式ではなくgzip形式（ヘッダー・CRC付き）で出力する
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def make_compressor(encoding, gzip_level=None, brotli_quality=None):
+    if encoding == 'br':
+        return _BrotliCompressor(COMPRESS_BROTLI_QUALITY if brotli_quality is None else brotli_quality)
+    return _GzipCompressor(COMPRESS_GZIP_LEVEL if gzip_level is None else gzip_level)
+
+
+def compress(data, encoding, **options):
+    """bytes を一括で圧縮する"""
+    compressor = make_compressor(encoding, **options)
+    return compressor.compress(data) + compressor.finish()
+
+
+def choose_encoding(accept_encodings):
+    """Accept-Encoding から使う圧縮方式を選ぶ（受け取れるものがなければ None）"""
+    for encoding in COMPRESS_ENCODINGS:
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def _compress_stream(chunks, compressor):
+    # 圧縮器が内部にためた分だけを返すので、小さな行を1つずつ渡しても細切れにはならない
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # 途中で切断されたときも元のジェネレーターの後始末（DB接続の返却など）を行う
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+# ================================
+# after_request から呼ぶ
+# ================================
+def compress_response(response):
+    if not COMPRESS_ENABLED or request.method == 'HEAD':
+        return response
+    if response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return response
+
+    # 同じURLでも Accept-Encoding によって中身が変わることをキャッシュに伝える
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, make_compressor(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+
+    # 圧縮後のバイト列は元と違うので、強いETagは弱いETagにする（比較の意味は変わらない）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,7 +1,16 @@
 import psycopg2  # PostgreSQLに接続するためのライブラリ
+from psycopg2 import extensions  # 接続・トランザクション状態の定数
 from psycopg2.extras import RealDictCursor  # クエリ結果を辞書形式で取得できるようにする
+from psycopg2.extras import execute_values  # 複数行をまとめてINSERTする
 from dotenv import load_dotenv  # .envファイルから環境変数を読み込むライブラリ
+from contextlib import contextmanager  # with文で使える接続の貸し出し用
 import os  # OSから環境変数を取得するための標準ライブラリ
+import select  # LISTEN中の接続の待ち受け用
+import threading  # プールの排他制御用
+import time  # 待ち時間・接続寿命の計測用
+import metrics  # クエリ時間・接続取得時間の計測
+from slow_queries import slow_query_log, normalize_sql  # 遅いクエリの記録
+from highlight import highlight_code  # コードのハイライト（登録時に1回だけ）
 
 # .envファイルを読み込む（プロジェクト起動時に一度実行）
 load_dotenv()
@@ -9,75 +18,559 @@ load_dotenv()
 # .envファイルから接続用URL（DATABASE_URL）を取得
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# PostgreSQLへの接続を返す関数（共通して使えるようにする）
+# SSLモード（RenderのDBなどでは require が必要。ローカル開発では disable などに変更可能）
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
+
+# コネクションプールの設定（.envで上書き可能）
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))  # 常に確保しておく接続数
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))  # 1プロセスあたりの最大接続数
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # 空き接続を待つ最大秒数
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # 接続を作り直すまでの秒数
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))  # この秒数以上使われていない接続は貸し出し前に確認
+
+
+# ================================
+# コネクションプール
+# ================================
+class PoolTimeout(Exception):
+    """空き接続を待っている間にタイムアウトしたときの例外"""
+
+
+class ConnectionPool:
+    """スレッドセーフなPostgreSQLコネクションプール
+
+    ・最小／最大接続数の範囲で接続を使い回す
+    ・一定時間使われていなかった接続は貸し出し前に SELECT 1 で生存確認する
+    ・max_lifetime を過ぎた接続は返却時・貸し出し時に作り直す
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=10.0,
+                 max_lifetime=1800.0, health_check_after=30.0, **connect_kwargs):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.connect_kwargs = connect_kwargs
+        self.pid = os.getpid()  # gunicornのfork後に作り直すための目印
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, 作成時刻, 最終使用時刻)] 末尾ほど最近使われた接続
+        self._in_use = {}  # id(conn) -> 作成時刻
+        self._size = 0  # 作成済み（作成中を含む）の接続数
+        self._waiting = 0  # 空き待ちのスレッド数
+
+        # 統計情報
+        self._stats = {
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "health_check_failures": 0,
+        }
+
+        # 最小接続数まで先に作っておく
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            now = time.monotonic()
+            with self._cond:
+                self._idle.append((conn, now, now))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._cond:
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["connections_closed"] += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """接続を1つ借りる（空きがなければ timeout 秒まで待つ）"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            conn = None
+            create = False
+
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["checkout_failures"] += 1
+                        raise PoolTimeout(f"{self.timeout}秒以内に空き接続を取得できませんでした。")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    self._size += 1  # 作成中の枠を先に確保
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._stats["checkout_failures"] += 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+            else:
+                now = time.monotonic()
+                # 寿命切れの接続は作り直す
+                if conn.closed or now - created_at >= self.max_lifetime:
+                    self._close(conn)
+                    continue
+                # しばらく使われていなかった接続は生存確認してから貸し出す
+                if now - last_used >= self.health_check_after and not self._is_healthy(conn):
+                    with self._cond:
+                        self._stats["health_check_failures"] += 1
+                    self._close(conn)
+                    continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._in_use[id(conn)] = created_at
+                self._stats["checkouts"] += 1
+                self._stats["wait_time_total"] += waited
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """借りた接続を返す（未確定のトランザクションはロールバックする）"""
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+
+        if created_at is None:
+            # このプールの接続ではない（fork前の接続など）
+            conn.close()
+            return
+
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+        if discard or conn.closed or time.monotonic() - created_at >= self.max_lifetime:
+            self._close(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """プールの状態（使用中・待機中の接続数、待ち時間、失敗回数など）"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+
+# クエリ1回ごとの時間を計測するカーソル（結果は RealDictCursor と同じく辞書形式）
+#   SLOW_QUERY_THRESHOLD_MS を超えたクエリは slow_query_log に記録し、
+#   一定の割合で EXPLAIN (ANALYZE, BUFFERS) の結果も保存する。
+class TimedCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        succeeded = False
+        try:
+            result = super().execute(query, vars)
+            succeeded = True
+            return result
+        finally:
+            self._finish(query, vars, time.perf_counter() - start, succeeded)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._finish(query, None, time.perf_counter() - start, False)
+
+    def _finish(self, query, vars, seconds, succeeded):
+        metrics.observe_query(seconds)
+        if not slow_query_log.is_slow(seconds):
+            return
+
+        normalized = normalize_sql(query)
+        plan = None
+        # 名前付きカーソル（DECLARE）は実行計画を取り直さない
+        if succeeded and self.name is None and slow_query_log.should_explain(normalized):
+            plan = self._explain(query, vars)
+        slow_query_log.record(normalized, vars, seconds, metrics.current_endpoint(), plan)
+
+    def _explain(self, query, vars):
+        """同じクエリを EXPLAIN (ANALYZE, BUFFERS) で実行し直した結果を返す
+
+        失敗しても呼び出し側のトランザクションを壊さないよう、セーブポイントの中で実行する。
+        """
+        conn = self.connection
+        if conn.info.transaction_status not in (extensions.TRANSACTION_STATUS_IDLE,
+                                                extensions.TRANSACTION_STATUS_INTRANS):
+            return None
+        use_savepoint = not conn.autocommit
+        try:
+            # 計測しない普通のカーソルを使う（再帰的に記録しない）
+            with conn.cursor(cursor_factory=extensions.cursor) as cur:
+                if use_savepoint:
+                    cur.execute("SAVEPOINT slow_query_explain")
+                try:
+                    prefix = b"EXPLAIN (ANALYZE, BUFFERS) " if isinstance(query, bytes) else "EXPLAIN (ANALYZE, BUFFERS) "
+                    cur.execute(prefix + query, vars)
+                    plan = "\n".join(row[0] for row in cur.fetchall())
+                except Exception:
+                    if use_savepoint:
+                        cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    raise
+                if use_savepoint:
+                    cur.execute("RELEASE SAVEPOINT slow_query_explain")
+                return plan
+        except Exception as e:
+            print("EXPLAIN取得エラー:", e)
+            return None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """プロセスごとのプールを返す（gunicornのworkerごとに初回アクセス時に作成）"""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                    sslmode=DB_SSLMODE,              # SSL接続を要求（RenderのDBなどで必要）
+                    cursor_factory=TimedCursor       # 結果を辞書形式で受け取る（カラム名付き・時間を計測）
+                )
+    return _pool
+
+
+def pool_stats():
+    """現在のプロセスのプール統計を返す（未作成なら空の辞書）"""
+    if _pool is None or _pool.pid != os.getpid():
+        return {}
+    return _pool.stats()
+
+
+# PostgreSQLへの接続をプールから貸し出す（with文で使う）
+#   with get_connection() as conn, conn.cursor() as cur:
+#       cur.execute(...)
+#       conn.commit()
+@contextmanager
 def get_connection():
-    # 接続処理（失敗時はエラーが発生）
-    return psycopg2.connect(
-        DATABASE_URL,                # .envに設定された接続URLを使用
-        sslmode="require",           # SSL接続を要求（RenderのDBなどで必要）
-        cursor_factory=RealDictCursor  # 結果を辞書形式で受け取る（カラム名付き）
-    )
+    pool = get_pool()
+    start = time.perf_counter()
+    conn = pool.getconn()
+    metrics.observe_acquire(time.perf_counter() - start)
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # 接続自体が壊れている可能性があるのでプールに戻さない
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+# ================================
+# LISTEN/NOTIFY による変更通知
+# ================================
+# gunicornの各workerが持つキャッシュを、どのworkerで更新が起きても無効化できるようにする。
+# 通知はCOMMIT時に全接続へ配信されるので、ロールバックされた更新では無効化されない。
+class NotificationListener:
+    """専用の接続で LISTEN し、通知を受けたらチャンネルごとのコールバックを呼ぶバックグラウンドスレッド
+
+    接続が切れた場合は通知を取りこぼしている可能性があるため、
+    再接続時に全チャンネルのコールバックを呼んでキャッシュを捨てさせる。
+    """
+
+    def __init__(self, dsn, reconnect_delay=5.0, **connect_kwargs):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._callbacks = {}  # channel -> [callback]
+        self._thread = None
+        self._pid = None
+        self._connected = threading.Event()
+        self._listening = set()  # LISTEN 済みのチャンネル
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+        self.ensure_started()
+
+    def is_listening(self, channel=None):
+        """通知を受け取れる状態か（Falseの間はキャッシュを信用しない）
+
+        channel を指定した場合は、そのチャンネルの LISTEN が済んでいるかも確認する
+        （後から subscribe したチャンネルは、次の待ち受けの区切りで LISTEN される）。
+        """
+        if not (self._connected.is_set() and self._pid == os.getpid()):
+            return False
+        if channel is None:
+            return True
+        with self._lock:
+            return channel in self._listening
+
+    def ensure_started(self):
+        # fork後のworkerではスレッドが引き継がれないので作り直す
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._connected.clear()
+            self._thread = threading.Thread(target=self._run, name="db-listener", daemon=True)
+            self._thread.start()
+
+    def _fire(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, []))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print("通知処理エラー:", channel, e)
+
+    def _fire_all(self):
+        with self._lock:
+            channels = list(self._callbacks)
+        for channel in channels:
+            self._fire(channel, None)
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+                conn.autocommit = True
+                listening = set()
+
+                while True:
+                    # 後から subscribe されたチャンネルも LISTEN する
+                    with self._lock:
+                        channels = set(self._callbacks)
+                    with conn.cursor() as cur:
+                        for channel in channels - listening:
+                            cur.execute(f'LISTEN "{channel}"')
+                    if channels - listening:
+                        if not listening:
+                            # 接続前の変更は通知されていないので、いったん全部捨てる
+                            self._fire_all()
+                        listening |= channels
+                        with self._lock:
+                            self._listening = set(listening)
+                        self._connected.set()
+
+                    if select.select([conn], [], [], 5.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            notification = conn.notifies.pop(0)
+                            self._fire(notification.channel, notification.payload)
+
+            except Exception as e:
+                print("LISTEN接続エラー:", e)
+            finally:
+                self._connected.clear()
+                with self._lock:
+                    self._listening = set()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(self.reconnect_delay)
+
+
+listener = NotificationListener(DATABASE_URL, sslmode=DB_SSLMODE)
+
+# レコードの変更を通知するチャンネル名（検索結果キャッシュの無効化用。search_cache.py を参照）
+RECORDS_CHANNEL = "records_changed"
+
+
+# 変更を他のworkerへ通知する（通知はCOMMIT時に送られる）
+def notify(cur, channel, payload=''):
+    cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+
 
 # ユーザー登録を行う関数（Flaskのsignup処理などから呼び出す用）
 def insert_user(username, hashed_password):
     try:
-        # データベースへ接続
-        conn = get_connection()
-        cur = conn.cursor()
-
-        # usersテーブルにデータを挿入（nicknameは省略）
-        cur.execute(
-            "INSERT INTO users (username, password) VALUES (%s, %s)",
-            (username, hashed_password)
-        )
+        # プールから接続を借りる
+        with get_connection() as conn, conn.cursor() as cur:
+
+            # usersテーブルにデータを挿入（nicknameは省略）
+            cur.execute(
+                "INSERT INTO users (username, password) VALUES (%s, %s)",
+                (username, hashed_password)
+            )
 
-        # 変更内容を保存（INSERTなどの操作では必要）
-        conn.commit()
+            # 変更内容を保存（INSERTなどの操作では必要）
+            conn.commit()
 
     except Exception as e:
         # エラー発生時に内容を表示し、上位にエラーを送る
         print("ユーザー登録エラー:", e)
         raise
 
-    finally:
-        # カーソルと接続をクローズしてリソースを開放
-        cur.close()
-        conn.close()
+
+# recordsテーブルに登録するカラム（insert_record / insert_records 共通）
+#   最後の code_html は code_result / code_language からここで作る（呼び出し側は渡さない）
+RECORD_INSERT_COLUMNS = (
+    "word", "details", "tag_id", "summary_result", "code_result", "code_language", "created_at", "updated_at",
+    "code_html"
+)
+_RECORD_INSERT_VALUES = ", ".join(["%s"] * len(RECORD_INSERT_COLUMNS))
+
+
+# ワード＋タグの組み合わせを一意にする制約
+#   登録・編集時の重複チェックはこの制約に任せる（事前のSELECTは行わない）。
+#   制約は schema.py のマイグレーションで作成する。
+RECORD_UNIQUE_CONSTRAINT = "records_word_tag_id_key"
+
+
+# 1件登録して (id, タグ名) を返す（同じワード＋タグがすでにあれば None）
+#   重複チェック・登録・タグ名の取得を1文で行う（往復1回、同時に登録されても重複しない）
+def register_record(cur, word, details, tag_id, summary_result, code_result, code_language, now):
+    cur.execute(f"""
+        WITH inserted AS (
+            INSERT INTO records
+            ({', '.join(RECORD_INSERT_COLUMNS)})
+            VALUES ({_RECORD_INSERT_VALUES})
+            ON CONFLICT ON CONSTRAINT {RECORD_UNIQUE_CONSTRAINT} DO NOTHING
+            RETURNING id, tag_id
+        )
+        SELECT inserted.id, tag.name AS tag_name
+        FROM inserted
+        JOIN tag ON tag.id = inserted.tag_id
+    """, (word, details, tag_id, summary_result, code_result, code_language, now, now,
+          highlight_code(code_result, code_language)))
+    return cur.fetchone()
 
 
 # recordsテーブルに新しいデータを挿入する関数
 def insert_record(word, details, tag, summary_result, code_result, code_language, created_at, updated_at):
     try:
-        # PostgreSQLに接続
-        conn = get_connection()
-        cur = conn.cursor()
+        # プールから接続を借りる
+        with get_connection() as conn, conn.cursor() as cur:
 
-        # INSERT文を実行してデータを追加
-        cur.execute("""
-            INSERT INTO records
-            (word, details, tag, summary_result, code_result, code_language, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            word,             # ワード
-            details,          # 説明
-            tag,              # タグ（言語）
-            summary_result,   # デキスギの要約
-            code_result,      # コード例
-            code_language,    # コードの言語（例：python, javascript）
-            created_at,       # 作成日時
-            updated_at        # 更新日時
-        ))
-
-        # 変更を保存（コミット）
-        conn.commit()
+            # INSERT文を実行してデータを追加
+            cur.execute(f"""
+                INSERT INTO records
+                ({', '.join(RECORD_INSERT_COLUMNS)})
+                VALUES ({_RECORD_INSERT_VALUES})
+            """, (
+                word,             # ワード
+                details,          # 説明
+                tag,              # タグID
+                summary_result,   # デキスギの要約
+                code_result,      # コード例
+                code_language,    # コードの言語（例：python, javascript）
+                created_at,       # 作成日時
+                updated_at,       # 更新日時
+                highlight_code(code_result, code_language)  # ハイライト済みのコード
+            ))
+            notify(cur, RECORDS_CHANNEL)  # 全workerの検索結果キャッシュを無効化
+
+            # 変更を保存（コミット）
+            conn.commit()
 
     except Exception as e:
         # エラーが発生した場合は内容を表示して再送出
         print("登録エラー:", e)
         raise
 
-    finally:
-        # 使用後はカーソルと接続を閉じる
-        cur.close()
-        conn.close()
 
+# recordsテーブルに複数のデータをまとめて挿入する関数（一括インポート用）
+#   rows … insert_record の引数と同じ順番の値のタプルのリスト
+#   page_size 件ずつ1つのINSERT文にまとめるので、往復回数は件数 / page_size 回で済む
+#   すでに登録済みのワード＋タグは飛ばし、実際に登録した件数を返す
+def insert_records(rows, page_size=500):
+    try:
+        # プールから接続を借りる
+        with get_connection() as conn, conn.cursor() as cur:
+
+            # 複数行のVALUESをまとめて送信
+            inserted = execute_values(cur, f"""
+                INSERT INTO records
+                ({', '.join(RECORD_INSERT_COLUMNS)})
+                VALUES %s
+                ON CONFLICT ON CONSTRAINT {RECORD_UNIQUE_CONSTRAINT} DO NOTHING
+                RETURNING id
+            """, [(*row, highlight_code(row[4], row[5])) for row in rows], page_size=page_size, fetch=True)
+            if inserted:
+                notify(cur, RECORDS_CHANNEL)  # 全workerの検索結果キャッシュを無効化
+
+            # すべて登録できたときだけ確定する
+            conn.commit()
+
+        return len(inserted)
+
+    except Exception as e:
+        # エラーが発生した場合は内容を表示して再送出
+        print("一括登録エラー:", e)
+        raise
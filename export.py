@@ -0,0 +1,150 @@
+# ================================
+# アシストデータのエクスポート
+# ================================
+# サーバーサイドカーソル（名前付きカーソル）で EXPORT_FETCH_SIZE 件ずつ取り出し、
+# CSV / JSONL として1行ずつ書き出す。件数が増えてもメモリ使用量は一定。
+#
+#   python export.py > records.csv
+#   python export.py --format jsonl --tag Python --updated-since 2024-01-01 -o records.jsonl
+#
+# 管理画面（/admin/records/export）からのダウンロードも同じ iter_export() を使う。
+from datetime import datetime  # 更新日時の絞り込み用
+from db import get_connection  # DB処理用関数
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from tags import get_tags  # タグ一覧キャッシュ
+import argparse  # コマンドライン引数
+import csv  # CSV書き出し
+import io  # CSVの1行分のバッファ
+import json  # JSONL書き出し
+import os  # OS関連操作（環境変数など）
+import sys  # 標準出力への書き出し
+
+load_dotenv()
+
+# サーバーサイドカーソルから1回に取り出す件数
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+
+# 出力する列（bulk_import.py で読み込める word,details,tag を先頭に置く）
+EXPORT_COLUMNS = ("id", "word", "details", "tag", "summary_result", "code_result",
+                  "code_language", "created_at", "updated_at")
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+
+def parse_updated_since(value):
+    """'2024-01-01' / '2024-01-01T09:00:00' 形式の文字列を datetime にする（空なら None）"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def resolve_tag_id(value):
+    """タグ名（大文字小文字を区別しない）またはタグIDからIDを返す（空なら None）"""
+    value = str(value or '').strip()
+    if not value:
+        return None
+    tags = get_tags()
+    if value in tags['by_id']:
+        return int(value)
+    tag_id = tags['by_name'].get(value.lower())
+    if tag_id is None:
+        raise ValueError(f"タグが見つかりません: {value}")
+    return tag_id
+
+
+def build_export_query(tag_id=None, updated_since=None):
+    """エクスポート用の (SQL, パラメータ) を返す"""
+    conditions = []
+    params = []
+    if tag_id is not None:
+        conditions.append("records.tag_id = %s")
+        params.append(tag_id)
+    if updated_since is not None:
+        conditions.append("records.updated_at >= %s")
+        params.append(updated_since)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    sql = f"""
+        SELECT records.id, records.word, records.details, tag.name AS tag,
+               records.summary_result, records.code_result, records.code_language,
+               records.created_at, records.updated_at
+        FROM records
+        JOIN tag ON records.tag_id = tag.id
+        {where}
+        ORDER BY records.id
+    """
+    return sql, params
+
+
+def iter_records(tag_id=None, updated_since=None, fetch_size=EXPORT_FETCH_SIZE):
+    """条件に合うレコードを id 順に1件ずつ返す（名前付きカーソルで fetch_size 件ずつ取得）"""
+    sql, params = build_export_query(tag_id, updated_since)
+
+    # 名前付きカーソルはトランザクション内でのみ有効。
+    # 途中で打ち切られても、接続をプールへ返すときのロールバックでカーソルも閉じられる。
+    with get_connection() as conn, conn.cursor(name="records_export") as cur:
+        cur.itersize = fetch_size
+        cur.execute(sql, params)
+        for row in cur:
+            yield row
+
+
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def iter_export(fmt='csv', tag_id=None, updated_since=None, fetch_size=EXPORT_FETCH_SIZE):
+    """レコードを CSV / JSONL の行（文字列）として順に返す"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未対応の形式です: {fmt}")
+
+    if fmt == 'csv':
+        yield _csv_line(EXPORT_COLUMNS)
+
+    for row in iter_records(tag_id, updated_since, fetch_size):
+        values = [_format_value(row[column]) for column in EXPORT_COLUMNS]
+        if fmt == 'csv':
+            yield _csv_line(values)
+        else:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False) + "\n"
+
+
+# ================================
+# コマンドラインからの実行
+# ================================
+def main():
+    parser = argparse.ArgumentParser(description="アシストデータを CSV / JSONL で書き出す")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv", help="出力形式（既定: csv）")
+    parser.add_argument("--tag", help="タグ名またはタグIDで絞り込む")
+    parser.add_argument("--updated-since", help="この日時以降に更新されたものだけ（例: 2024-01-01）")
+    parser.add_argument("--fetch-size", type=int, default=EXPORT_FETCH_SIZE, help="1回に取り出す件数")
+    parser.add_argument("-o", "--output", help="出力ファイル（省略時は標準出力）")
+    args = parser.parse_args()
+
+    try:
+        tag_id = resolve_tag_id(args.tag)
+        updated_since = parse_updated_since(args.updated_since)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        for line in iter_export(args.format, tag_id, updated_since, args.fetch_size):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# ================================
+# 非同期モード（gevent）での起動設定
+# ================================
+# 通常の同期worker（gunicorn -w 4 app:app）は、1プロセスで同時に1リクエストしか処理できず、
+# PostgreSQL や ChatGPT の応答を待つ間もプロセスを占有する。
+# このモードでは gevent のworkerを使い、1プロセスで ASYNC_WORKER_CONNECTIONS 件までのリクエストを
+# 並行に処理する（待ち時間の間に他のリクエストを進める）。ルートとテンプレートは同じものを使う。
+#
+#   gunicorn -c gunicorn_async_conf.py app:app
+#   WEB_CONCURRENCY=2 ASYNC_WORKER_CONNECTIONS=500 gunicorn -c gunicorn_async_conf.py -b 0.0.0.0:8000 app:app
+#
+# 待ち時間が協調的（他のリクエストに処理を譲る）になる仕組み:
+#   ・PostgreSQL … psycogreen で psycopg2 の待ち受けを gevent に渡す（post_fork で設定）
+#   ・ChatGPT    … OpenAIクライアント（httpx）のソケットを gevent の monkey patch が置き換える
+#   ・bcrypt     … passwords.py が gevent の本物のOSスレッドで計算する（イベントループを止めない）
+#   ・LISTEN/NOTIFY・SSE・スレッドプール … threading / select / queue が gevent 版になる
+#
+# 同時に処理するリクエストが増えても、DBの接続数は DB_POOL_MAX_SIZE（プロセスごと）で頭打ちになり、
+# 超えた分はプールの空きを待つ。PostgreSQL の max_connections を workers × DB_POOL_MAX_SIZE が超えないようにする。
+# 同期workerとの比較方法は bench/compare_serving.py を参照。
+#
+# 計測結果（同期worker と gevent worker、結果のJSONは bench/results/compare_serving.json）
+#   環境: 1 CPU のLinux・同じマシンのPostgreSQL・データはユーザー100 / タグ20 / レコード20000
+#   BCRYPT_ROUNDS=4 python bench/load_bench.py seed --users 100 --tags 20 --records 20000
+#   python bench/compare_serving.py --modes sync gevent --workers 2 --users 100 --concurrency 32 --duration 30 \
+#       -o bench/results/compare_serving.json
+#   （偽のChatGPT: 応答時間の中央値 0.8秒・ばらつき 0.5、gevent の同時処理数 200/プロセス、どちらも2プロセス）
+#
+#   route                 sync req/s   sync p95(ms)   gevent req/s   gevent p95(ms)
+#   register:assist             1.09        7914.55           6.41          2818.22
+#   search:partial:all          2.41        5896.48          11.85          2162.52
+#   search:exact:word           2.01        5874.09          10.49          1588.01
+#   search:list                 2.27        6260.04          12.29          1396.70
+#   admin:users                 1.03        6539.35           5.97          1147.60
+#   合計                        8.81        6260.04          47.01          2012.09
+#
+#   同期workerでは ChatGPT を待つ register:assist が2プロセスを占有し、検索まで待たされる。
+#   gevent では待ち時間の間に他のリクエストを進めるので、合計で約5.3倍になった。
+#   gevent の admin:users の2件のエラーは、計測終了時にサーバーを止めたときの切断（ReadError）。
+#   1 CPU で負荷をかける側も同じマシンなので、数値は絶対値ではなく同じ条件での比較として読む。
+import multiprocessing  # CPU数
+import os  # OS関連操作（環境変数など）
+
+bind = os.getenv("BIND", "127.0.0.1:8000")
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_connections = int(os.getenv("ASYNC_WORKER_CONNECTIONS", "200"))  # 1プロセスで同時に処理するリクエスト数
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+# ChatGPTの同時呼び出し数（llm.py のスレッドプール）は、同時に処理するリクエスト数に合わせて広げる
+os.environ.setdefault("LLM_MAX_WORKERS", str(worker_connections))
+
+
+def post_fork(server, worker):
+    # workerごとに、アプリ（db.py）がPostgreSQLに接続する前に設定する
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
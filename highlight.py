@@ -0,0 +1,112 @@
+# ================================
+# コードのシンタックスハイライト（サーバー側・保存時に1回だけ）
+# ================================
+# extract_code_and_language() で取り出したコードと言語から、Pygments でハイライト済みのHTMLを作り、
+# records.code_html に保存する。検索ページはこのHTMLをそのまま表示するので、ブラウザ側の処理はない。
+#
+# code_result / code_language が変わると、DBのトリガーが code_html を NULL に戻す（schema.py のバージョン7）。
+# NULL のレコードは表示時にその場でハイライトし、次のコマンドでまとめて保存し直せる:
+#
+#   python highlight.py                 # code_html が未作成のレコードを埋める
+#   python highlight.py --css > static/pygments.css   # 配色を変えたときのCSSの作り直し
+from pygments import highlight  # ハイライト処理
+from pygments.formatters import HtmlFormatter  # HTML出力
+from pygments.lexers import get_lexer_by_name  # 言語名からの字句解析器
+from pygments.lexers.special import TextLexer  # 未知の言語・plaintext 用
+from pygments.util import ClassNotFound  # 言語名が見つからないとき
+import argparse  # コマンドライン引数
+import sys  # 進捗の表示先
+
+# 配色（static/pygments.css はこのスタイルから作る）
+HIGHLIGHT_STYLE = "monokai"
+
+# 1回に読み込んで更新する件数（コマンドラインからの一括作成）
+HIGHLIGHT_CHUNK_SIZE = 500
+
+_formatter = HtmlFormatter(cssclass="highlight", style=HIGHLIGHT_STYLE)
+
+
+def highlight_code(code, language):
+    """コードをハイライト済みのHTML（<div class="highlight"><pre>…）にする（コードが空なら None）"""
+    if not code:
+        return None
+    try:
+        lexer = get_lexer_by_name((language or "").strip() or "text", stripnl=False)
+    except ClassNotFound:
+        lexer = TextLexer(stripnl=False)
+    return highlight(code, lexer, _formatter)
+
+
+def ensure_code_html(rows):
+    """code_html が未作成の行に、その場でハイライトしたHTMLを入れる（保存はしない）"""
+    for row in rows:
+        if row.get('code_html') is None and row.get('code_result'):
+            row['code_html'] = highlight_code(row['code_result'], row.get('code_language'))
+    return rows
+
+
+def stylesheet():
+    return _formatter.get_style_defs(".highlight")
+
+
+# ================================
+# 未作成分の一括作成
+# ================================
+def backfill_code_html(chunk_size=HIGHLIGHT_CHUNK_SIZE, progress=None):
+    """code_html が NULL のレコードにハイライト済みのHTMLを保存し、更新件数を返す"""
+    from db import get_connection, notify, RECORDS_CHANNEL  # DB処理用関数
+    from psycopg2.extras import execute_values  # まとめて更新
+
+    updated = 0
+    after_id = 0
+    while True:
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, code_result, code_language
+                FROM records
+                WHERE code_html IS NULL AND code_result <> '' AND id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (after_id, chunk_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+
+            # ハイライト中にコードが変わった行は更新しない（トリガーで NULL に戻っているはずのものを上書きしない）
+            # page_size ごとに分けて実行されるので、件数は cur.rowcount（最後の分だけ）ではなく RETURNING で数える
+            changed = execute_values(cur, """
+                UPDATE records
+                SET code_html = data.code_html
+                FROM (VALUES %s) AS data(id, code_result, code_html)
+                WHERE records.id = data.id AND records.code_result = data.code_result
+                RETURNING records.id
+            """, [(row['id'], row['code_result'], highlight_code(row['code_result'], row['code_language']))
+                  for row in rows], fetch=True)
+            updated += len(changed)
+            if changed:
+                notify(cur, RECORDS_CHANNEL)  # 起動中のアプリの検索結果キャッシュを無効化
+            conn.commit()
+
+        if progress:
+            progress(updated)
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コードのハイライト済みHTMLを作成する")
+    parser.add_argument("--css", action="store_true", help="ハイライト用のCSSを標準出力に出して終了する")
+    parser.add_argument("--chunk-size", type=int, default=HIGHLIGHT_CHUNK_SIZE, help="1回に更新する件数")
+    args = parser.parse_args()
+
+    if args.css:
+        print(stylesheet())
+        return
+
+    updated = backfill_code_html(args.chunk_size,
+                                 progress=lambda n: print(f"\r{n} 件更新", end="", file=sys.stderr))
+    print(f"\n✅ {updated} 件のハイライトを作成しました。", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
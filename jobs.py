@@ -0,0 +1,129 @@
+# ================================
+# バックグラウンドジョブのキュー（PostgreSQL）
+# ================================
+# ChatGPTの呼び出しなど時間のかかる処理をWebのworkerから切り離す。
+# ジョブは assist_jobs テーブルに積み、worker.py のプロセスが
+# SELECT ... FOR UPDATE SKIP LOCKED で1件ずつ取り出して実行する。
+#
+# 状態の遷移:
+#   queued → running → done
+#                    → queued（失敗・再試行待ち）→ ... → dead（再試行の上限）
+#   running のまま JOB_VISIBILITY_TIMEOUT を過ぎたジョブ（workerが落ちた等）は再び取り出される。
+#   実行回数が上限に達していれば、取り出さずに dead にする（last_error は "visibility timeout"）。
+#
+# assist_jobs テーブルは schema.py のマイグレーションで作成する。
+from db import get_connection, notify  # DB処理用関数
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from psycopg2.extras import Json  # ペイロード・結果をjsonbで保存
+import os  # OS関連操作（環境変数など）
+
+load_dotenv()
+
+# ジョブ追加を worker に知らせるチャンネル名
+JOB_CHANNEL = "assist_jobs"
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # 実行回数の上限（超えたら dead）
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))  # 実行中とみなす秒数
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))  # 再試行までの基本秒数（回数ごとに倍）
+
+
+def enqueue(cur, kind, payload, max_attempts=JOB_MAX_ATTEMPTS):
+    """ジョブを追加してIDを返す（呼び出し側のトランザクションのCOMMITで worker に通知される）"""
+    cur.execute("""
+        INSERT INTO assist_jobs (kind, payload, max_attempts)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    """, (kind, Json(payload), max_attempts))
+    job_id = cur.fetchone()['id']
+    notify(cur, JOB_CHANNEL, str(job_id))
+    return job_id
+
+
+def get_job(job_id):
+    """ジョブの状態を返す（なければ None）"""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, kind, payload, status, attempts, max_attempts, result, last_error,
+                   created_at, updated_at
+            FROM assist_jobs
+            WHERE id = %s
+        """, (job_id,))
+        return cur.fetchone()
+
+
+def expire_stale(cur):
+    """実行期限を過ぎた running のジョブのうち、実行回数が上限に達したものを dead にする（件数を返す）"""
+    cur.execute("""
+        UPDATE assist_jobs
+        SET status = 'dead',
+            last_error = 'visibility timeout',
+            locked_until = NULL,
+            updated_at = now()
+        WHERE id IN (
+            SELECT id FROM assist_jobs
+            WHERE status = 'running' AND locked_until < now() AND attempts >= max_attempts
+            FOR UPDATE SKIP LOCKED
+        )
+    """)
+    return cur.rowcount
+
+
+def claim(cur, visibility_timeout=JOB_VISIBILITY_TIMEOUT):
+    """実行できるジョブを1件取り出して running にする（なければ None）
+
+    他のworkerがロック中の行は SKIP LOCKED で飛ばすので、workerを増やしても待ち合わせない。
+    """
+    expire_stale(cur)
+    cur.execute("""
+        UPDATE assist_jobs
+        SET status = 'running',
+            attempts = attempts + 1,
+            locked_until = now() + make_interval(secs => %s),
+            updated_at = now()
+        WHERE id = (
+            SELECT id FROM assist_jobs
+            WHERE (status = 'queued' AND run_at <= now())
+               OR (status = 'running' AND locked_until < now() AND attempts < max_attempts)
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts, max_attempts
+    """, (visibility_timeout,))
+    return cur.fetchone()
+
+
+def complete(cur, job, result):
+    """成功として結果を保存する（期限切れで他のworkerに渡ったジョブなら何もしない）"""
+    cur.execute("""
+        UPDATE assist_jobs
+        SET status = 'done', result = %s, locked_until = NULL, updated_at = now()
+        WHERE id = %s AND status = 'running' AND attempts = %s
+    """, (Json(result), job['id'], job['attempts']))
+    return cur.rowcount == 1
+
+
+def fail(cur, job, error, retry_delay=JOB_RETRY_DELAY):
+    """失敗を記録し、上限までは間隔を空けて再試行、上限に達したら dead にする"""
+    dead = job['attempts'] >= job['max_attempts']
+    delay = retry_delay * (2 ** (job['attempts'] - 1))
+    cur.execute("""
+        UPDATE assist_jobs
+        SET status = %s,
+            last_error = %s,
+            run_at = now() + make_interval(secs => %s),
+            locked_until = NULL,
+            updated_at = now()
+        WHERE id = %s AND status = 'running' AND attempts = %s
+    """, ('dead' if dead else 'queued', str(error), delay, job['id'], job['attempts']))
+    if not dead and cur.rowcount == 1:
+        notify(cur, JOB_CHANNEL, str(job['id']))
+    return dead
+
+
+def job_counts():
+    """状態ごとの件数（管理画面・監視用）"""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT status, count(*) AS count FROM assist_jobs GROUP BY status")
+        return {row['status']: row['count'] for row in cur.fetchall()}
+
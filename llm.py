@@ -0,0 +1,405 @@
+from openai import OpenAI  # OpenAIクライアント
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError  # 要約・コード生成の並列実行用
+import json  # まとめて生成した要約の解析用
+import os  # OS関連操作（環境変数など）
+import queue  # ストリーミング時のトークン受け渡し用
+import time  # タイムアウト計算用
+from llm_cache import llm_cache, LLM_CACHE_ENABLED  # 応答キャッシュ
+import metrics  # 呼び出し時間・トークン数・エラー数の計測
+
+# ================================
+# 環境変数の読み込みとOpenAI初期化
+# ================================
+load_dotenv()
+
+# 呼び出し先（openai: 本物のOpenAI / fake: llm_fake.py の偽物。負荷テスト・オフライン確認用）
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+
+def create_client(backend=LLM_BACKEND):
+    """chat.completions.create を持つクライアントを返す（with_options(timeout=, max_retries=) にも対応）"""
+    if backend == "fake":
+        from llm_fake import FakeOpenAI  # 本番では読み込まない
+        return FakeOpenAI()
+    if backend == "openai":
+        # OPENAI_BASE_URL があればそちらに接続する（python llm_fake.py で起動したサーバーなど）
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    raise ValueError(f"未対応の LLM_BACKEND です: {backend}")
+
+
+client = create_client()
+
+# 使用するモデル
+MODEL = "gpt-3.5-turbo"
+
+# 呼び出しごとのタイムアウト秒数（.envで上書き可能）
+LLM_SUMMARY_TIMEOUT = float(os.getenv("LLM_SUMMARY_TIMEOUT", "20"))
+LLM_CODE_TIMEOUT = float(os.getenv("LLM_CODE_TIMEOUT", "40"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+# 要約とコードを同時に生成するためのスレッドプール（1プロセスあたりの同時呼び出し数の上限）
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "8"))
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm")
+
+# 複数ワードの要約をまとめて生成するときの設定（一括登録・補完用）
+LLM_BATCH_TIMEOUT = float(os.getenv("LLM_BATCH_TIMEOUT", "60"))
+LLM_BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", "20"))  # 1回の呼び出しに含める最大件数
+LLM_BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "3000"))  # 1回の呼び出しの推定トークン数（入力+出力）の上限
+LLM_BATCH_MAX_ROUNDS = int(os.getenv("LLM_BATCH_MAX_ROUNDS", "3"))  # 解析できなかった分を再実行する回数（初回を含む）
+
+# システムプロンプト
+SUMMARY_SYSTEM_PROMPT = "あなたは要点を簡潔に伝える教育アシスタントです。"
+SUMMARY_BATCH_SYSTEM_PROMPT = "あなたは要点を簡潔に伝える教育アシスタントです。必ずJSONオブジェクトだけを返してください。"
+CODE_SYSTEM_PROMPT = "あなたは優秀なプログラミング教師です。"
+
+
+# ================================
+# プロンプトの組み立て
+# ================================
+def build_summary_prompt(word, details):
+    return f"""
+    以下のワードに対して、学習者が一目で理解できるような超簡潔な説明を作ってください（30文字以内）。
+    ワード: {word}
+    説明: {details}
+    """
+
+
+def build_summary_batch_prompt(items):
+    """items: [(番号, ワード, 説明), ...] をまとめて1つのプロンプトにする"""
+    entries = "\n".join(
+        json.dumps({"id": str(key), "word": word, "details": details}, ensure_ascii=False)
+        for key, word, details in items
+    )
+    return f"""
+    以下の各ワードに対して、学習者が一目で理解できるような超簡潔な説明を作ってください（それぞれ30文字以内）。
+    結果は {{"id": "説明", ...}} の形のJSONオブジェクトで、すべての id について返してください。
+    {entries}
+    """
+
+
+def build_code_prompt(word, details, tag):
+    return f"""
+    以下のワードに関連した実用的なコードを1つだけ提案してください。
+    ワード: {word}
+    説明: {details}
+    タグ: {tag}
+    ワード: {word}
+    説明: {details}
+    上記に関連する{tag}言語のコードを1つ提案してください。Markdown形式でコードのみを表示してください。
+    """
+
+
+# ================================
+# コードと言語を抽出する関数
+# ================================
+def extract_code_and_language(raw_code):
+    if raw_code.startswith("```"):  # コードが ``` で始まる場合
+        lines = raw_code.strip().split('\n')
+        language = lines[0].replace("```", "").strip() or "plaintext"  # 言語名取得
+        code = '\n'.join(lines[1:-1])  # コード本体
+    else:
+        language = "plaintext"
+        code = raw_code
+    return language, code
+
+# ================================
+# ChatGPT呼び出し
+# ================================
+# bypass_cache=True のときはキャッシュを読まずに再生成する（結果はキャッシュに上書き保存）
+def _create(prompt, timeout, **params):
+    """OpenAIを呼び出し、時間・トークン数・エラー数を prompt（summary / code など）ごとに記録する
+
+    stream=True のときは受信し終わるまでが呼び出しなので、記録は _stream_complete() で行う。
+    """
+    if params.get("stream"):
+        return client.with_options(timeout=timeout, max_retries=LLM_MAX_RETRIES).chat.completions.create(
+            model=MODEL, **params)
+
+    start = time.perf_counter()
+    try:
+        response = client.with_options(timeout=timeout, max_retries=LLM_MAX_RETRIES).chat.completions.create(
+            model=MODEL, **params)
+    except Exception as e:
+        metrics.LLM_ERRORS.inc(prompt, type(e).__name__)
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, prompt)
+    metrics.observe_llm_usage(prompt, response.usage)
+    return response
+
+
+def _complete(system_prompt, user_prompt, timeout, bypass_cache=False, prompt='other'):
+    key = None
+    if LLM_CACHE_ENABLED:
+        key = llm_cache.make_key(MODEL, system_prompt, user_prompt)
+        if bypass_cache:
+            llm_cache.record_bypass()
+        else:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                return cached
+
+    start = time.monotonic()
+    response = _create(prompt, timeout, messages=[
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ])
+    result = response.choices[0].message.content.strip()
+
+    if key is not None:
+        llm_cache.set(key, MODEL, result, time.monotonic() - start)
+    return result
+
+
+# ChatGPTで要約を生成
+def generate_summary(word, details, timeout=LLM_SUMMARY_TIMEOUT, bypass_cache=False):
+    return _complete(SUMMARY_SYSTEM_PROMPT, build_summary_prompt(word, details), timeout, bypass_cache, 'summary')
+
+
+# ChatGPTでコードを生成（Markdown形式のまま返す）
+def generate_code(word, details, tag, timeout=LLM_CODE_TIMEOUT, bypass_cache=False):
+    return _complete(CODE_SYSTEM_PROMPT, build_code_prompt(word, details, tag), timeout, bypass_cache, 'code')
+
+
+# 要約とコードを同時に生成する
+#   戻り値: (results, errors)
+#     results … {'summary': 要約, 'code': Markdownのコード} のうち成功したもの
+#     errors  … {'summary': 例外, 'code': 例外} のうち失敗したもの
+#   片方が失敗してももう片方の結果は返す。処理時間は遅い方の呼び出し時間になる。
+#   bypass_cache=True のときはキャッシュを使わずに再生成する。
+def generate_assists(word, details, tag, summary=True, code=True, bypass_cache=False):
+    start = time.monotonic()
+    jobs = {}
+
+    if summary:
+        jobs['summary'] = (_executor.submit(generate_summary, word, details, bypass_cache=bypass_cache), LLM_SUMMARY_TIMEOUT)
+    if code:
+        jobs['code'] = (_executor.submit(generate_code, word, details, tag, bypass_cache=bypass_cache), LLM_CODE_TIMEOUT)
+
+    results = {}
+    errors = {}
+    for name, (future, timeout) in jobs.items():
+        # リトライを含めても各呼び出しが自分のタイムアウトを超えないように待つ
+        remaining = max(0.0, start + timeout * (LLM_MAX_RETRIES + 1) - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            errors[name] = TimeoutError(f"{name} の生成が{timeout}秒以内に終わりませんでした。")
+        except Exception as e:
+            errors[name] = e
+
+    return results, errors
+
+
+# ================================
+# 複数ワードの要約をまとめて生成
+# ================================
+# 30文字程度の要約は1回の呼び出しの固定コスト（往復時間・システムプロンプト）が大半を占めるので、
+# 一括登録や補完では複数件を1つのプロンプトにまとめ、JSONで受け取って分割する。
+SUMMARY_OUTPUT_TOKENS = 60  # 1件あたりの出力の見積もり（30文字 + JSONのキー）
+
+
+def estimate_tokens(text):
+    """トークン数のおおまかな見積もり（日本語は1文字≒1トークン、英数字は4文字≒1トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def split_batches(items, max_items=LLM_BATCH_MAX_ITEMS, max_tokens=LLM_BATCH_MAX_TOKENS):
+    """[(番号, ワード, 説明), ...] を件数と推定トークン数の上限で区切る"""
+    base = estimate_tokens(SUMMARY_BATCH_SYSTEM_PROMPT + build_summary_batch_prompt([]))
+    batches = []
+    batch = []
+    used = base
+    for item in items:
+        cost = estimate_tokens(build_summary_batch_prompt([item])) - base + SUMMARY_OUTPUT_TOKENS
+        if batch and (len(batch) >= max_items or used + cost > max_tokens):
+            batches.append(batch)
+            batch = []
+            used = base
+        batch.append(item)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_summary_batch(content, keys):
+    """応答のJSONから {番号: 要約} を取り出す（空・文字列以外・欠けている番号は含めない）"""
+    text = content.strip()
+    if text.startswith("```"):
+        # ```json ... ``` で囲まれて返ってきた場合
+        text = "\n".join(text.split("\n")[1:-1])
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    parsed = {}
+    for key in keys:
+        value = data.get(str(key))
+        if isinstance(value, str) and value.strip():
+            parsed[key] = value.strip()
+    return parsed
+
+
+def _complete_summary_batch(batch, timeout):
+    """1バッチ分を呼び出し、(解析できた {番号: 要約}, 呼び出しにかかった秒数) を返す"""
+    start = time.monotonic()
+    response = _create('summary_batch', timeout, response_format={"type": "json_object"}, messages=[
+        {"role": "system", "content": SUMMARY_BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": build_summary_batch_prompt(batch)}
+    ])
+    content = response.choices[0].message.content or ""
+    return parse_summary_batch(content, [key for key, _, _ in batch]), time.monotonic() - start
+
+
+# 複数の (ワード, 説明) の要約をまとめて生成する
+#   戻り値: (results, errors)
+#     results … {入力の位置: 要約}
+#     errors  … {入力の位置: 例外}
+#   結果は1件ずつ generate_summary() と同じキーでキャッシュするので、
+#   あとから個別に登録・再生成するときもキャッシュが効く。
+#   応答に含まれなかった・解析できなかった項目だけを集め直して再実行する。
+def generate_summaries(items, bypass_cache=False, timeout=LLM_BATCH_TIMEOUT,
+                       max_items=LLM_BATCH_MAX_ITEMS, max_tokens=LLM_BATCH_MAX_TOKENS,
+                       max_rounds=LLM_BATCH_MAX_ROUNDS):
+    results = {}
+    errors = {}
+    cache_keys = {}
+    pending = []
+
+    for index, (word, details) in enumerate(items):
+        if LLM_CACHE_ENABLED:
+            key = llm_cache.make_key(MODEL, SUMMARY_SYSTEM_PROMPT, build_summary_prompt(word, details))
+            cache_keys[index] = key
+            if bypass_cache:
+                llm_cache.record_bypass()
+            else:
+                cached = llm_cache.get(key)
+                if cached is not None:
+                    results[index] = cached
+                    continue
+        pending.append((index, word, details))
+
+    for _ in range(max_rounds):
+        if not pending:
+            break
+
+        futures = [(batch, _executor.submit(_complete_summary_batch, batch, timeout))
+                   for batch in split_batches(pending, max_items, max_tokens)]
+        unparsed = []
+        for batch, future in futures:
+            try:
+                parsed, latency = future.result()
+            except Exception as e:
+                # 呼び出し自体の失敗（タイムアウト・レート制限など）は再実行しない
+                for index, _, _ in batch:
+                    errors[index] = e
+                continue
+
+            for item in batch:
+                index = item[0]
+                if index in parsed:
+                    results[index] = parsed[index]
+                    if index in cache_keys:
+                        llm_cache.set(cache_keys[index], MODEL, parsed[index], latency / len(batch))
+                else:
+                    unparsed.append(item)
+        pending = unparsed
+
+    for index, word, _ in pending:
+        errors[index] = ValueError(f"「{word}」の要約を応答から取り出せませんでした。")
+
+    return results, errors
+
+
+# ================================
+# ストリーミング生成
+# ================================
+def _stream_complete(system_prompt, user_prompt, timeout, bypass_cache, emit, prompt='other'):
+    """トークンを受け取るたびに emit(テキスト片) を呼び、最後に全文を返す"""
+    key = None
+    if LLM_CACHE_ENABLED:
+        key = llm_cache.make_key(MODEL, system_prompt, user_prompt)
+        if bypass_cache:
+            llm_cache.record_bypass()
+        else:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                emit(cached)  # キャッシュにあれば一度に送る
+                return cached
+
+    start = time.monotonic()
+    parts = []
+    try:
+        stream = _create(prompt, timeout, messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ], stream=True, stream_options={"include_usage": True})
+
+        for chunk in stream:
+            # 最後のチャンクにだけ使用トークン数が入る
+            metrics.observe_llm_usage(prompt, getattr(chunk, 'usage', None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                emit(delta)
+    except Exception as e:
+        # 接続エラー・受信途中の切断・タイムアウト
+        metrics.LLM_ERRORS.inc(prompt, type(e).__name__)
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.monotonic() - start, prompt)
+    result = ''.join(parts).strip()
+
+    if key is not None:
+        llm_cache.set(key, MODEL, result, time.monotonic() - start)
+    return result
+
+
+# 要約とコードを同時にストリーミング生成する
+#   (name, event, data) を順に返すジェネレーター
+#     name  … 'summary' または 'code'
+#     event … 'delta'（テキスト片）、'done'（全文）、'error'（エラーメッセージ）
+#   2つの生成は並列に進み、届いた順にトークンが返される。
+def stream_assists(word, details, tag, summary=True, code=True, bypass_cache=False):
+    events = queue.Queue()
+    jobs = {}
+
+    if summary:
+        jobs['summary'] = (SUMMARY_SYSTEM_PROMPT, build_summary_prompt(word, details), LLM_SUMMARY_TIMEOUT)
+    if code:
+        jobs['code'] = (CODE_SYSTEM_PROMPT, build_code_prompt(word, details, tag), LLM_CODE_TIMEOUT)
+
+    def run(name, system_prompt, user_prompt, timeout):
+        try:
+            result = _stream_complete(system_prompt, user_prompt, timeout, bypass_cache,
+                                      lambda delta: events.put((name, 'delta', delta)), name)
+            events.put((name, 'done', result))
+        except Exception as e:
+            events.put((name, 'error', str(e)))
+
+    start = time.monotonic()
+    deadline = start + max((job[2] for job in jobs.values()), default=0) * (LLM_MAX_RETRIES + 1)
+    for name, (system_prompt, user_prompt, timeout) in jobs.items():
+        _executor.submit(run, name, system_prompt, user_prompt, timeout)
+
+    pending = set(jobs)
+    while pending:
+        try:
+            name, event, data = events.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            # 時間内に終わらなかったものはエラー扱いにする
+            for name in pending:
+                yield name, 'error', f"{name} の生成が時間内に終わりませんでした。"
+            return
+        if event != 'delta':
+            pending.discard(name)
+        yield name, event, data
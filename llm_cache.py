@@ -0,0 +1,175 @@
+from collections import OrderedDict  # LRU（最近使った順）管理用
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from db import get_connection  # DB処理用関数
+import hashlib  # キャッシュキーのハッシュ化
+import json  # キー材料のシリアライズ
+import os  # OS関連操作（環境変数など）
+import threading  # 排他制御用
+import time  # TTL・節約時間の計測用
+
+load_dotenv()
+
+# キャッシュの設定（.envで上書き可能）
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 有効期限（秒）
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))  # プロセス内に保持する件数
+LLM_CACHE_DB_MAX_ROWS = int(os.getenv("LLM_CACHE_DB_MAX_ROWS", "50000"))  # DBに保持する件数
+LLM_CACHE_PRUNE_EVERY = int(os.getenv("LLM_CACHE_PRUNE_EVERY", "100"))  # 何回保存するごとにDBを掃除するか
+
+
+# ================================
+# llm_cache テーブルの読み書き（schema.py の実行計画の確認でも使う）
+# ================================
+def lookup_row(cur, key, ttl):
+    """有効期限内の応答を取得して最終利用日時を更新する（なければ None）"""
+    cur.execute("""
+        UPDATE llm_cache SET last_hit_at = now()
+        WHERE key = %s AND created_at > now() - make_interval(secs => %s)
+        RETURNING response, latency, extract(epoch FROM created_at) AS stored_at
+    """, (key, ttl))
+    return cur.fetchone()
+
+
+def store_row(cur, key, model, response, latency):
+    cur.execute("""
+        INSERT INTO llm_cache (key, model, response, latency)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (key) DO UPDATE
+        SET response = EXCLUDED.response, latency = EXCLUDED.latency,
+            created_at = now(), last_hit_at = now()
+    """, (key, model, response, latency))
+
+
+# ================================
+# ChatGPT応答キャッシュ（プロセス内LRU + PostgreSQL）
+# ================================
+class LLMCache:
+    """モデル名・システムプロンプト・ユーザープロンプトのハッシュをキーにした応答キャッシュ
+
+    1段目はプロセス内のLRU、2段目は llm_cache テーブル。
+    どちらも TTL を過ぎたものは使わず、件数の上限を超えたら古いものから消す。
+    DBに接続できない場合はキャッシュなしとして動く（生成そのものは止めない）。
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 db_max_rows=LLM_CACHE_DB_MAX_ROWS, prune_every=LLM_CACHE_PRUNE_EVERY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db_max_rows = db_max_rows
+        self.prune_every = prune_every
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (応答, 生成にかかった秒数, 保存時刻)
+        self._writes = 0
+
+        self._stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "errors": 0,
+            "latency_saved": 0.0,  # キャッシュヒットで省略できた生成時間の合計（秒）
+        }
+
+    @staticmethod
+    def make_key(model, system_prompt, user_prompt):
+        material = json.dumps([model, system_prompt, user_prompt], ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _remember(self, key, response, latency, stored_at):
+        with self._lock:
+            self._memory[key] = (response, latency, stored_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)  # 一番使われていないものから消す
+
+    def get(self, key):
+        """キャッシュされた応答を返す（なければ None）"""
+        now = time.time()
+
+        # 1段目：プロセス内LRU
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, latency, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    self._stats["latency_saved"] += latency
+                    return response
+                del self._memory[key]  # 期限切れ
+
+        # 2段目：PostgreSQL
+        try:
+            with get_connection() as conn, conn.cursor() as cur:
+                row = lookup_row(cur, key, self.ttl)
+                conn.commit()
+        except Exception as e:
+            print("LLMキャッシュ取得エラー:", e)
+            self._count("errors")
+            row = None
+
+        if row is None:
+            self._count("misses")
+            return None
+
+        self._remember(key, row['response'], row['latency'], float(row['stored_at']))
+        with self._lock:
+            self._stats["db_hits"] += 1
+            self._stats["latency_saved"] += row['latency']
+        return row['response']
+
+    def set(self, key, model, response, latency):
+        """生成した応答を保存する（latency は生成にかかった秒数）"""
+        self._remember(key, response, latency, time.time())
+
+        try:
+            with get_connection() as conn, conn.cursor() as cur:
+                store_row(cur, key, model, response, latency)
+
+                with self._lock:
+                    self._writes += 1
+                    prune = self._writes % self.prune_every == 0
+                if prune:
+                    self._prune(cur)
+
+                conn.commit()
+        except Exception as e:
+            print("LLMキャッシュ保存エラー:", e)
+            self._count("errors")
+
+    def _prune(self, cur):
+        # 期限切れと、件数上限を超えた古いものを削除
+        cur.execute("DELETE FROM llm_cache WHERE created_at <= now() - make_interval(secs => %s)", (self.ttl,))
+        cur.execute("""
+            DELETE FROM llm_cache
+            WHERE key IN (
+                SELECT key FROM llm_cache
+                ORDER BY last_hit_at DESC
+                OFFSET %s
+            )
+        """, (self.db_max_rows,))
+
+    def record_bypass(self):
+        self._count("bypasses")
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["db_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+# アプリ全体で共有するキャッシュ
+llm_cache = LLMCache()
@@ -0,0 +1,367 @@
+# ================================
+# ChatGPTの代わりに使うローカルの偽物（負荷テスト・オフライン確認用）
+# ================================
+# LLM_BACKEND=fake のとき、llm.py の client がこの FakeOpenAI になり、OpenAIには接続しない。
+# chat.completions.create のうち、このアプリが使う部分（messages / stream / stream_options /
+# response_format）だけを真似て、要約・Markdownのコード・まとめて生成した要約のJSONを返す。
+#
+#   応答時間   … 対数正規分布（中央値 LLM_FAKE_LATENCY_MEDIAN 秒・ばらつき LLM_FAKE_LATENCY_SIGMA）
+#                 ＋ 出力1トークンごとに LLM_FAKE_TOKEN_SECONDS 秒（ストリーミングではトークンごとに届く）
+#   失敗       … LLM_FAKE_RATE_LIMIT_RATE / LLM_FAKE_SERVER_ERROR_RATE の割合で 429 / 500
+#                 （OpenAIクライアントと同じ RateLimitError / InternalServerError を送出する）
+#   タイムアウト … 応答時間が timeout を超えると、timeout 秒待ってから APITimeoutError
+#   再試行     … with_options(max_retries=...) の回数まで、429・500・タイムアウトを指数バックオフで再試行
+#   トークン数 … 入力・出力を見積もって usage に入れる。合計は stats() で確認できる
+#
+# 別プロセスの本物のOpenAIクライアントから（SDKの再試行処理も含めて）使うときはHTTPサーバーとして起動する:
+#   python llm_fake.py --port 8100
+#   OPENAI_BASE_URL=http://127.0.0.1:8100/v1 gunicorn app:app
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # HTTPサーバーとして動かす場合
+import argparse  # コマンドライン引数
+import httpx  # 例外に付けるリクエスト・レスポンス
+import json  # 要約のJSON・HTTPの本文
+import math  # 対数正規分布
+import openai  # 本物と同じ例外クラス
+import os  # OS関連操作（環境変数など）
+import random  # 応答時間・失敗の抽選
+import re  # プロンプトからワード・タグを取り出す
+import threading  # 集計の排他制御用
+import time  # 応答時間の再現
+import uuid  # 応答ID
+
+load_dotenv()
+
+LLM_FAKE_LATENCY_MEDIAN = float(os.getenv("LLM_FAKE_LATENCY_MEDIAN", "0.8"))  # 最初のトークンまでの秒数の中央値
+LLM_FAKE_LATENCY_SIGMA = float(os.getenv("LLM_FAKE_LATENCY_SIGMA", "0.5"))  # 対数正規分布のσ（0で固定）
+LLM_FAKE_TOKEN_SECONDS = float(os.getenv("LLM_FAKE_TOKEN_SECONDS", "0.01"))  # 出力1トークンあたりの秒数
+LLM_FAKE_RATE_LIMIT_RATE = float(os.getenv("LLM_FAKE_RATE_LIMIT_RATE", "0"))  # 429 を返す割合（0〜1）
+LLM_FAKE_SERVER_ERROR_RATE = float(os.getenv("LLM_FAKE_SERVER_ERROR_RATE", "0"))  # 500 を返す割合（0〜1）
+LLM_FAKE_SEED = os.getenv("LLM_FAKE_SEED")  # 乱数の種（同じ値なら同じ順で遅延・失敗が起きる）
+
+# 再試行の待ち時間（OpenAIクライアントの既定値と同じ 0.5秒から倍々、上限8秒）
+RETRY_INITIAL_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+_REQUEST = httpx.Request("POST", "http://llm-fake.local/v1/chat/completions")
+
+_WORD = re.compile(r"^\s*ワード:\s*(.+)$", re.MULTILINE)
+_TAG = re.compile(r"^\s*タグ:\s*(.+)$", re.MULTILINE)
+
+# コード生成で返す、タグ（言語）ごとのひな形
+CODE_TEMPLATES = {
+    'python': ("python", 'def {name}():\n    """{word} の例"""\n    return "{word}"\n\n\nprint({name}())'),
+    'javascript': ("javascript", 'function {name}() {{\n  // {word} の例\n  return "{word}";\n}}\n\nconsole.log({name}());'),
+    'sql': ("sql", "-- {word} の例\nSELECT '{word}' AS word;"),
+    'html': ("html", "<!-- {word} の例 -->\n<p>{word}</p>"),
+}
+
+
+def count_tokens(text):
+    """トークン数の見積もり（llm.estimate_tokens と同じ基準：日本語は1文字、英数字は4文字で1トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def _split_tokens(text):
+    """ストリーミングで送る単位に分ける（英数字は4文字・日本語は1文字ずつ）"""
+    pieces = []
+    buffer = ""
+    for ch in text:
+        if ord(ch) < 128:
+            buffer += ch
+            if len(buffer) == 4:
+                pieces.append(buffer)
+                buffer = ""
+        else:
+            if buffer:
+                pieces.append(buffer)
+                buffer = ""
+            pieces.append(ch)
+    if buffer:
+        pieces.append(buffer)
+    return pieces
+
+
+# ================================
+# 応答の組み立て
+# ================================
+def _summary(word):
+    return f"{word}：要点を一言で表す用語。"[:30]
+
+
+def _code(word, tag):
+    language, template = CODE_TEMPLATES.get(tag.strip().lower(), CODE_TEMPLATES['python'])
+    name = re.sub(r"\W+", "_", word.lower()).strip("_") or "example"
+    if not name.isascii() or name[0].isdigit():
+        name = "example"
+    return f"```{language}\n{template.format(name=name, word=word)}\n```"
+
+
+def _summary_batch(user_prompt):
+    results = {}
+    for line in user_prompt.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(item, dict) and "id" in item:
+            results[str(item["id"])] = _summary(str(item.get("word", "")))
+    return json.dumps(results, ensure_ascii=False)
+
+
+def build_reply(messages, response_format=None):
+    """プロンプトの種類（まとめて要約・コード・要約）に合わせた応答本文を返す"""
+    user_prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    if (response_format or {}).get("type") == "json_object":
+        return _summary_batch(user_prompt)
+
+    word_match = _WORD.search(user_prompt)
+    word = word_match.group(1).strip() if word_match else user_prompt.strip()[:20]
+    if "Markdown" in user_prompt or "コード" in user_prompt:
+        tag_match = _TAG.search(user_prompt)
+        return _code(word, tag_match.group(1) if tag_match else "python")
+    return _summary(word)
+
+
+# ================================
+# 偽のChatGPT（遅延・失敗・トークン数の管理）
+# ================================
+class FakeLLM:
+    def __init__(self, latency_median=LLM_FAKE_LATENCY_MEDIAN, latency_sigma=LLM_FAKE_LATENCY_SIGMA,
+                 token_seconds=LLM_FAKE_TOKEN_SECONDS, rate_limit_rate=LLM_FAKE_RATE_LIMIT_RATE,
+                 server_error_rate=LLM_FAKE_SERVER_ERROR_RATE, seed=LLM_FAKE_SEED, sleep=time.sleep):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.token_seconds = token_seconds
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'rate_limited': 0, 'server_errors': 0, 'timeouts': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """呼び出し回数・エラー数・トークン数の合計"""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def plan(self, messages, response_format=None):
+        """1回の呼び出しの結果を決める: (エラーのステータス or None, 最初のトークンまでの秒数, 本文, usage)"""
+        with self._lock:
+            latency = self.latency_median
+            if self.latency_sigma > 0:
+                latency = self._random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+            roll = self._random.random()
+        self._count('requests')
+
+        if roll < self.rate_limit_rate:
+            self._count('rate_limited')
+            return 429, latency * 0.1, None, None
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            self._count('server_errors')
+            return 500, latency, None, None
+
+        content = build_reply(messages, response_format)
+        usage = {
+            'prompt_tokens': sum(count_tokens(m.get("content") or "") for m in messages),
+            'completion_tokens': count_tokens(content),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        self._count('prompt_tokens', usage['prompt_tokens'])
+        self._count('completion_tokens', usage['completion_tokens'])
+        return None, latency, content, usage
+
+    def completion(self, model, content, usage):
+        return {
+            'id': f"chatcmpl-fake-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion',
+            'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': usage,
+        }
+
+    def chunks(self, model, content, usage, include_usage):
+        """ストリーミングのチャンク（dict）を、トークンごとの待ち時間を挟みながら返す"""
+        base = {'id': f"chatcmpl-fake-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion.chunk',
+                'created': int(time.time()), 'model': model}
+        yield dict(base, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])
+        for piece in _split_tokens(content):
+            self.sleep(self.token_seconds)
+            yield dict(base, choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}])
+        yield dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if include_usage:
+            yield dict(base, choices=[], usage=usage)
+
+
+def _error(status):
+    response = httpx.Response(status, request=_REQUEST)
+    if status == 429:
+        return openai.RateLimitError("Rate limit reached (fake)", response=response, body=None)
+    return openai.InternalServerError("The server had an error (fake)", response=response, body=None)
+
+
+# ================================
+# OpenAIクライアントの代わり（client.with_options(...).chat.completions.create）
+# ================================
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, messages, stream=False, stream_options=None, response_format=None, **_):
+        return self._owner._create(model, messages, stream, stream_options, response_format)
+
+
+class _Chat:
+    def __init__(self, owner):
+        self.completions = _Completions(owner)
+
+
+class FakeOpenAI:
+    def __init__(self, fake=None, timeout=600.0, max_retries=2):
+        self.fake = fake or FakeLLM()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.chat = _Chat(self)
+
+    def with_options(self, timeout=None, max_retries=None, **_):
+        return FakeOpenAI(self.fake,
+                          self.timeout if timeout is None else timeout,
+                          self.max_retries if max_retries is None else max_retries)
+
+    def _create(self, model, messages, stream, stream_options, response_format):
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk  # 本物と同じ応答の型
+
+        for attempt in range(self.max_retries + 1):
+            status, latency, content, usage = self.fake.plan(messages, response_format)
+            output_seconds = 0 if stream or usage is None else usage['completion_tokens'] * self.fake.token_seconds
+            try:
+                if latency + output_seconds > self.timeout:
+                    self.fake.sleep(self.timeout)
+                    self.fake._count('timeouts')
+                    raise openai.APITimeoutError(request=_REQUEST)
+                self.fake.sleep(latency + output_seconds)
+                if status is not None:
+                    raise _error(status)
+            except (openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError):
+                if attempt == self.max_retries:
+                    raise
+                self.fake.sleep(min(RETRY_INITIAL_DELAY * 2 ** attempt, RETRY_MAX_DELAY))
+                continue
+
+            if stream:
+                include_usage = bool((stream_options or {}).get("include_usage"))
+                return (ChatCompletionChunk.model_validate(chunk)
+                        for chunk in self.fake.chunks(model, content, usage, include_usage))
+            return ChatCompletion.model_validate(self.fake.completion(model, content, usage))
+
+
+# ================================
+# HTTPサーバーとして起動（OPENAI_BASE_URL で向け先を変える）
+# ================================
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.fake.stats())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "fake")
+
+        status, latency, content, usage = self.fake.plan(body.get("messages", []), body.get("response_format"))
+        if status is not None:
+            time.sleep(latency)
+            error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+            self._send_json(status, {'error': {'message': f"fake {status}", 'type': error_type}})
+            return
+
+        if not body.get("stream"):
+            time.sleep(latency + usage['completion_tokens'] * self.fake.token_seconds)
+            self._send_json(200, self.fake.completion(model, content, usage))
+            return
+
+        time.sleep(latency)
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for chunk in self.fake.chunks(model, content, usage, include_usage):
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # クライアントがタイムアウトで切断した
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass  # アクセスログは出さない（負荷テスト中に大量に出るため）
+
+
+def serve(host, port, fake):
+    _Handler.fake = fake
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    print(f"🤖 偽のChatGPTを http://{host}:{port}/v1 で起動しました（集計は /stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(fake.stats(), ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatGPTの代わりに応答するローカルのHTTPサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-median", type=float, default=LLM_FAKE_LATENCY_MEDIAN, help="最初のトークンまでの秒数の中央値")
+    parser.add_argument("--latency-sigma", type=float, default=LLM_FAKE_LATENCY_SIGMA, help="対数正規分布のσ（0で固定）")
+    parser.add_argument("--token-seconds", type=float, default=LLM_FAKE_TOKEN_SECONDS, help="出力1トークンあたりの秒数")
+    parser.add_argument("--rate-limit-rate", type=float, default=LLM_FAKE_RATE_LIMIT_RATE, help="429 を返す割合")
+    parser.add_argument("--server-error-rate", type=float, default=LLM_FAKE_SERVER_ERROR_RATE, help="500 を返す割合")
+    parser.add_argument("--seed", default=LLM_FAKE_SEED, help="乱数の種")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, FakeLLM(args.latency_median, args.latency_sigma, args.token_seconds,
+                                        args.rate_limit_rate, args.server_error_rate, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# ================================
+# 計測（Prometheus形式のメトリクス）
+# ================================
+# エンドポイントごとの処理時間・DBクエリ・接続の取得待ち、ChatGPTの呼び出し、bcrypt の時間を
+# プロセス内で集計し、/metrics から Prometheus のテキスト形式で返す。
+#
+# 値はプロセスごとに持つ（gunicornでは /metrics に応答したworkerの値になる）。
+# 1回の記録はロック1回と数回の加算だけなので、本番でも常に有効にしておける。
+import bisect  # ヒストグラムのバケット探索
+import contextvars  # リクエストごとの集計先
+import threading  # 排他制御用
+import time  # 計測用
+
+# 処理時間用のバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 件数用のバケット（1リクエストあたりのクエリ数など）
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """増えるだけの値（ラベルの組み合わせごと）"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """値の分布（バケットごとの件数・合計・件数）"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # ラベル -> [バケットごとの件数..., 合計, 件数]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for label_values, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(float(state[-2]))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, gauges=None):
+        """テキスト形式で返す（gauges は {名前: (説明, 値)} の、その時点の値）"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"])
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ================================
+# 記録するメトリクス
+# ================================
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "エンドポイントごとの処理時間", ("endpoint", "method", "status"))
+HTTP_REQUEST_DB_QUERIES = registry.histogram(
+    "http_request_db_queries", "1リクエストあたりのDBクエリ数", ("endpoint",), COUNT_BUCKETS)
+HTTP_REQUEST_DB_SECONDS = registry.histogram(
+    "http_request_db_seconds", "1リクエストあたりのDBクエリ時間の合計", ("endpoint",))
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "DBクエリ1回の時間", ("endpoint",))
+DB_ACQUIRE_SECONDS = registry.histogram(
+    "db_connection_acquire_seconds", "プールから接続を借りるまでの時間", ("endpoint",))
+LLM_REQUEST_SECONDS = registry.histogram(
+    "llm_request_duration_seconds", "ChatGPT呼び出しの時間（キャッシュヒットは含まない）", ("prompt",))
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "ChatGPTの使用トークン数", ("prompt", "kind"))
+LLM_ERRORS = registry.counter(
+    "llm_errors_total", "ChatGPT呼び出しのエラー数", ("prompt", "error"))
+BCRYPT_SECONDS = registry.histogram(
+    "bcrypt_duration_seconds", "パスワードのハッシュ化・照合の時間（待ち時間を含む）", ("operation",))
+BCRYPT_REJECTED = registry.counter(
+    "bcrypt_rejected_total", "待ち行列がいっぱいで断ったハッシュ計算の数")
+
+
+# ================================
+# リクエスト単位の集計
+# ================================
+# DBクエリを記録するときに、どのエンドポイントの処理かを引けるようにする
+# （リクエスト外の処理（worker・CLI）は endpoint="none" になる）
+_request = contextvars.ContextVar("metrics_request", default=None)
+
+
+class _RequestState:
+    __slots__ = ("endpoint", "start", "queries", "query_seconds")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+def current_endpoint():
+    state = _request.get()
+    return state.endpoint if state is not None else "none"
+
+
+def start_request(endpoint):
+    _request.set(_RequestState(endpoint or "unknown"))
+
+
+def finish_request(method, status):
+    state = _request.get()
+    if state is None:
+        return
+    _request.set(None)
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - state.start, state.endpoint, method, str(status))
+    HTTP_REQUEST_DB_QUERIES.observe(state.queries, state.endpoint)
+    HTTP_REQUEST_DB_SECONDS.observe(state.query_seconds, state.endpoint)
+
+
+def observe_query(seconds):
+    state = _request.get()
+    if state is not None:
+        state.queries += 1
+        state.query_seconds += seconds
+    DB_QUERY_SECONDS.observe(seconds, state.endpoint if state is not None else "none")
+
+
+def observe_acquire(seconds):
+    DB_ACQUIRE_SECONDS.observe(seconds, current_endpoint())
+
+
+def observe_llm_usage(prompt, usage):
+    """OpenAIの応答の usage（prompt_tokens / completion_tokens）を記録する"""
+    if usage is None:
+        return
+    LLM_TOKENS.inc(prompt, "prompt", amount=usage.prompt_tokens or 0)
+    LLM_TOKENS.inc(prompt, "completion", amount=usage.completion_tokens or 0)
@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor  # ハッシュ計算用の専用スレッド
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+import bcrypt  # パスワードの暗号化・照合に使用
+import metrics  # 計算時間の計測
+import os  # OS関連操作（環境変数など）
+import threading  # 待ち行列の上限管理用
+import time  # 計測用
+
+load_dotenv()
+
+# bcryptの設定（.envで上書き可能）
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # コスト（2^ROUNDS 回の計算）
+BCRYPT_MAX_WORKERS = int(os.getenv("BCRYPT_MAX_WORKERS", str(os.cpu_count() or 1)))  # 同時に計算するスレッド数
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "16"))  # 計算待ちにできる件数
+BCRYPT_TIMEOUT = float(os.getenv("BCRYPT_TIMEOUT", "10"))  # 結果を待つ最大秒数
+
+
+class HashingBusy(Exception):
+    """ハッシュ計算の待ち行列がいっぱいのときの例外（しばらくしてから再試行してもらう）"""
+
+
+# ================================
+# bcrypt専用の実行スレッド
+# ================================
+def _thread_pool(max_workers):
+    """ハッシュ計算用のスレッドプール
+
+    gevent のworker（gunicorn_async_conf.py）では threading がグリーンレットに置き換わっており、
+    そのままでは計算中にイベントループ全体が止まるので、gevent の本物のOSスレッドのプールを使う。
+    """
+    try:
+        from gevent import monkey  # 非同期モードのときだけ入っている
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+
+
+class BcryptExecutor:
+    """bcryptの計算を専用スレッドで実行する（同時実行数と待ち件数に上限あり）
+
+    bcryptはGILを解放して計算するので、スレッド数分のCPUを並列に使える。
+    上限を超えた分は待たせずに HashingBusy を送出し、
+    ログインが集中してもワーカー全体が詰まらないようにする。
+    """
+
+    def __init__(self, max_workers=BCRYPT_MAX_WORKERS, max_queue=BCRYPT_MAX_QUEUE, timeout=BCRYPT_TIMEOUT):
+        self.timeout = timeout
+        self._executor = _thread_pool(max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def run(self, operation, func, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.BCRYPT_REJECTED.inc()
+            raise HashingBusy("パスワード処理が混み合っています。")
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            metrics.BCRYPT_SECONDS.observe(time.perf_counter() - start, operation)
+
+
+_executor = BcryptExecutor()
+
+
+def hash_password(password, rounds=None):
+    """パスワードをハッシュ化して、DBに保存できる文字列で返す"""
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    hashed = _executor.run('hash', bcrypt.hashpw, password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+
+def check_password(password, hashed):
+    """パスワードが保存済みのハッシュと一致するか"""
+    return _executor.run('check', bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_cost(hashed):
+    """ハッシュ文字列（$2b$12$...）に含まれるコストを返す"""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    """現在の設定より低いコストで保存されているか（ログイン成功時に作り直す）"""
+    cost = hash_cost(hashed)
+    return cost is not None and cost < BCRYPT_ROUNDS
@@ -0,0 +1,410 @@
+# ================================
+# スキーマとインデックスの管理（マイグレーション）
+# ================================
+# テーブル・制約・インデックスの定義はすべてここに置く。
+# 適用済みのバージョンは schema_migrations テーブルに記録し、未適用のものだけを順に実行する。
+#
+#   python schema.py migrate              # 未適用のマイグレーションをすべて実行
+#   python schema.py status               # 適用状況を表示
+#   python schema.py check-plans          # 主要なクエリの実行計画を確認（シーケンシャルスキャンの検出）
+#   python schema.py check-plans --seed 20000 --threshold 1000
+#
+# 一度適用したマイグレーションの中身は変更しない（変更は新しいバージョンとして追加する）。
+from collections import defaultdict  # 計画確認用の空の結果行
+from datetime import datetime, timedelta  # 計画確認用のデータ・カーソル
+from db import get_connection, register_record, RECORD_UNIQUE_CONSTRAINT  # DB処理用関数
+import argparse  # コマンドライン引数
+import json  # 実行計画の出力
+import sys  # 終了コード
+
+# 同時に複数のプロセスがマイグレーションを実行しないためのアドバイザリロックのキー
+MIGRATION_LOCK_KEY = 72_100_014
+
+# (バージョン, 名前, SQLのリスト)
+MIGRATIONS = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            is_admin BOOLEAN NOT NULL DEFAULT false
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tag (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS records (
+            id SERIAL PRIMARY KEY,
+            word TEXT NOT NULL,
+            details TEXT,
+            tag_id INTEGER REFERENCES tag (id),
+            summary_result TEXT,
+            code_result TEXT,
+            code_language TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        """,
+        # ログイン時の username 検索（手作業で作られたDBにはすでにある場合がある）
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'users_username_key') THEN
+                ALTER TABLE users ADD CONSTRAINT users_username_key UNIQUE (username);
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    # 登録・編集時の重複判定（ON CONFLICT / 一意制約違反）
+    (2, "records unique word and tag", [
+        f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{RECORD_UNIQUE_CONSTRAINT}') THEN
+                ALTER TABLE records ADD CONSTRAINT {RECORD_UNIQUE_CONSTRAINT} UNIQUE (word, tag_id);
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    (3, "records listing indexes", [
+        # 検索結果の新しい順の並び替えとキーセットページング
+        "CREATE INDEX IF NOT EXISTS records_created_at_id_idx ON records (created_at DESC, id DESC)",
+        # タグでの絞り込み（エクスポート・補完）とタグ削除時の外部キー確認
+        "CREATE INDEX IF NOT EXISTS records_tag_id_id_idx ON records (tag_id, id)",
+        # 更新日時での差分エクスポート
+        "CREATE INDEX IF NOT EXISTS records_updated_at_idx ON records (updated_at)",
+    ]),
+    # 全文検索（search.TS_CONFIG と同じ辞書を使う）と部分一致用のトライグラム
+    (4, "records search index", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """
+        ALTER TABLE records ADD COLUMN IF NOT EXISTS search_document tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(word, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(summary_result, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(details, '')), 'C') ||
+            setweight(to_tsvector('simple', coalesce(code_result, '')), 'D')
+        ) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS records_search_document_idx ON records USING GIN (search_document)",
+        "CREATE INDEX IF NOT EXISTS records_word_trgm_idx ON records USING GIN (word gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS records_details_trgm_idx ON records USING GIN (details gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS records_summary_result_trgm_idx ON records USING GIN (summary_result gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS records_code_result_trgm_idx ON records USING GIN (code_result gin_trgm_ops)",
+    ]),
+    (5, "llm cache", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            latency DOUBLE PRECISION NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_hit_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        # 古いものから削除するときの並び替え
+        "CREATE INDEX IF NOT EXISTS llm_cache_last_hit_at_idx ON llm_cache (last_hit_at)",
+    ]),
+    (6, "assist jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS assist_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            result JSONB,
+            last_error TEXT,
+            run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            locked_until TIMESTAMPTZ,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        # 取り出し対象（待機中・実行期限切れ）だけを小さな部分インデックスにする
+        "CREATE INDEX IF NOT EXISTS assist_jobs_ready_idx ON assist_jobs (run_at, id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS assist_jobs_running_idx ON assist_jobs (locked_until, id) WHERE status = 'running'",
+    ]),
+    (7, "records code html", [
+        # ハイライト済みのコード（highlight.py が登録時に作る。NULL は未作成）
+        "ALTER TABLE records ADD COLUMN IF NOT EXISTS code_html TEXT",
+        # コードか言語が変わったら、古いハイライトを使わないよう NULL に戻す
+        # （同じUPDATEで code_html も書き換えた場合はそのまま）
+        """
+        CREATE OR REPLACE FUNCTION records_reset_code_html() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.code_html IS NOT DISTINCT FROM OLD.code_html THEN
+                NEW.code_html := NULL;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS records_reset_code_html ON records",
+        """
+        CREATE TRIGGER records_reset_code_html
+        BEFORE UPDATE OF code_result, code_language ON records
+        FOR EACH ROW
+        WHEN (NEW.code_result IS DISTINCT FROM OLD.code_result
+              OR NEW.code_language IS DISTINCT FROM OLD.code_language)
+        EXECUTE FUNCTION records_reset_code_html()
+        """,
+    ]),
+]
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def applied_versions(cur):
+    _ensure_migrations_table(cur)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cur.fetchall()}
+
+
+def migrate(target=None, log=print):
+    """未適用のマイグレーションを順に実行する（1バージョンごとに1トランザクション）"""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            _ensure_migrations_table(cur)
+            conn.commit()
+            done = applied_versions(cur)
+
+            for version, name, statements in MIGRATIONS:
+                if version in done or (target is not None and version > target):
+                    continue
+                try:
+                    for sql in statements:
+                        cur.execute(sql)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    log(f"❌ {version:03d} {name} の適用に失敗しました。")
+                    raise
+                log(f"✅ {version:03d} {name}")
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+
+
+def status():
+    """[(バージョン, 名前, 適用済みか), ...]"""
+    with get_connection() as conn, conn.cursor() as cur:
+        done = applied_versions(cur)
+        conn.commit()
+    return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+
+
+# ================================
+# 実行計画の確認（シーケンシャルスキャンの検出）
+# ================================
+# 主要なクエリを EXPLAIN し、行数が threshold を超えるテーブルを Seq Scan で読んでいたら失敗とする。
+# --seed を付けると、同じトランザクション内でダミーデータを追加して ANALYZE してから確認する
+# （最後にロールバックするので、データは残らない）。
+PLAN_CHECK_THRESHOLD = 1000
+
+
+class ExplainCursor:
+    """execute() を EXPLAIN に置き換えて実行計画を集めるカーソル
+
+    アプリのクエリ関数（search_records など）にそのまま渡して、実際と同じSQLの計画を得る。
+    EXPLAIN は ANALYZE なしなので、INSERT / UPDATE も実行されない。
+    """
+
+    rowcount = 0
+
+    def __init__(self, cur):
+        self._cur = cur
+        self.plans = []
+
+    def execute(self, sql, params=None):
+        self._cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        self.plans.append(self._cur.fetchone()['QUERY PLAN'][0]['Plan'])
+
+    def fetchone(self):
+        # 結果を読む関数（search_validator など）が row['count'] のように参照しても止まらないようにする
+        return defaultdict(type(None))
+
+    def fetchall(self):
+        return []
+
+
+def _hot_queries():
+    """(名前, cur を受け取ってクエリを実行する関数[, Seq Scan を許すテーブル]) のリスト"""
+    # migrate / status ではOpenAIの設定がなくても動くよう、確認時にだけ読み込む
+    from backfill import _fetch_missing
+    from export import build_export_query
+    from jobs import claim
+    from llm_cache import lookup_row, store_row, LLM_CACHE_TTL
+    from search import (search_records, search_validator, fetch_record, encode_cursor,
+                        RECORD_LIST_FIELDS)
+
+    now = datetime.now()
+    next_page = encode_cursor([now, 10**9])
+
+    def export_query(tag_id=None, updated_since=None):
+        return lambda cur: cur.execute(*build_export_query(tag_id, updated_since))
+
+    return [
+        ("login: users by username",
+         lambda cur: cur.execute("SELECT * FROM users WHERE username = %s", ("admin",))),
+        ("assist_register_confirm: register_record",
+         lambda cur: register_record(cur, "plan-check", "d", 1, "", "", "", now)),
+        ("assist_edit: record by id",
+         lambda cur: cur.execute("SELECT * FROM records WHERE id = %s", (1,))),
+        ("assist_search: newest first",
+         lambda cur: search_records(cur, "", "partial", [])),
+        ("assist_search: newest first, next page",
+         lambda cur: search_records(cur, "", "partial", [], cursor=next_page)),
+        ("assist_search: newest first by tag",
+         lambda cur: search_records(cur, "", "partial", [], tag_id=1)),
+        ("assist_search: partial match",
+         lambda cur: search_records(cur, "python", "partial", [])),
+        ("assist_search: exact match on word",
+         lambda cur: search_records(cur, "python", "exact", ["search_word"])),
+        ("export: by tag", export_query(tag_id=1)),
+        ("export: updated since", export_query(updated_since=now - timedelta(days=1))),
+        ("assist_search: validator (count / last modified)",
+         lambda cur: search_validator(cur, "", "partial", [], tag_id=1)),
+        ("assist_search: validator, partial match",
+         lambda cur: search_validator(cur, "python", "partial", [])),
+        ("api: records list",
+         lambda cur: search_records(cur, "", "partial", [], columns=list(RECORD_LIST_FIELDS))),
+        ("api: records list, partial match",
+         lambda cur: search_records(cur, "python", "partial", [], columns=list(RECORD_LIST_FIELDS))),
+        ("api: record by id", lambda cur: fetch_record(cur, 1)),
+        # 管理画面の一覧は全件を表示するので、そのテーブルの Seq Scan は問題にしない
+        ("admin: users list",
+         lambda cur: cur.execute("SELECT * FROM users ORDER BY id"), {"users"}),
+        ("admin: tags list",
+         lambda cur: cur.execute("SELECT * FROM tag ORDER BY id"), {"tag"}),
+        ("llm_cache: lookup", lambda cur: lookup_row(cur, "plan-check", LLM_CACHE_TTL)),
+        ("llm_cache: store", lambda cur: store_row(cur, "plan-check", "model", "response", 0.0)),
+        ("backfill: missing summaries", lambda cur: _fetch_missing(cur, 0, 1, 200)),
+        ("worker: claim job", lambda cur: claim(cur)),
+    ]
+
+
+def _seed(cur, rows):
+    """計画確認用のダミーデータを追加して統計を更新する"""
+    cur.execute("INSERT INTO tag (name) SELECT 'plan-check-' || g FROM generate_series(1, 20) g")
+    cur.execute("""
+        INSERT INTO users (username, password)
+        SELECT 'plan-check-' || g, 'x' FROM generate_series(1, %s) g
+    """, (rows,))
+    cur.execute("""
+        INSERT INTO records (word, details, tag_id, summary_result, code_result, code_language, created_at, updated_at)
+        SELECT 'plan-check-' || g, 'details ' || md5(g::text),
+               tags.ids[1 + g %% array_length(tags.ids, 1)],
+               CASE WHEN g %% 10 = 0 THEN '' ELSE 'summary ' || md5(g::text) END,
+               'print(' || g || ')', 'python',
+               now() - g * interval '1 minute', now() - g * interval '1 minute'
+        FROM generate_series(1, %s) g, (SELECT array_agg(id) AS ids FROM tag) tags
+        ON CONFLICT DO NOTHING
+    """, (rows,))
+    cur.execute("""
+        INSERT INTO assist_jobs (kind, payload, status, max_attempts, run_at)
+        SELECT 'plan-check', '{}', CASE WHEN g %% 50 = 0 THEN 'queued' ELSE 'done' END, 3, now()
+        FROM generate_series(1, %s) g
+    """, (rows,))
+    cur.execute("""
+        INSERT INTO llm_cache (key, model, response, latency)
+        SELECT 'plan-check-' || g, 'model', 'response ' || g, 1.0
+        FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    """, (rows,))
+    for table in ("users", "tag", "records", "assist_jobs", "llm_cache"):
+        cur.execute(f"ANALYZE {table}")
+
+
+def _seq_scans(plan, found=None):
+    """実行計画の木から Seq Scan のテーブル名を集める"""
+    found = [] if found is None else found
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        _seq_scans(child, found)
+    return found
+
+
+def check_plans(seed=0, threshold=PLAN_CHECK_THRESHOLD, log=print):
+    """主要なクエリの実行計画を確認し、問題のあったクエリ名のリストを返す"""
+    failures = []
+    with get_connection() as conn, conn.cursor() as cur:
+        try:
+            if seed:
+                _seed(cur, seed)
+
+            cur.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+            table_rows = {row['relname']: row['reltuples'] for row in cur.fetchall()}
+
+            for name, run, *allowed in _hot_queries():
+                allowed = allowed[0] if allowed else set()
+                explain = ExplainCursor(cur)
+                run(explain)
+                scans = [table for plan in explain.plans for table in _seq_scans(plan)]
+                large = [table for table in scans if table_rows.get(table, 0) > threshold and table not in allowed]
+                if large:
+                    failures.append(name)
+                    log(f"❌ {name}: Seq Scan on {', '.join(sorted(set(large)))}")
+                    for plan in explain.plans:
+                        log(json.dumps(plan, ensure_ascii=False, indent=2))
+                else:
+                    log(f"✅ {name}")
+        finally:
+            # ダミーデータは残さない
+            conn.rollback()
+    return failures
+
+
+# ================================
+# コマンドラインからの実行
+# ================================
+def main():
+    parser = argparse.ArgumentParser(description="スキーマのマイグレーションと実行計画の確認")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="未適用のマイグレーションを実行する")
+    migrate_parser.add_argument("--target", type=int, help="このバージョンまで適用する")
+
+    commands.add_parser("status", help="マイグレーションの適用状況を表示する")
+
+    plans_parser = commands.add_parser("check-plans", help="主要なクエリの実行計画を確認する")
+    plans_parser.add_argument("--seed", type=int, default=0, help="確認前に追加するダミーデータの件数（ロールバックされる）")
+    plans_parser.add_argument("--threshold", type=int, default=PLAN_CHECK_THRESHOLD,
+                              help="この行数を超えるテーブルの Seq Scan を失敗とする")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.target)
+    elif args.command == "status":
+        for version, name, applied in status():
+            print(f"{'✅' if applied else '  '} {version:03d} {name}")
+    else:
+        failures = check_plans(args.seed, args.threshold)
+        if failures:
+            print(f"{len(failures)} 件のクエリでシーケンシャルスキャンが見つかりました。")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
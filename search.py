@@ -0,0 +1,325 @@
+from datetime import datetime  # カーソルの日時変換用
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+import base64  # カーソルのエンコード用
+import hashlib  # ETag の計算
+import json  # カーソルのエンコード用
+import os  # OS関連操作（環境変数など）
+
+load_dotenv()
+
+# ================================
+# アシスト検索（全文検索 + トライグラム）
+# ================================
+# records.search_document … ワード・アシスト説明・説明・コードに重みを付けた tsvector（生成列）
+# records.*_trgm_idx       … 部分一致・完全一致用の pg_trgm GINインデックス
+#                            （日本語は単語に分割されないので、部分一致はトライグラムで行う）
+# 生成列とインデックスは schema.py のマイグレーションで作成する。
+
+# 検索対象の項目：フォームのチェックボックス名 -> (カラム名, tsvectorの重み)
+SEARCH_FIELDS = {
+    'search_word': ('word', 'A'),
+    'search_assist': ('summary_result', 'B'),
+    'search_details': ('details', 'C'),
+    'search_code': ('code_result', 'D'),
+}
+
+# 重みごとの関連度の係数（ts_rank の既定値と同じ比率）
+RANK_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+
+# 検索結果として返すカラム（search_document は返さない）
+RECORD_COLUMNS = """
+    records.id, records.word, records.details, records.tag_id,
+    records.summary_result, records.code_result, records.code_language, records.code_html,
+    records.created_at, records.updated_at
+"""
+
+# JSON API（/api/records）の fields= で選べる項目 -> SELECTする式
+RECORD_FIELDS = {
+    'id': 'records.id',
+    'word': 'records.word',
+    'details': 'records.details',
+    'tag_id': 'records.tag_id',
+    'tag_name': 'tag.name',
+    'summary_result': 'records.summary_result',
+    'code_result': 'records.code_result',
+    'code_language': 'records.code_language',
+    'code_html': 'records.code_html',
+    'created_at': 'records.created_at',
+    'updated_at': 'records.updated_at',
+}
+
+# 一覧で fields= を省略したときの項目（大きい details・code_result は含めない）
+RECORD_LIST_FIELDS = ('id', 'word', 'tag_id', 'tag_name', 'summary_result', 'code_language',
+                      'created_at', 'updated_at')
+
+# 1ページあたりの件数（フォームの page_size で変更可能、上限あり）
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+
+# 全文検索用の辞書（日本語の形態素解析は行わないので simple を使う。schema.py の生成列と同じにする）
+TS_CONFIG = 'simple'
+
+def build_search_conditions(keyword, match_type, fields, tag_id=None):
+    """検索条件からWHERE句と並び順（関連度）を組み立てる
+
+    keyword    … 検索キーワード（空なら絞り込まない）
+    match_type … 'exact'（完全一致）または 'partial'（部分一致）
+    fields     … SEARCH_FIELDS のキーのうちチェックされたもの（空なら全項目）
+    tag_id     … タグIDでの絞り込み（None なら絞り込まない）
+
+    戻り値: (where_sql, where_params, rank_sql, rank_params)
+      rank_sql はキーワードがないとき None
+    """
+    where_clauses = []
+    where_params = []
+
+    # タグの絞り込み
+    if tag_id is not None:
+        where_clauses.append("records.tag_id = %s")
+        where_params.append(tag_id)
+
+    if not keyword:
+        return " AND ".join(where_clauses), where_params, None, []
+
+    # 🔽 チェックが一つも入っていなかったら、全対象に対して検索する
+    selected = [name for name in SEARCH_FIELDS if name in fields] or list(SEARCH_FIELDS)
+
+    # 完全一致は = 、部分一致は ILIKE（どちらも pg_trgm のGINインデックスが使われる）
+    match_op = "=" if match_type == "exact" else "ILIKE"
+    keyword_pattern = keyword if match_type == "exact" else f"%{keyword}%"
+
+    keyword_clauses = []
+    for name in selected:
+        column = SEARCH_FIELDS[name][0]
+        keyword_clauses.append(f"records.{column} {match_op} %s")
+        where_params.append(keyword_pattern)
+
+    # 部分一致では全文検索（search_document のGINインデックス）でも拾う
+    #   単語の並びが違っても、キーワードの単語をすべて含むレコードが一致する。
+    #   チェックされた項目だけを対象にするため、tsquery の各単語に項目の重み（'word':A など）を付ける。
+    selected_weights = {SEARCH_FIELDS[name][1] for name in selected}
+    if match_type != "exact":
+        ts_query_sql = f"plainto_tsquery('{TS_CONFIG}', %s)"
+        if len(selected_weights) < len(SEARCH_FIELDS):
+            weights = "".join(sorted(selected_weights))
+            ts_query_sql = (f"to_tsquery('{TS_CONFIG}', regexp_replace({ts_query_sql}::text, "
+                            rf"'''(?:[^'']|'''')*''', '\&:{weights}', 'g'))")
+        keyword_clauses.append(f"records.search_document @@ {ts_query_sql}")
+        where_params.append(keyword)
+
+    # OR 条件でまとめる
+    where_clauses.append(f"({' OR '.join(keyword_clauses)})")
+
+    # 関連度：チェックされた項目だけに重みを付けた全文検索スコア + ワードとの類似度
+    # ts_rank の重み配列は {D, C, B, A} の順
+    rank_weights = [RANK_WEIGHTS[w] if w in selected_weights else 0.0 for w in 'DCBA']
+
+    rank_sql = f"ts_rank(%s::float4[], records.search_document, plainto_tsquery('{TS_CONFIG}', %s))"
+    rank_params = [rank_weights, keyword]
+    if 'search_word' in selected:
+        rank_sql += " + similarity(records.word, %s)"
+        rank_params.append(keyword)
+
+    return " AND ".join(where_clauses), where_params, rank_sql, rank_params
+
+
+def parse_record_fields(value, default=tuple(RECORD_FIELDS)):
+    """'id,word,tag_name' 形式の文字列を項目名のリストにする（空なら default、不明な項目は ValueError）"""
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    if not names:
+        return list(default)
+    unknown = [name for name in names if name not in RECORD_FIELDS]
+    if unknown:
+        raise ValueError(f"不明な項目です: {', '.join(unknown)}")
+    return list(dict.fromkeys(names))  # 重複を除く（順番は指定どおり）
+
+
+def _select_sql(columns):
+    """SELECTする列（columns が None なら全項目）。ページングに使う id・created_at は必ず含める
+
+    code_html は未作成（NULL）のときにその場でハイライトできるよう、コードと言語も一緒に取る。
+    """
+    if columns is None:
+        return f"{RECORD_COLUMNS}, tag.name AS tag_name"
+    extra = ['code_result', 'code_language'] if 'code_html' in columns else []
+    names = dict.fromkeys(list(columns) + ['id', 'created_at'] + extra)
+    return ", ".join(f"{RECORD_FIELDS[name]} AS {name}" for name in names)
+
+
+def parse_search_args(args):
+    """フォーム・クエリ文字列から search_records() の引数を取り出す（タグが数値でなければ ValueError）"""
+    selected_tag = args.get('tag')  # タグによる絞り込み
+    return {
+        'keyword': args.get('keyword'),  # 検索キーワード
+        'match_type': args.get('match_type'),  # 完全一致 or 部分一致
+        'fields': [name for name in SEARCH_FIELDS if name in args],  # 検索対象の項目
+        'tag_id': int(selected_tag) if selected_tag else None,  # 🔄 数値に変換
+        'page_size': clamp_page_size(args.get('page_size')),  # 1ページあたりの件数
+        'cursor': args.get('cursor'),  # ページ送りのカーソル
+        'direction': args.get('direction', 'next'),  # 次へ or 前へ
+    }
+
+
+def clamp_page_size(value):
+    """フォームから受け取ったページサイズを 1〜SEARCH_MAX_PAGE_SIZE に収める"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return SEARCH_PAGE_SIZE
+    return max(1, min(size, SEARCH_MAX_PAGE_SIZE))
+
+
+# ================================
+# キーセットページング用カーソル
+# ================================
+# カーソル … ページ境界の行の並び順キー [関連度(キーワードありのみ), created_at, id] を
+#           URLに載せられる文字列にしたもの
+def encode_cursor(key):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in key]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, with_rank):
+    """不正なカーソルは None（最初のページ扱い）"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if with_rank:
+            rank, created_at, record_id = values
+            return [float(rank), datetime.fromisoformat(created_at), int(record_id)]
+        created_at, record_id = values
+        return [datetime.fromisoformat(created_at), int(record_id)]
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+def _row_key(row, with_rank):
+    key = [row['created_at'], row['id']]
+    return [row['rank']] + key if with_rank else key
+
+
+def search_records(cur, keyword, match_type, fields, tag_id=None,
+                   page_size=SEARCH_PAGE_SIZE, cursor=None, direction='next', columns=None):
+    """条件に一致するレコードを1ページ分返す
+
+    並び順は関連度の高い順（キーワードなしなら新しい順）で、同点は (created_at, id) の降順。
+    OFFSET を使わず、前ページ最後の行のキーより後ろだけを LIMIT 件取得するので、
+    何ページ目でもレコード総数に関係なく同じコストで取得できる。
+
+    cursor    … 前の検索結果で返されたカーソル（None なら最初のページ）
+    direction … 'next'（cursor より後ろ）または 'prev'（cursor より前）
+    columns   … 取得する項目（RECORD_FIELDS のキー。None なら全項目）
+
+    戻り値: (rows, next_cursor, prev_cursor)  次／前のページがないときカーソルは None
+    """
+    where_sql, where_params, rank_sql, rank_params = build_search_conditions(
+        keyword, match_type, fields, tag_id)
+    with_rank = rank_sql is not None
+    backward = direction == 'prev'
+    key = decode_cursor(cursor, with_rank)
+
+    where_clauses = [where_sql] if where_sql else []
+    params = list(where_params)
+
+    # 並び順キー（関連度は式なのでWHERE用にもう一度書く）
+    key_sql = ["records.created_at", "records.id"]
+    if with_rank:
+        key_sql.insert(0, f"({rank_sql})")
+
+    # キーセット条件：降順なので「次」はキーより小さい行、「前」はキーより大きい行
+    if key is not None:
+        placeholders = ["%s::real" if with_rank and i == 0 else "%s" for i in range(len(key))]
+        op = ">" if backward else "<"
+        where_clauses.append(f"({', '.join(key_sql)}) {op} ({', '.join(placeholders)})")
+        if with_rank:
+            params.extend(rank_params)
+        params.extend(key)
+
+    select_rank = f", {rank_sql} AS rank" if with_rank else ""
+    sql = f"""
+        SELECT {_select_sql(columns)}{select_rank}
+        FROM records
+        JOIN tag ON records.tag_id = tag.id
+    """
+    if where_clauses:
+        sql += " WHERE " + " AND ".join(where_clauses)
+
+    # 関連度の高い順 → 新しい順（「前」のページは逆順に取ってから並べ直す）
+    order = "ASC" if backward else "DESC"
+    order_keys = (["rank"] if with_rank else []) + ["records.created_at", "records.id"]
+    sql += " ORDER BY " + ", ".join(f"{k} {order}" for k in order_keys)
+
+    # 1件多く取得して、さらに先のページがあるかを判定する
+    sql += " LIMIT %s"
+
+    cur.execute(sql, tuple(rank_params + params + [page_size + 1]))
+    rows = cur.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backward:
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+
+    first_key = encode_cursor(_row_key(rows[0], with_rank))
+    last_key = encode_cursor(_row_key(rows[-1], with_rank))
+    if backward:
+        return rows, last_key, first_key if has_more else None
+    return rows, last_key if has_more else None, first_key if key is not None else None
+
+
+def fetch_record(cur, record_id, columns=None):
+    """IDで1件取得する（なければ None）"""
+    cur.execute(f"""
+        SELECT {_select_sql(columns)}
+        FROM records
+        JOIN tag ON records.tag_id = tag.id
+        WHERE records.id = %s
+    """, (record_id,))
+    return cur.fetchone()
+
+
+def search_validator(cur, keyword, match_type, fields, tag_id=None):
+    """条件に一致するレコードの (件数, 最終更新日時) を返す（ETag / Last-Modified 用）
+
+    結果の中身は読まないので、検索そのもの（並び替え・関連度・タグの結合）より軽い。
+    """
+    where_sql, where_params, _, _ = build_search_conditions(keyword, match_type, fields, tag_id)
+
+    sql = "SELECT count(*) AS count, max(records.updated_at) AS last_modified FROM records"
+    if where_sql:
+        sql += f" WHERE {where_sql}"
+
+    cur.execute(sql, tuple(where_params))
+    row = cur.fetchone()
+    return row['count'], row['last_modified']
+
+
+def search_etag(filter_key, count, last_modified, tag_names, build_version=None):
+    """検索条件・件数・最終更新日時・タグ名・ビルドのバージョンから ETag の値を作る
+
+    レコードの追加・編集は updated_at、削除は件数、タグ名の変更は tag_names、
+    テンプレート・静的ファイルの変更（デプロイ）は build_version（assets.BUILD_VERSION）で変わる。
+    """
+    material = json.dumps([list(filter_key), count, last_modified.isoformat() if last_modified else None,
+                           sorted(tag_names.items()), build_version], ensure_ascii=False, default=str)
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()
+
+
+def estimate_count(cur, keyword, match_type, fields, tag_id=None):
+    """条件に一致する件数の概算（実行計画の見積もり行数。COUNT(*) のような全件走査をしない）"""
+    where_sql, where_params, _, _ = build_search_conditions(keyword, match_type, fields, tag_id)
+
+    sql = "EXPLAIN (FORMAT JSON) SELECT 1 FROM records JOIN tag ON records.tag_id = tag.id"
+    if where_sql:
+        sql += f" WHERE {where_sql}"
+
+    cur.execute(sql, tuple(where_params))
+    row = cur.fetchone()
+    plan = row['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,141 @@
+from collections import OrderedDict  # LRU（最近使った順）管理用
+from db import listener, notify, RECORDS_CHANNEL  # DB処理用関数
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from search import SEARCH_FIELDS, search_validator  # 検索対象の項目・ETag用の件数と最終更新日時
+import os  # OS関連操作（環境変数など）
+import threading  # 排他制御用
+import time  # TTLの計測用
+
+load_dotenv()
+
+# キャッシュの設定（.envで上書き可能）
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") == "1"
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))  # 有効期限（秒）
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "500"))  # プロセス内に保持する件数
+
+
+# ================================
+# 検索結果のキャッシュ（プロセス内LRU + 世代番号）
+# ================================
+class SearchCache:
+    """検索条件（正規化したもの）をキーにした assist_search の結果キャッシュ
+
+    レコードの登録・編集・削除やタグの変更のたびに notify_records_changed() で世代番号を進める。
+    世代が変わると、それ以前に保存した結果はすべて使われなくなる（全件を消して回らない）。
+    他のworkerでの変更は LISTEN/NOTIFY（records_changed）で届く。
+    LISTEN接続が使えない間は、古い結果を返さないようキャッシュを使わない。
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (世代, 結果, 保存時刻)
+        self._generation = 0
+        self._subscribed = False
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "bypasses": 0}
+
+    @staticmethod
+    def make_key(keyword, match_type, fields, tag_id, page_size, cursor, direction, with_count):
+        """同じ結果になる条件が同じキーになるように正規化する"""
+        keyword = (keyword or '').strip()
+        if keyword:
+            match_type = 'exact' if match_type == 'exact' else 'partial'
+            # チェックなしは全項目と同じ
+            fields = tuple(name for name in SEARCH_FIELDS if name in fields) or tuple(SEARCH_FIELDS)
+        else:
+            # キーワードがなければ一致方法・項目は結果に影響しない
+            match_type = None
+            fields = ()
+        return (keyword, match_type, fields, tag_id, page_size, cursor or None,
+                direction if cursor else None, bool(with_count))
+
+    def invalidate(self, payload=None):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def _is_usable(self):
+        if not self._subscribed:
+            listener.subscribe(RECORDS_CHANNEL, self.invalidate)
+            self._subscribed = True
+        else:
+            listener.ensure_started()
+        return listener.is_listening(RECORDS_CHANNEL)
+
+    def generation(self):
+        """検索を始める前に取得しておき、set() に渡す（検索中の変更を検出する）"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        """キャッシュされた結果を返す（なければ None）"""
+        if not self._is_usable():
+            with self._lock:
+                self._stats["bypasses"] += 1
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, value, stored_at = entry
+                if generation == self._generation and now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key, value, generation):
+        # 通知を受け取れない間の結果は、あとで無効化できないので保存しない
+        if not listener.is_listening(RECORDS_CHANNEL):
+            return
+        with self._lock:
+            # 検索中に変更があった場合は保存しない（古い結果を残さない）
+            if generation != self._generation:
+                return
+            self._entries[key] = (generation, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # 一番使われていないものから消す
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["generation"] = self._generation
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# アプリ全体で共有するキャッシュ
+search_cache = SearchCache()
+
+
+def notify_records_changed(cur):
+    """レコード・タグを変更した同じトランザクション内で呼ぶ（COMMIT時に全workerへ通知される）"""
+    notify(cur, RECORDS_CHANNEL)
+    search_cache.invalidate()
+
+
+def cached_search_validator(cur, keyword, match_type, fields, tag_id=None):
+    """search_validator() の結果（件数, 最終更新日時）を検索結果と同じ世代番号で使い回す
+
+    304 を返すだけのリクエストや、検索結果がキャッシュにあるリクエストで、
+    該当する全行の集計（count / max）を毎回実行しないようにする。
+    ページ送りや件数表示の有無に関係なく同じ値なので、検索条件だけをキーにする。
+    """
+    key = ('validator',) + search_cache.make_key(keyword, match_type, fields, tag_id, None, None, None, False)
+    cached = search_cache.get(key) if SEARCH_CACHE_ENABLED else None
+    if cached is not None:
+        return cached
+
+    generation = search_cache.generation()
+    validator = search_validator(cur, keyword, match_type, fields, tag_id)
+    if SEARCH_CACHE_ENABLED:
+        search_cache.set(key, validator, generation)
+    return validator
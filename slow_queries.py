@@ -0,0 +1,145 @@
+# ================================
+# 遅いクエリの記録
+# ================================
+# db.TimedCursor が SLOW_QUERY_THRESHOLD_MS を超えたクエリをここに記録する。
+# SQLは値を ? に置き換えて正規化し、同じ形のクエリ（フィンガープリント）ごとに集計する。
+# SLOW_QUERY_EXPLAIN_SAMPLE の割合で EXPLAIN (ANALYZE, BUFFERS) の結果も保存する（副作用のある関数を呼ばないSELECTのみ）。
+#
+# 集計はプロセスごと（/admin/slow_queries に応答したworkerの内容が表示される）。
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+import hashlib  # フィンガープリント
+import os  # OS関連操作（環境変数など）
+import random  # EXPLAIN のサンプリング
+import re  # SQLの正規化
+import threading  # 排他制御用
+import time  # 記録時刻
+
+load_dotenv()
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))  # これより遅いクエリを記録（0以下で無効）
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))  # EXPLAIN ANALYZE を取る割合（0〜1）
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "200"))  # 保持する種類の上限
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*")
+_COMMENT = re.compile(r"--[^\n]*")
+_SPACES = re.compile(r"\s+")
+# 実行し直すと状態が変わる関数・構文（ロック・通知・シーケンス・設定・SELECT INTO）
+_SIDE_EFFECTS = re.compile(
+    r"\b(?:pg_(?:try_)?advisory_\w+|pg_notify|nextval|setval|set_config|pg_sleep\w*"
+    r"|pg_(?:cancel|terminate)_backend|lo_\w+|dblink\w*)\s*\(|\bINTO\b",
+    re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """値を ? に置き換え、空白をまとめたSQL（同じ形のクエリは同じ文字列になる）"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _VALUE_LIST.sub("(?...)", sql)  # IN (?, ?, ?) や複数行の VALUES は件数によらず同じにする
+    return _SPACES.sub(" ", sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def _shape(value):
+    if value is None:
+        return "None"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def params_shape(params):
+    """パラメータの型と件数だけを返す（値そのものは記録しない）"""
+    if params is None:
+        return ""
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {_shape(value)}" for key, value in params.items()) + "}"
+    if isinstance(params, (list, tuple)):
+        return "(" + ", ".join(_shape(value) for value in params) + ")"
+    return _shape(params)
+
+
+def is_explainable(normalized):
+    """EXPLAIN ANALYZE で実行し直しても安全な（データを変更しない）クエリか
+
+    副作用のある関数を呼ぶSELECTも除く。pg_advisory_lock などはセッション単位なので、
+    EXPLAIN 後のセーブポイントのロールバックでは元に戻らない。
+
+    >>> is_explainable("SELECT pg_advisory_lock($1)")
+    False
+    >>> is_explainable("SELECT id, word FROM records WHERE tag_id = ? ORDER BY id LIMIT ?")
+    True
+    """
+    head = normalized.lstrip("( ").upper()
+    if not head.startswith(("SELECT", "WITH")):
+        return False
+    if _SIDE_EFFECTS.search(normalized):
+        return False
+    return not re.search(r"\b(INSERT|UPDATE|DELETE|FOR UPDATE|FOR SHARE)\b", normalized, re.IGNORECASE)
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=SLOW_QUERY_THRESHOLD_MS, explain_sample=SLOW_QUERY_EXPLAIN_SAMPLE,
+                 max_fingerprints=SLOW_QUERY_MAX_FINGERPRINTS):
+        self.threshold = threshold_ms / 1000.0
+        self.explain_sample = explain_sample
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._entries = {}  # フィンガープリント -> 集計
+
+    def is_slow(self, seconds):
+        return self.threshold > 0 and seconds >= self.threshold
+
+    def should_explain(self, normalized):
+        return self.explain_sample > 0 and random.random() < self.explain_sample and is_explainable(normalized)
+
+    def record(self, normalized, params, seconds, endpoint, plan=None):
+        key = fingerprint(normalized)
+        shape = params_shape(params)
+        print(f"遅いクエリ（{seconds * 1000:.1f}ms / {endpoint}）: {normalized} params={shape}")
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    # 合計時間が一番少ないものを捨てる
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k]['total'])]
+                entry = self._entries[key] = {
+                    'fingerprint': key, 'sql': normalized, 'count': 0, 'total': 0.0, 'max': 0.0,
+                    'params': {}, 'endpoints': {}, 'plan': None, 'last_seen': 0.0,
+                }
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['params'][shape] = entry['params'].get(shape, 0) + 1
+            entry['endpoints'][endpoint] = entry['endpoints'].get(endpoint, 0) + 1
+            entry['last_seen'] = time.time()
+            if plan is not None:
+                entry['plan'] = plan
+
+    def top(self, limit=50, order='total'):
+        """集計結果を order（total / max / count）の大きい順に返す"""
+        with self._lock:
+            entries = [dict(entry, params=dict(entry['params']), endpoints=dict(entry['endpoints']))
+                       for entry in self._entries.values()]
+        for entry in entries:
+            entry['avg'] = entry['total'] / entry['count']
+        entries.sort(key=lambda entry: entry[order], reverse=True)
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# アプリ全体で共有する記録
+slow_query_log = SlowQueryLog()
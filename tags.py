@@ -0,0 +1,92 @@
+from db import get_connection, listener, notify  # DB処理用関数
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+import os  # OS関連操作（環境変数など）
+import threading  # 排他制御用
+import time  # 読み込み時刻の記録用
+
+load_dotenv()
+
+# タグ変更を通知するチャンネル名
+TAG_CHANNEL = "tag_catalogue"
+
+# LISTEN接続が使えないときにキャッシュを信用する秒数
+TAG_CACHE_FALLBACK_TTL = float(os.getenv("TAG_CACHE_FALLBACK_TTL", "30"))
+
+
+# ================================
+# タグ一覧のキャッシュ
+# ================================
+class TagCatalogue:
+    """tagテーブルの内容をプロセス内に保持するキャッシュ
+
+    ・tag_list … [{'id': 1, 'name': 'Python'}, ...]（id順）
+    ・by_id    … {'1': 'Python', ...}（フォームの値がそのまま引けるよう文字列のID）
+    ・by_name  … {'python': 1, ...}（小文字のタグ名 -> ID）
+
+    タグの追加・編集・削除時に notify_tags_changed() を呼ぶと、
+    LISTEN/NOTIFY で全workerのキャッシュが捨てられ、次のアクセスで読み直される。
+    """
+
+    def __init__(self, fallback_ttl=TAG_CACHE_FALLBACK_TTL):
+        self.fallback_ttl = fallback_ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._version = 0  # 無効化のたびに増える（読み込み中の無効化を検出する）
+        self._subscribed = False
+
+    def invalidate(self, payload=None):
+        with self._lock:
+            self._snapshot = None
+            self._version += 1
+
+    def _is_fresh(self):
+        if self._snapshot is None:
+            return False
+        # 通知を受け取れていない間は一定時間で読み直す
+        return listener.is_listening(TAG_CHANNEL) or time.monotonic() - self._loaded_at < self.fallback_ttl
+
+    def get(self):
+        """{'tag_list': [...], 'by_id': {...}, 'by_name': {...}} を返す"""
+        if not self._subscribed:
+            listener.subscribe(TAG_CHANNEL, self.invalidate)
+            self._subscribed = True
+        else:
+            listener.ensure_started()
+
+        with self._lock:
+            if self._is_fresh():
+                return self._snapshot
+            version = self._version
+
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT id, name FROM tag ORDER BY id")
+            tag_list = [{'id': row['id'], 'name': row['name']} for row in cur.fetchall()]
+
+        snapshot = {
+            'tag_list': tag_list,
+            'by_id': {str(tag['id']): tag['name'] for tag in tag_list},
+            'by_name': {tag['name'].lower(): tag['id'] for tag in tag_list},
+        }
+
+        with self._lock:
+            # 読み込み中に無効化された場合は保存しない（古い内容を残さない）
+            if self._version == version:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return snapshot
+
+
+# アプリ全体で共有するキャッシュ
+tag_catalogue = TagCatalogue()
+
+
+def get_tags():
+    """キャッシュされたタグ一覧を返す"""
+    return tag_catalogue.get()
+
+
+def notify_tags_changed(cur):
+    """タグを変更した同じトランザクション内で呼ぶ（COMMIT時に全workerへ通知される）"""
+    notify(cur, TAG_CHANNEL)
+    tag_catalogue.invalidate()
@@ -0,0 +1,174 @@
+# ================================
+# バックグラウンドジョブのworker
+# ================================
+# assist_jobs テーブルのジョブを取り出して実行する。Webサーバーとは別に起動する。
+#
+#   python worker.py                 # 既定数のプロセスで実行
+#   python worker.py --processes 4
+#
+# 新しいジョブは LISTEN/NOTIFY で即座に受け取り、通知を取りこぼしても
+# JOB_POLL_INTERVAL 秒ごとにテーブルを確認する。
+from db import DATABASE_URL, DB_SSLMODE, get_connection  # DB処理用関数
+from dotenv import load_dotenv  # .envから環境変数を読み込む
+from jobs import JOB_CHANNEL, claim, complete, fail  # ジョブキュー
+from highlight import highlight_code  # コードのハイライト
+from llm import generate_assists, extract_code_and_language  # ChatGPT呼び出し用
+import argparse  # コマンドライン引数
+import multiprocessing  # workerプロセスの起動
+import os  # OS関連操作（環境変数など）
+import psycopg2  # LISTEN用の接続
+import select  # 通知待ち
+import signal  # 停止シグナルの処理
+import time  # 再接続待ち
+
+load_dotenv()
+
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "2"))  # 起動するプロセス数
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))  # 通知がなくてもテーブルを見る間隔
+
+# 停止要求（シグナルハンドラからはフラグを立てるだけにする）
+_stopping = False
+
+
+def _request_stop(*_):
+    global _stopping
+    _stopping = True
+
+
+# ================================
+# ジョブの種類ごとの処理
+# ================================
+def run_assist_generate(payload, job):
+    """アシスト（要約・コード）を生成して確認画面に渡す形で返す
+
+    一部だけ失敗した場合は再試行する（成功した方はLLMキャッシュに残っているので再度は呼ばれない）。
+    最後の試行では、成功した分だけでも結果として返す。
+    """
+    results, errors = generate_assists(payload['word'], payload['details'], payload['tag'],
+                                       summary=payload.get('summary', True),
+                                       code=payload.get('code', True),
+                                       bypass_cache=payload.get('bypass_cache', False) and job['attempts'] == 1)
+    last_attempt = job['attempts'] >= job['max_attempts']
+    if errors and (not results or not last_attempt):
+        raise RuntimeError("; ".join(f"{name}: {e}" for name, e in errors.items()))
+
+    result = {'summary_result': results.get('summary', ''), 'code_result': '', 'code_language': '',
+              'errors': {name: str(e) for name, e in errors.items()}}
+    if 'code' in results:
+        result['code_language'], result['code_result'] = extract_code_and_language(results['code'])
+        result['code_html'] = highlight_code(result['code_result'], result['code_language'])
+    return result
+
+
+# ジョブの種類 → 処理関数（payload, job を受け取り、結果の辞書を返す）
+HANDLERS = {
+    'assist_generate': run_assist_generate,
+}
+
+
+def run_one(handlers=HANDLERS):
+    """ジョブを1件実行する（実行するジョブがなければ False）"""
+    with get_connection() as conn, conn.cursor() as cur:
+        job = claim(cur)
+        conn.commit()  # running にしたことを確定し、ロックを外してから処理する
+
+    if job is None:
+        return False
+
+    try:
+        handler = handlers[job['kind']]
+        result = handler(job['payload'], job)
+    except Exception as e:
+        with get_connection() as conn, conn.cursor() as cur:
+            dead = fail(cur, job, e)
+            conn.commit()
+        print(f"ジョブ失敗（id={job['id']} / {job['attempts']}回目{' / dead' if dead else ''}）:", e)
+        return True
+
+    with get_connection() as conn, conn.cursor() as cur:
+        if not complete(cur, job, result):
+            print(f"ジョブの結果を保存できませんでした（id={job['id']}：実行期限切れ）")
+        conn.commit()
+    return True
+
+
+def _listen():
+    """ジョブ追加の通知を受け取る専用接続（失敗したら None でポーリングのみ）"""
+    try:
+        conn = psycopg2.connect(DATABASE_URL, sslmode=DB_SSLMODE)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {JOB_CHANNEL}")
+        return conn
+    except Exception as e:
+        print("LISTEN接続エラー:", e)
+        return None
+
+
+def worker_loop(should_stop=lambda: _stopping, handlers=HANDLERS, poll_interval=JOB_POLL_INTERVAL):
+    """ジョブがある限り実行し、なくなったら通知かポーリング間隔まで待つ"""
+    listen_conn = None
+
+    while not should_stop():
+        try:
+            if run_one(handlers):
+                continue
+        except Exception as e:
+            print("ジョブ取得エラー:", e)
+            time.sleep(poll_interval)
+            continue
+
+        if listen_conn is None or listen_conn.closed:
+            listen_conn = _listen()
+        if listen_conn is None:
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            if select.select([listen_conn], [], [], poll_interval)[0]:
+                listen_conn.poll()
+                listen_conn.notifies.clear()
+        except Exception as e:
+            print("LISTEN接続エラー:", e)
+            listen_conn.close()
+
+    if listen_conn is not None and not listen_conn.closed:
+        listen_conn.close()
+
+
+def _child_main():
+    # 停止は親プロセスが SIGTERM で伝え、実行中のジョブを終えてから抜ける
+    # （Ctrl+C はプロセスグループ全体に届くので子では無視する）
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _request_stop)
+    worker_loop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アシスト生成などのバックグラウンドジョブを実行する")
+    parser.add_argument("--processes", type=int, default=JOB_WORKER_PROCESSES, help="workerプロセス数")
+    args = parser.parse_args()
+
+    processes = [multiprocessing.Process(target=_child_main, name=f"job-worker-{i}")
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    print(f"workerを {args.processes} プロセスで起動しました。")
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    try:
+        while not _stopping and any(process.is_alive() for process in processes):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # 実行中のジョブは終わるまで待つ
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()